@@ -0,0 +1,6 @@
+"""
+AI Portrait Generator - pacote de linha de comando e biblioteca
+
+A interface Streamlit continua em `src/main.py`; este pacote expõe a geração
+sem depender do Streamlit (ver `ai_portrait_generator.main`).
+"""
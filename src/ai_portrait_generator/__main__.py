@@ -0,0 +1,5 @@
+"""Permite executar `python -m ai_portrait_generator`"""
+
+from ai_portrait_generator.main import main
+
+raise SystemExit(main())
@@ -0,0 +1,362 @@
+"""
+Linha de comando para gerar imagens sem a interface Streamlit
+
+    ai-portrait generate "retrato de uma astronauta" --model "DALL-E 3" -o saida/
+    ai-portrait batch prompts.jsonl saida/ --workers 8
+    ai-portrait benchmark "retrato" --requests 20 --concurrency 4 --compare-modes
+    ai-portrait startup --budget-ms 100
+
+Os módulos de geração (e, por tabela, `openai`, `replicate`, `requests` e
+`PIL`) só são importados pelo subcomando que precisa deles, para que
+execuções agendadas (cron) comecem em milissegundos.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Orçamento de tempo de importação do caminho de geração, em milissegundos
+CLI_IMPORT_BUDGET_MS = float(os.getenv("CLI_IMPORT_BUDGET_MS", "100"))
+
+# Módulos que importamos antes da primeira chamada a um provedor
+STARTUP_MODULES = ["ai_portrait_generator.main", "generators.image_generator", "generators.batch"]
+
+# Módulos pesados que não podem ser carregados na inicialização
+LAZY_MODULES = ["streamlit", "openai", "replicate", "PIL", "requests", "httpx"]
+
+DEFAULT_MODEL = "DALL-E 3"
+
+
+def _load_env():
+    """Carrega o `.env` como a aplicação Streamlit (se python-dotenv existir)"""
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+
+def _print_json(data: Any):
+    print(json.dumps(data, indent=2, ensure_ascii=False), flush=True)
+
+
+def _add_generation_args(parser: argparse.ArgumentParser):
+    parser.add_argument("prompt", help="Descrição da imagem")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Modelo de IA")
+    parser.add_argument("--size", default="1024x1024", help="Tamanho da imagem")
+    parser.add_argument("--quality", default="hd", help="Qualidade (DALL-E 3)")
+    parser.add_argument("--style", default="vivid", help="Estilo (DALL-E 3)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed (Stability/Replicate)")
+    parser.add_argument("--no-cache", action="store_true", help="Ignora o cache de resultados")
+
+
+def _generation_kwargs(args: argparse.Namespace) -> Dict[str, Any]:
+    from generators.clients import get_env_api_keys
+    from generators.image_generator import get_provider
+
+    return {
+        "prompt": args.prompt,
+        "model": args.model,
+        "api_key": get_env_api_keys().get(get_provider(args.model)) or "",
+        "quality": args.quality,
+        "size": args.size,
+        "style": args.style,
+        "seed": args.seed,
+        "use_cache": not args.no_cache,
+    }
+
+
+def cmd_generate(args: argparse.Namespace) -> int:
+    """Gera imagens para um prompt e grava os arquivos no diretório de saída"""
+
+    from generators.image_generator import generate_image
+    from utils.transcode import detect_format, mime_for
+
+    started = time.perf_counter()
+    result = generate_image(num_images=args.num_images, **_generation_kwargs(args))
+
+    out = Path(args.output_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    files = []
+    for index, image in enumerate(result.get("images", []), start=1):
+        path = out / f"{stamp}_{index}.{mime_for(detect_format(image))[1]}"
+        path.write_bytes(image)
+        files.append(str(path))
+
+    _print_json({
+        "success": result["success"],
+        "error": result.get("error"),
+        "cached": bool(result.get("cached")),
+        "files": files,
+        "latency": round(time.perf_counter() - started, 3),
+    })
+    return 0 if result["success"] else 1
+
+
+def cmd_batch(args: argparse.Namespace) -> int:
+    """Executa um lote de prompts (mesmo comportamento de `generators.batch`)"""
+
+    from generators.batch import batch_succeeded, describe_row, run_batch
+
+    def report(entry: Dict[str, Any]):
+        print(describe_row(entry), file=sys.stderr, flush=True)
+
+    summary = run_batch(
+        args.prompt_file,
+        args.output_dir,
+        max_workers=args.workers,
+        use_cache=not args.no_cache,
+        on_row_done=report,
+    )
+    _print_json(summary)
+    return 0 if batch_succeeded(summary) else 1
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+def run_benchmark(
+    kwargs: Dict[str, Any],
+    requests: int,
+    concurrency: int,
+    num_images: int = 1,
+    same_prompt: bool = False,
+    warmup: int = 1,
+) -> Dict[str, Any]:
+    """
+    Dispara o mesmo pedido várias vezes e mede vazão, latência e memória
+
+    Args:
+        kwargs: Argumentos de `generate_image` (sem `num_images`)
+        requests: Total de requisições
+        concurrency: Requisições simultâneas
+        num_images: Imagens por requisição
+        same_prompt: Repete o prompt exato (senão numera para fugir do cache)
+        warmup: Requisições iniciais fora da medição (importações, conexões)
+
+    Returns:
+        Dict com contagens, vazão, percentis de latência e o pico de memória
+        alocada pelo Python (`tracemalloc`) durante a execução
+    """
+
+    import tracemalloc
+    from concurrent.futures import ThreadPoolExecutor
+
+    from generators.image_generator import generate_image
+
+    def run(index: int) -> Dict[str, Any]:
+        started = time.perf_counter()
+        prompt = kwargs["prompt"] if same_prompt else f"{kwargs['prompt']} #{index}"
+        result = generate_image(**dict(kwargs, prompt=prompt), num_images=num_images)
+        return {"success": result["success"], "latency": time.perf_counter() - started}
+
+    for index in range(warmup):
+        run(-1 - index)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            runs = list(executor.map(run, range(requests)))
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = [r["latency"] for r in runs if r["success"]]
+    return {
+        "model": kwargs["model"],
+        "requests": requests,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "failed": len(runs) - len(latencies),
+        "elapsed": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "latency_p50": _percentile(latencies, 0.50),
+        "latency_p95": _percentile(latencies, 0.95),
+        "latency_p99": _percentile(latencies, 0.99),
+        "peak_python_mb": round(peak / (1024 * 1024), 2),
+    }
+
+
+def cmd_benchmark(args: argparse.Namespace) -> int:
+    """Mede vazão e latência de um modelo (e compara os modos de retorno)"""
+
+    from generators.capabilities import RESPONSE_MODE_CHOICES, RESPONSE_MODES
+    from generators.image_generator import get_provider
+
+    kwargs = _generation_kwargs(args)
+    provider = get_provider(args.model)
+    modes = RESPONSE_MODE_CHOICES.get(provider, ()) if args.compare_modes else ()
+
+    if not modes:
+        report = run_benchmark(kwargs, args.requests, args.concurrency, args.num_images, args.same_prompt, args.warmup)
+        report["response_mode"] = RESPONSE_MODES.get(provider)
+        _print_json(report)
+        return 0 if report["failed"] == 0 else 1
+
+    reports = []
+    configured = RESPONSE_MODES[provider]
+    try:
+        for mode in modes:
+            RESPONSE_MODES[provider] = mode
+            report = run_benchmark(kwargs, args.requests, args.concurrency, args.num_images, args.same_prompt, args.warmup)
+            report["response_mode"] = mode
+            reports.append(report)
+    finally:
+        RESPONSE_MODES[provider] = configured
+
+    _print_json(reports)
+    return 0 if all(report["failed"] == 0 for report in reports) else 1
+
+
+def measure_startup(modules: List[str] = STARTUP_MODULES) -> Dict[str, Any]:
+    """
+    Mede o tempo de importação com `python -X importtime` em um processo novo
+
+    Returns:
+        Tempo (ms) dos módulos do projeto, tempo total de importação e os
+        módulos de `LAZY_MODULES` que foram carregados indevidamente
+    """
+
+    package_root = str(Path(__file__).resolve().parent.parent)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_root, env.get("PYTHONPATH")]))
+
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Linhas no formato "import time: <self us> | <cumulativo us> | <módulo>";
+    # a indentação do nome indica aninhamento
+    top_level: Dict[str, int] = {}
+    loaded = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        loaded.add(name.strip())
+        if not name[1:].startswith(" "):
+            top_level[name.strip()] = int(cumulative)
+
+    project_prefixes = tuple(m.split(".")[0] for m in modules)
+    project_us = sum(
+        us for name, us in top_level.items() if name.split(".")[0] in project_prefixes
+    )
+    return {
+        "modules": modules,
+        "project_ms": round(project_us / 1000, 1),
+        "total_ms": round(sum(top_level.values()) / 1000, 1),
+        "eager_heavy_imports": sorted(m for m in LAZY_MODULES if m in loaded),
+    }
+
+
+def cmd_startup(args: argparse.Namespace) -> int:
+    """Verifica o tempo de importação contra o orçamento"""
+
+    report = measure_startup()
+    report["budget_ms"] = args.budget_ms
+    report["within_budget"] = report["project_ms"] <= args.budget_ms and not report["eager_heavy_imports"]
+    _print_json(report)
+    return 0 if report["within_budget"] else 1
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    """Exporta o histórico de um usuário para um arquivo zip/tar"""
+
+    from utils.archive import export_archive
+
+    fmt = args.format or ("tar" if args.output.endswith(".tar") else "zip")
+    with open(args.output, "wb") as f:
+        counts = export_archive(f, args.user, fmt)
+    _print_json({"output": args.output, "format": fmt, **counts})
+    return 0
+
+
+def cmd_import(args: argparse.Namespace) -> int:
+    """Importa um arquivo exportado para o histórico de um usuário"""
+
+    from utils.archive import import_archive
+
+    with open(args.archive, "rb") as f:
+        result = import_archive(f, args.user)
+    _print_json(result)
+    return 1 if result["error"] else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="ai-portrait", description="AI Portrait Generator sem interface")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="Gera imagens para um prompt")
+    _add_generation_args(generate)
+    generate.add_argument("-n", "--num-images", type=int, default=1, help="Número de imagens")
+    generate.add_argument("-o", "--output-dir", default=".", help="Diretório de saída")
+    generate.set_defaults(func=cmd_generate)
+
+    batch = subparsers.add_parser("batch", help="Gera um lote a partir de um arquivo JSONL/CSV")
+    batch.add_argument("prompt_file", help="Arquivo de prompts (.jsonl ou .csv)")
+    batch.add_argument("output_dir", help="Diretório de saída")
+    batch.add_argument("--workers", type=int, default=None, help="Linhas simultâneas")
+    batch.add_argument("--no-cache", action="store_true", help="Ignora o cache de resultados")
+    batch.set_defaults(func=cmd_batch)
+
+    benchmark = subparsers.add_parser("benchmark", help="Mede vazão e latência de um provedor")
+    _add_generation_args(benchmark)
+    benchmark.add_argument("-n", "--num-images", type=int, default=1, help="Imagens por requisição")
+    benchmark.add_argument("--requests", type=int, default=10, help="Total de requisições")
+    benchmark.add_argument("--concurrency", type=int, default=4, help="Requisições simultâneas")
+    benchmark.add_argument("--same-prompt", action="store_true", help="Repete o prompt exato")
+    benchmark.add_argument("--warmup", type=int, default=1, help="Requisições fora da medição")
+    benchmark.add_argument(
+        "--compare-modes", action="store_true", help="Roda uma vez por modo de retorno do provedor"
+    )
+    benchmark.set_defaults(func=cmd_benchmark)
+
+    startup = subparsers.add_parser("startup", help="Mede o tempo de importação (-X importtime)")
+    startup.add_argument("--budget-ms", type=float, default=CLI_IMPORT_BUDGET_MS, help="Orçamento em ms")
+    startup.set_defaults(func=cmd_startup)
+
+    export = subparsers.add_parser("export", help="Exporta o histórico (imagens + metadados) em fluxo")
+    export.add_argument("output", help="Arquivo de saída (.zip ou .tar)")
+    export.add_argument("--user", required=True, help="Dono do histórico (parâmetro ?u= da URL)")
+    export.add_argument("--format", choices=["zip", "tar"], help="Formato (padrão: pela extensão)")
+    export.set_defaults(func=cmd_export)
+
+    import_ = subparsers.add_parser("import", help="Importa um arquivo exportado em fluxo")
+    import_.add_argument("archive", help="Arquivo .zip ou .tar")
+    import_.add_argument("--user", required=True, help="Dono do histórico que recebe os dados")
+    import_.set_defaults(func=cmd_import)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Ponto de entrada do script `app` / `python -m ai_portrait_generator`"""
+
+    args = build_parser().parse_args(argv)
+    _load_env()
+    if args.command == "batch" and args.workers is None:
+        from generators.batch import BATCH_WORKERS
+
+        args.workers = BATCH_WORKERS
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,311 @@
+"""
+Benchmark de `generate_image` contra servidores falsos dos provedores
+
+    cd src
+    python -m benchmarks.run --concurrency 1 4 16 --requests 64 --latency 0.5
+    python -m benchmarks.run --compare ../.data/benchmarks/baseline.json
+
+Para cada modelo e nível de concorrência, mede vazão, percentis de latência,
+taxa de erro e pico de RSS do processo. Os resultados são gravados em JSON
+e podem ser comparados com uma execução anterior para detectar regressões.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.stub_servers import StubConfig, start_stub_servers, stub_environment
+
+DEFAULT_MODELS = ["DALL-E 3", "Stable Diffusion XL", "Midjourney (Replicate)"]
+DEFAULT_CONCURRENCY = [1, 4, 16]
+
+# Métricas comparadas com a execução de referência e o sentido de "pior"
+COMPARED_METRICS = {
+    "throughput_rps": "lower",
+    "latency_p50": "higher",
+    "latency_p95": "higher",
+    "peak_rss_mb": "higher",
+}
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+
+def _current_rss_mb() -> Optional[float]:
+    """RSS atual do processo (Linux); None se indisponível"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler:
+    """
+    Amostra o RSS em uma thread durante a execução para achar o pico
+
+    Onde não existe `/proc`, usa `ru_maxrss` (pico desde o início do processo).
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _current_rss_mb()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:
+            # ru_maxrss é em KB no Linux e em bytes no macOS
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def run_level(model: str, concurrency: int, requests: int, num_images: int) -> Dict[str, Any]:
+    """Executa `requests` gerações com `concurrency` simultâneas"""
+
+    from generators.clients import get_env_api_keys
+    from generators.image_generator import generate_image, get_provider
+
+    api_key = get_env_api_keys()[get_provider(model)]
+
+    def call(index: int) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = generate_image(
+            prompt=f"benchmark portrait #{index}",
+            model=model,
+            api_key=api_key,
+            num_images=num_images,
+            use_cache=False,
+        )
+        return {
+            "success": result["success"],
+            "images": len(result.get("images", [])),
+            "latency": time.perf_counter() - started,
+        }
+
+    baseline_rss = _current_rss_mb()
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            runs = list(executor.map(call, range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = [run["latency"] for run in runs if run["success"]]
+    return {
+        "model": model,
+        "concurrency": concurrency,
+        "requests": requests,
+        "num_images": num_images,
+        "succeeded": len(latencies),
+        "failed": len(runs) - len(latencies),
+        "images": sum(run["images"] for run in runs),
+        "elapsed": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "baseline_rss_mb": round(baseline_rss, 1) if baseline_rss is not None else None,
+        "peak_rss_mb": round(sampler.peak, 1),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float,
+) -> List[Dict[str, Any]]:
+    """
+    Compara duas execuções e lista as métricas que pioraram além da tolerância
+
+    Args:
+        current: Resultado desta execução
+        baseline: Resultado de referência (mesmo formato)
+        tolerance: Piora relativa aceita (0.2 = 20%)
+    """
+
+    reference = {(row["model"], row["concurrency"]): row for row in baseline.get("results", [])}
+    regressions = []
+
+    for row in current["results"]:
+        before = reference.get((row["model"], row["concurrency"]))
+        if before is None:
+            continue
+        for metric, worse in COMPARED_METRICS.items():
+            old, new = before.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (worse == "higher" and change > tolerance) or (worse == "lower" and -change > tolerance):
+                regressions.append({
+                    "model": row["model"],
+                    "concurrency": row["concurrency"],
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": round(change, 3),
+                })
+
+    return regressions
+
+
+def run_benchmark(
+    models: List[str],
+    concurrency_levels: List[int],
+    requests: int,
+    num_images: int,
+    config: StubConfig,
+    respect_rate_limits: bool = False,
+    warmup: int = 2,
+) -> Dict[str, Any]:
+    """
+    Sobe os servidores falsos e mede cada modelo em cada nível de concorrência
+
+    Returns:
+        Dict com metadados da execução, a configuração e a lista de resultados
+    """
+
+    servers = start_stub_servers({provider: config for provider in ("openai", "stability", "replicate")})
+    env = stub_environment(servers)
+    env.setdefault("REPLICATE_POLL_INTERVAL", "0.05")
+    env.setdefault("APP_DATA_DIR", str(Path(os.getenv("APP_DATA_DIR", ".data")) / "benchmarks" / "data"))
+    if not respect_rate_limits:
+        for provider in ("OPENAI", "STABILITY", "REPLICATE"):
+            env[f"RATE_LIMIT_{provider}_RPM"] = "1000000"
+            env[f"RATE_LIMIT_{provider}_BURST"] = "100000"
+            env[f"SCHEDULER_LIMIT_{provider}"] = "100000"
+        env["SCHEDULER_MAX_CONCURRENT"] = "100000"
+    # As configurações dos geradores são lidas na importação
+    os.environ.update(env)
+
+    results = []
+    try:
+        for model in models:
+            # Aquecimento: importações, clientes e conexões fora da medição
+            if warmup:
+                run_level(model, 1, warmup, num_images)
+            for concurrency in concurrency_levels:
+                row = run_level(model, concurrency, requests, num_images)
+                print(
+                    f"{model:<24} c={concurrency:<3} {row['throughput_rps']} req/s "
+                    f"p50={row['latency_p50']}s p95={row['latency_p95']}s "
+                    f"falhas={row['failed']} rss={row['peak_rss_mb']}MB",
+                    file=sys.stderr,
+                    flush=True,
+                )
+                results.append(row)
+    finally:
+        server_stats = {provider: server.stats() for provider, server in servers.items()}
+        for server in servers.values():
+            server.stop()
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "stub": config.__dict__,
+            "requests": requests,
+            "num_images": num_images,
+            "warmup": warmup,
+            "respect_rate_limits": respect_rate_limits,
+        },
+        "servers": server_stats,
+        "results": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Ponto de entrada de linha de comando: python -m benchmarks.run"""
+
+    parser = argparse.ArgumentParser(description="Benchmark de generate_image com provedores falsos")
+    parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS, help="Modelos a medir")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=DEFAULT_CONCURRENCY, help="Níveis de concorrência")
+    parser.add_argument("--requests", type=int, default=32, help="Requisições por nível")
+    parser.add_argument("--num-images", type=int, default=1, help="Imagens por requisição")
+    parser.add_argument("--warmup", type=int, default=2, help="Requisições de aquecimento por modelo")
+    parser.add_argument("--latency", type=float, default=0.5, help="Latência da API falsa (s)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Variação da latência (s)")
+    parser.add_argument("--payload-kb", type=int, default=1024, help="Tamanho de cada imagem (KB)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fração de respostas 429")
+    parser.add_argument("--respect-rate-limits", action="store_true", help="Mantém os limites de taxa configurados")
+    parser.add_argument("--output", help="Arquivo JSON de saída (padrão: .data/benchmarks/<data>.json)")
+    parser.add_argument("--compare", help="JSON de referência para detectar regressões")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Piora relativa aceita na comparação")
+    args = parser.parse_args(argv)
+
+    config = StubConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        payload_bytes=args.payload_kb * 1024,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    report = run_benchmark(
+        args.models, args.concurrency, args.requests, args.num_images, config,
+        args.respect_rate_limits, args.warmup,
+    )
+
+    output = Path(args.output) if args.output else (
+        Path(os.getenv("APP_DATA_DIR", ".data")) / "benchmarks" / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    exit_code = 0
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        report["regressions"] = compare_results(report, baseline, args.tolerance)
+        for regression in report["regressions"]:
+            print(
+                f"REGRESSÃO {regression['model']} c={regression['concurrency']} {regression['metric']}: "
+                f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.0%})",
+                file=sys.stderr,
+            )
+        exit_code = 1 if report["regressions"] else 0
+
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(output)
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
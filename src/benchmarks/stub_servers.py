@@ -0,0 +1,247 @@
+"""
+Servidores HTTP locais que imitam as APIs da OpenAI, Stability e Replicate
+
+Usados pelos benchmarks para medir o caminho de geração sem chamar (nem
+pagar) os provedores. Cada servidor tem latência, tamanho das imagens e
+taxas de erro (5xx) e de limite (429) configuráveis.
+"""
+
+import base64
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class StubConfig:
+    """
+    Comportamento de um servidor falso
+
+    Args:
+        latency: Atraso médio de cada chamada à API, em segundos
+        jitter: Variação aleatória somada ao atraso (0 a `jitter` segundos)
+        payload_bytes: Tamanho aproximado de cada imagem PNG
+        error_rate: Fração das chamadas que respondem 500
+        rate_limit_rate: Fração das chamadas que respondem 429 com Retry-After
+        download_latency: Atraso do download das imagens (modo URL)
+        poll_steps: Consultas "processing" antes do Replicate terminar
+    """
+
+    latency: float = 0.5
+    jitter: float = 0.0
+    payload_bytes: int = 1024 * 1024
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    download_latency: float = 0.05
+    poll_steps: int = 2
+
+
+def make_png(payload_bytes: int) -> bytes:
+    """
+    PNG válido com aproximadamente `payload_bytes` bytes
+
+    Usa ruído e compressão nível 0, para que o tamanho seja previsível,
+    sem depender do Pillow.
+    """
+
+    width = max(1, int((max(payload_bytes, 64) / 3) ** 0.5))
+    height = max(1, payload_bytes // (width * 3 + 1))
+    rng = random.Random(payload_bytes)
+    row_bytes = width * 3
+    raw = b"".join(b"\x00" + rng.randbytes(row_bytes) for _ in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw, 0))
+        + chunk(b"IEND", b"")
+    )
+
+
+class StubServer:
+    """
+    Servidor falso de um provedor, em uma thread própria
+
+    Args:
+        provider: "openai", "stability" ou "replicate"
+        config: Latência, tamanho e taxas de erro
+    """
+
+    def __init__(self, provider: str, config: Optional[StubConfig] = None):
+        self.provider = provider
+        self.config = config or StubConfig()
+        self.png = make_png(self.config.payload_bytes)
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self._polls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name=f"stub-{self.provider}", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited}
+
+    def _fault(self) -> Optional[int]:
+        """Sorteia se a chamada falha (500) ou é limitada (429)"""
+
+        roll = random.random()
+        with self._lock:
+            self.requests += 1
+            if roll < self.config.rate_limit_rate:
+                self.rate_limited += 1
+                return 429
+            if roll < self.config.rate_limit_rate + self.config.error_rate:
+                self.errors += 1
+                return 500
+        return None
+
+    def _delay(self):
+        time.sleep(self.config.latency + random.uniform(0, self.config.jitter))
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, body: Any, content_type: str = "application/json", headers=None):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _base(self) -> str:
+                return f"http://{self.headers['Host']}"
+
+            def do_HEAD(self):
+                self._send(200, b"")
+
+            def do_GET(self):
+                if self.path.startswith("/files/"):
+                    time.sleep(stub.config.download_latency)
+                    return self._send(200, stub.png, "image/png")
+
+                if stub.provider == "replicate" and self.path.startswith("/v1/predictions/"):
+                    prediction_id = self.path.rsplit("/", 1)[1]
+                    with stub._lock:
+                        stub._polls[prediction_id] = stub._polls.get(prediction_id, 0) + 1
+                        polls = stub._polls[prediction_id]
+                    done = polls > stub.config.poll_steps
+                    prediction = stub._prediction(self._base(), prediction_id, "succeeded" if done else "processing")
+                    if done:
+                        count = int(prediction_id.split("-")[1])
+                        prediction["output"] = [f"{self._base()}/files/{prediction_id}-{i}" for i in range(count)]
+                    return self._send(200, prediction)
+
+                self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                stub._delay()
+
+                fault = stub._fault()
+                if fault == 429:
+                    return self._send(429, {"error": "rate limited"}, headers={"Retry-After": "0.1"})
+                if fault == 500:
+                    return self._send(500, {"error": "internal error"})
+
+                if stub.provider == "openai" and self.path.endswith("/images/generations"):
+                    count = int(body.get("n") or 1)
+                    if body.get("response_format") == "b64_json":
+                        encoded = base64.b64encode(stub.png).decode("ascii")
+                        data = [{"b64_json": encoded} for _ in range(count)]
+                    else:
+                        data = [{"url": f"{self._base()}/files/{time.time_ns()}-{i}"} for i in range(count)]
+                    return self._send(200, {"created": int(time.time()), "data": data})
+
+                if stub.provider == "stability" and self.path.endswith("/text-to-image"):
+                    if self.headers.get("Accept") == "image/png":
+                        return self._send(200, stub.png, "image/png")
+                    encoded = base64.b64encode(stub.png).decode("ascii")
+                    artifacts = [
+                        {"base64": encoded, "seed": 0, "finishReason": "SUCCESS"}
+                        for _ in range(int(body.get("samples") or 1))
+                    ]
+                    return self._send(200, {"artifacts": artifacts})
+
+                if stub.provider == "replicate" and self.path == "/v1/predictions":
+                    count = int(body.get("input", {}).get("num_outputs") or 1)
+                    prediction_id = f"{time.time_ns()}-{count}"
+                    return self._send(201, stub._prediction(self._base(), prediction_id, "starting"))
+
+                self._send(404, {"error": "not found"})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _prediction(self, base: str, prediction_id: str, status: str) -> Dict[str, Any]:
+        return {
+            "id": prediction_id,
+            "model": "stub/model",
+            "version": "stub",
+            "created_at": "2024-01-01T00:00:00Z",
+            "status": status,
+            "input": {},
+            "output": None,
+            "error": None,
+            "logs": "",
+            "urls": {"get": f"{base}/v1/predictions/{prediction_id}"},
+        }
+
+
+def start_stub_servers(configs: Dict[str, StubConfig]) -> Dict[str, StubServer]:
+    """Sobe um servidor falso por provedor e devolve-os por nome"""
+    return {provider: StubServer(provider, config).start() for provider, config in configs.items()}
+
+
+def stub_environment(servers: Dict[str, StubServer]) -> Dict[str, str]:
+    """Variáveis de ambiente que apontam os clientes para os servidores falsos"""
+
+    env = {
+        "OPENAI_API_KEY": "stub-openai",
+        "STABILITY_API_KEY": "stub-stability",
+        "REPLICATE_API_TOKEN": "stub-replicate",
+    }
+    if "openai" in servers:
+        env["OPENAI_BASE_URL"] = f"{servers['openai'].base_url}/v1"
+    if "stability" in servers:
+        env["STABILITY_API_BASE"] = servers["stability"].base_url
+    if "replicate" in servers:
+        env["REPLICATE_API_BASE"] = servers["replicate"].base_url
+    return env
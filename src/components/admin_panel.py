@@ -0,0 +1,53 @@
+"""
+Painel de administração com as latências por etapa (p50/p95/p99)
+"""
+
+import streamlit as st
+import os
+from generators.scheduler import get_scheduler
+from utils.metrics import get_metrics
+
+# O painel só aparece quando habilitado (mostra dados de todas as sessões)
+ADMIN_PANEL_ENABLED = os.getenv("METRICS_ADMIN_PANEL", "false").lower() in ("1", "true", "yes")
+
+def render_admin_panel():
+    """Renderiza a tabela de latências das métricas do processo"""
+    
+    if not ADMIN_PANEL_ENABLED:
+        return
+    
+    with st.expander("📊 Métricas de latência (admin)"):
+        # Ocupação atual do escalonador (todas as sessões)
+        st.markdown("**Fila de geração**")
+        st.dataframe(
+            [{"provider": provider, **stats} for provider, stats in get_scheduler().stats().items()],
+            use_container_width=True,
+            hide_index=True
+        )
+        
+        rows = get_metrics().summary()
+        if not rows:
+            st.info("Nenhuma métrica registrada ainda.")
+            return
+        
+        # Segundos com 3 casas, colunas vazias para rótulos ausentes
+        for row in rows:
+            for field in ("mean", "p50", "p95", "p99"):
+                if row[field] is not None:
+                    row[field] = round(row[field], 3)
+        
+        metrics = sorted({row["metric"] for row in rows})
+        selected = st.selectbox("Métrica", metrics, key="admin_metric")
+        st.dataframe(
+            [row for row in rows if row["metric"] == selected],
+            use_container_width=True,
+            hide_index=True
+        )
+        
+        st.download_button(
+            "⬇️ Exportar (Prometheus)",
+            data=get_metrics().render_prometheus(),
+            file_name="metrics.prom",
+            mime="text/plain",
+            key="admin_metrics_export"
+        )
@@ -3,99 +3,435 @@ Componente de galeria para mostrar histórico de gerações
 """
 
 import streamlit as st
+import os
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
+from utils.blob_store import get_blob_store
+from utils.history_search import PromptSearch, get_history_search
+from utils.history_store import get_history_store
+from utils.image_hash import (
+    IMAGE_DUPLICATE_DISTANCE, find_similar_images, get_image_hash_index, hashes_pending, schedule_hashes
+)
+from utils.session_state import get_session_id, get_user_id
+from utils.thumbnails import THUMBNAIL_POLL_INTERVAL, get_thumbnail, thumbnail_pending
+from utils.transcode import get_download
+
+# Gerações por página na galeria
+GALLERY_PAGE_SIZE = int(os.getenv("GALLERY_PAGE_SIZE", "10"))
+
+# Filtros da busca no histórico e seus rótulos
+SEARCH_FILTER_LABELS = {
+    "model": "Modelo",
+    "size": "Tamanho",
+    "quality": "Qualidade",
+    "style": "Estilo"
+}
+
+def sync_history_search():
+    """Índice de busca do histórico do usuário (compartilhado entre sessões), atualizado"""
+    
+    search = get_history_search(get_user_id())
+    
+    # Gerações gravadas (ou importadas) desde a última busca ainda sem hash perceptual
+    schedule_hashes(search.sync())
+    return search
+
+def get_prompt_search():
+    """Índice dos prompts salvos da sessão, atualizado com os prompts novos"""
+    
+    if 'prompt_search' not in st.session_state:
+        st.session_state.prompt_search = PromptSearch()
+    
+    search = st.session_state.prompt_search
+    search.sync(st.session_state.get('saved_prompts', []))
+    return search
+
+def has_newer_duplicate(ref, timestamp, search):
+    """A imagem é quase igual a alguma imagem de uma geração mais recente do usuário?"""
+    
+    index = get_image_hash_index()
+    hashes = index.hashes(ref)
+    if hashes is None:
+        return False
+    
+    for other, _ in index.search(hashes[1], IMAGE_DUPLICATE_DISTANCE):
+        newest = search.newest_with_image(other)
+        if newest is not None and newest > timestamp:
+            return True
+    return False
+
+def collapse_near_duplicates(generations, search):
+    """
+    Oculta as gerações cujas imagens são todas quase iguais às de gerações mais recentes
+    
+    Returns:
+        (gerações visíveis, número de gerações ocultas)
+    """
+    
+    visible = []
+    for generation in generations:
+        images = generation['images']
+        if images and all(has_newer_duplicate(ref, generation['timestamp'], search) for ref in images):
+            continue
+        visible.append(generation)
+    return visible, len(generations) - len(visible)
+
+def render_similar_images(ref, search, show_details, page_size):
+    """Gerações do histórico com imagens parecidas com a imagem escolhida"""
+    
+    col1, col2 = st.columns([3, 1])
+    
+    with col1:
+        st.subheader("🧩 Imagens semelhantes")
+    
+    with col2:
+        if st.button("✖️ Fechar", key="close_similar", use_container_width=True):
+            del st.session_state.similar_image
+            st.rerun()
+    
+    render_thumbnail(str(get_blob_store().path(ref)), ref, width=192)
+    
+    # Sem esperar: enquanto a assinatura é calculada, a página é recarregada
+    # pela mesma verificação das miniaturas pendentes
+    matches = find_similar_images(ref)
+    if not matches:
+        if hashes_pending(ref):
+            if 'pending_hashes' not in st.session_state:
+                st.session_state.pending_hashes = set()
+            st.session_state.pending_hashes.add(ref)
+            st.caption("🧮 Calculando a assinatura da imagem...")
+        else:
+            st.warning("Não foi possível calcular a assinatura desta imagem.")
+        return
+    
+    # Cada geração aparece uma vez, pela sua imagem mais parecida
+    found = {}
+    for other, distance in matches:
+        for timestamp, generation_id, number in search.with_image(other):
+            found.setdefault(generation_id, (distance, -timestamp, number))
+    
+    ordered = sorted(found, key=lambda generation_id: found[generation_id][:2])
+    limit = st.session_state.get('similar_limit', page_size)
+    
+    st.markdown(f"**{len(ordered)} geração(ões) com imagens semelhantes**")
+    # Só as gerações da página são lidas do banco
+    for generation in get_history_store().generations_by_id(get_user_id(), ordered[:limit]):
+        distance, _, number = found[generation['id']]
+        render_generation(generation, number, show_details)
+        st.caption(f"Diferença: {distance} de 64 bits")
+    
+    if len(ordered) > limit:
+        if st.button("⬇️ Mostrar mais", key="similar_more", use_container_width=True):
+            st.session_state.similar_limit = limit + page_size
+            st.rerun()
+
+def render_search_controls(search):
+    """
+    Campo de busca, período e filtros do histórico
+    
+    Returns:
+        (texto, filtros por campo, início, fim) — datas como timestamps ou None
+    """
+    
+    col1, col2 = st.columns([3, 1])
+    
+    with col1:
+        query = st.text_input(
+            "🔎 Buscar no histórico",
+            key="history_query",
+            placeholder="Palavras do prompt..."
+        )
+    
+    with col2:
+        dates = st.date_input("Período", value=(), key="history_dates")
+    
+    filters = {}
+    with st.expander("Filtros"):
+        cols = st.columns(len(SEARCH_FILTER_LABELS))
+        for col, (field, label) in zip(cols, SEARCH_FILTER_LABELS.items()):
+            with col:
+                chosen = st.multiselect(label, search.values(field), key=f"history_filter_{field}")
+            if chosen:
+                filters[field] = chosen
+    
+    # Período inclusivo: do início do primeiro dia ao fim do último
+    start = end = None
+    if dates:
+        start = datetime.combine(dates[0], datetime.min.time()).timestamp()
+        last = dates[1] if len(dates) > 1 else dates[0]
+        end = datetime.combine(last + timedelta(days=1), datetime.min.time()).timestamp()
+    
+    return query.strip(), filters, start, end
+
+def render_thumbnail(path, ref, **image_kwargs):
+    """Mostra a miniatura da imagem; enquanto ela é criada, um aviso no lugar"""
+    
+    thumbnail = get_thumbnail(path, ref)
+    if thumbnail is not None:
+        st.image(thumbnail, **image_kwargs)
+        return
+    
+    if 'pending_thumbnails' not in st.session_state:
+        st.session_state.pending_thumbnails = set()
+    st.session_state.pending_thumbnails.add(ref)
+    st.caption("🖼️ Gerando miniatura...")
+
+def render_thumbnail_refresh():
+    """Recarrega a página quando as miniaturas (ou assinaturas) mostradas como aviso ficam prontas"""
+    
+    if st.session_state.get('pending_thumbnails') or st.session_state.get('pending_hashes'):
+        st.fragment(run_every=THUMBNAIL_POLL_INTERVAL)(check_pending_thumbnails)()
+
+def check_pending_thumbnails():
+    """Verifica (sem esperar) se as miniaturas e assinaturas pendentes já foram criadas"""
+    
+    thumbnails = st.session_state.get('pending_thumbnails', set())
+    hashes = st.session_state.get('pending_hashes', set())
+    if not any(thumbnail_pending(ref) for ref in thumbnails) and not any(hashes_pending(ref) for ref in hashes):
+        thumbnails.clear()
+        hashes.clear()
+        st.rerun()
+
+def render_gallery_image(ref, key):
+    """Mostra a miniatura da imagem, ou o original se o usuário pedir"""
+    
+    if 'full_size_images' not in st.session_state:
+        st.session_state.full_size_images = set()
+    
+    path = str(get_blob_store().path(ref))
+    
+    if key in st.session_state.full_size_images:
+        st.image(path, use_column_width=True)
+        if st.button("🔽 Ver miniatura", key=f"thumb_{key}", use_container_width=True):
+            st.session_state.full_size_images.discard(key)
+            st.rerun()
+    else:
+        render_thumbnail(path, ref, use_column_width=True)
+        if st.button("🔍 Ver tamanho original", key=f"full_{key}", use_container_width=True):
+            st.session_state.full_size_images.add(key)
+            st.rerun()
+    
+    if st.button("🧩 Semelhantes", key=f"similar_{key}", use_container_width=True):
+        st.session_state.similar_image = ref
+        st.session_state.pop('similar_limit', None)
+        st.rerun()
+
+def render_download_button(ref, label, file_stem, key):
+    """
+    Botão de download que só carrega a imagem quando o usuário pede
+    
+    Um `st.download_button` envia os bytes ao servidor de mídia do Streamlit
+    a cada rerun, mesmo sem clique; por isso ele só é criado sob demanda.
+    O arquivo sai no formato de download escolhido, com o tipo MIME real.
+    """
+    
+    if 'download_ready' not in st.session_state:
+        st.session_state.download_ready = set()
+    
+    if key in st.session_state.download_ready:
+        data, mime, ext = get_download(
+            ref, str(get_blob_store().path(ref)), st.session_state.download_format
+        )
+        st.download_button(
+            label,
+            data=data,
+            file_name=f"{file_stem}.{ext}",
+            mime=mime,
+            key=f"gallery_download_{key}",
+            use_container_width=True
+        )
+    elif st.button(
+        label,
+        key=f"prepare_download_{key}",
+        help="Prepara o arquivo para download",
+        use_container_width=True
+    ):
+        st.session_state.download_ready.add(key)
+        st.rerun()
 
 def render_gallery():
-    """Renderiza a galeria de imagens geradas"""
+    """Renderiza a galeria de imagens geradas, uma página por vez"""
     
-    if 'generation_history' not in st.session_state or not st.session_state.generation_history:
+    # A galeria lê o histórico persistido; a sessão guarda só as gerações recentes
+    store = get_history_store()
+    user_id = get_user_id()
+    total = store.count(user_id)
+    
+    if not total:
         st.info("📸 Nenhuma imagem gerada ainda. Use o gerador acima para começar!")
         return
     
     st.header("🖼️ Galeria de Gerações")
     
     # Controles da galeria
-    col1, col2, col3 = st.columns([2, 1, 1])
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
     
     with col1:
-        st.markdown(f"**{len(st.session_state.generation_history)} gerações no histórico**")
+        st.markdown(f"**{total} gerações no histórico**")
     
     with col2:
         if st.button("🗑️ Limpar Histórico"):
-            st.session_state.generation_history = []
+            store.clear_user(user_id)
+            get_blob_store().retain(get_session_id(), [])
+            st.session_state.gallery_cursors = [None]
             st.rerun()
     
     with col3:
         show_details = st.checkbox("📋 Mostrar Detalhes", value=False)
+        collapse = st.checkbox(
+            "🧬 Agrupar quase iguais",
+            key="gallery_collapse",
+            help="Oculta gerações cujas imagens são quase iguais às de uma geração mais recente"
+        )
     
-    # Mostrar histórico (mais recente primeiro)
-    history = reversed(st.session_state.generation_history)
+    with col4:
+        options = sorted({5, 10, 20, 50, GALLERY_PAGE_SIZE})
+        page_size = st.selectbox(
+            "Por página",
+            options,
+            index=options.index(GALLERY_PAGE_SIZE),
+            key="gallery_page_size"
+        )
     
-    for i, generation in enumerate(history):
-        with st.container():
-            st.markdown("---")
-            
-            # Cabeçalho da geração
-            timestamp = datetime.fromtimestamp(generation['timestamp'])
-            st.markdown(f"**Geração #{len(st.session_state.generation_history) - i}** - {timestamp.strftime('%d/%m/%Y %H:%M')}")
+    search = sync_history_search()
+    
+    if st.session_state.get('similar_image'):
+        render_similar_images(st.session_state.similar_image, search, show_details, page_size)
+        return
+    
+    # Busca e filtros: só as gerações encontradas pelo índice são mostradas
+    query, filters, start, end = render_search_controls(search)
+    
+    if query or filters or start is not None:
+        search_key = (query, tuple(sorted((k, tuple(v)) for k, v in filters.items())), start, end)
+        if st.session_state.get('history_search_key') != search_key:
+            st.session_state.history_search_key = search_key
+            st.session_state.history_search_limit = page_size
+        limit = st.session_state.history_search_limit
+        
+        results = search.search(query, filters, start, end, limit=limit)
+        if not results:
+            st.info("Nenhuma geração encontrada com esses critérios.")
+            return
+        
+        st.markdown(f"**{len(results)}{'+' if len(results) >= limit else ''} resultado(s)**")
+        # O índice só guarda ids e números; as gerações encontradas vêm do banco
+        numbers = dict(results)
+        generations = store.generations_by_id(user_id, [generation_id for generation_id, _ in results])
+        if collapse:
+            generations, hidden = collapse_near_duplicates(generations, search)
+            if hidden:
+                st.caption(f"🧬 {hidden} geração(ões) quase iguais a outras mais recentes ocultas")
+        for generation in generations:
+            render_generation(generation, numbers[generation['id']], show_details)
+        
+        if len(results) >= limit:
+            if st.button("⬇️ Mostrar mais", use_container_width=True):
+                st.session_state.history_search_limit = limit + page_size
+                st.rerun()
+        return
+    
+    # Paginação por cursor (página 1 = gerações mais recentes): a pilha guarda
+    # o cursor inicial de cada página visitada, e cada página é uma consulta
+    # indexada a partir dele, sem OFFSET
+    if st.session_state.get('gallery_cursors_page_size') != page_size:
+        st.session_state.gallery_cursors = [None]
+        st.session_state.gallery_cursors_page_size = page_size
+    cursors = st.session_state.gallery_cursors
+    
+    generations, next_cursor = store.page(user_id, cursors[-1], page_size)
+    page = len(cursors)
+    num_pages = max(page, -(-total // page_size))
+    
+    if num_pages > 1:
+        nav1, nav2, nav3 = st.columns([1, 2, 1])
+        with nav1:
+            if st.button("⬅️ Mais recentes", disabled=page <= 1, use_container_width=True):
+                cursors.pop()
+                st.rerun()
+        with nav2:
+            st.markdown(f"<div style='text-align: center'>Página {page} de {num_pages}</div>", unsafe_allow_html=True)
+        with nav3:
+            if st.button("Mais antigas ➡️", disabled=next_cursor is None, use_container_width=True):
+                cursors.append(next_cursor)
+                st.rerun()
+    
+    first_number = total - (page - 1) * page_size
+    numbered = [(first_number - i, generation) for i, generation in enumerate(generations)]
+    if collapse:
+        visible, hidden = collapse_near_duplicates(generations, search)
+        visible_ids = {id(generation) for generation in visible}
+        numbered = [(number, generation) for number, generation in numbered if id(generation) in visible_ids]
+        if hidden:
+            st.caption(f"🧬 {hidden} geração(ões) desta página quase iguais a outras mais recentes ocultas")
+    for number, generation in numbered:
+        render_generation(generation, number, show_details)
+
+def render_generation(generation, number, show_details):
+    """Renderiza uma geração do histórico"""
+    
+    # Id da geração: único (timestamps podem se repetir) e estável entre reruns
+    gen_key = f"{generation['id']}"
+    
+    with st.container():
+        st.markdown("---")
+        
+        # Cabeçalho da geração
+        timestamp = datetime.fromtimestamp(generation['timestamp'])
+        st.markdown(f"**Geração #{number}** - {timestamp.strftime('%d/%m/%Y %H:%M')}")
+        
+        # Layout das imagens
+        images = generation['images']
+        
+        if len(images) == 1:
+            # Uma imagem
+            col1, col2 = st.columns([2, 1])
             
-            # Layout das imagens
-            images = generation['images']
+            with col1:
+                render_gallery_image(images[0], f"{gen_key}_0")
             
-            if len(images) == 1:
-                # Uma imagem
-                col1, col2 = st.columns([2, 1])
+            with col2:
+                if show_details:
+                    st.markdown("**Detalhes:**")
+                    st.markdown(f"- Modelo: {generation['model']}")
+                    st.markdown(f"- Qualidade: {generation['parameters']['quality']}")
+                    st.markdown(f"- Tamanho: {generation['parameters']['size']}")
+                    st.markdown(f"- Estilo: {generation['parameters']['style']}")
                 
-                with col1:
-                    st.image(images[0], use_column_width=True)
+                # Botões de ação
+                render_download_button(
+                    images[0],
+                    "💾 Download",
+                    f"portrait_gallery_{int(generation['timestamp'])}",
+                    f"{gen_key}_0"
+                )
                 
-                with col2:
-                    if show_details:
-                        st.markdown("**Detalhes:**")
-                        st.markdown(f"- Modelo: {generation['model']}")
-                        st.markdown(f"- Qualidade: {generation['parameters']['quality']}")
-                        st.markdown(f"- Tamanho: {generation['parameters']['size']}")
-                        st.markdown(f"- Estilo: {generation['parameters']['style']}")
-                    
-                    # Botões de ação
-                    st.download_button(
-                        "💾 Download",
-                        data=images[0],
-                        file_name=f"portrait_gallery_{int(generation['timestamp'])}.png",
-                        mime="image/png",
-                        key=f"gallery_download_{i}",
-                        use_container_width=True
-                    )
-                    
-                    if st.button("🔄 Reutilizar Prompt", key=f"reuse_{i}", use_container_width=True):
-                        # Copiar prompt para área de texto (simulado)
-                        st.info("💡 Copie o prompt abaixo e cole no gerador")
+                if st.button("🔄 Reutilizar Prompt", key=f"reuse_{gen_key}", use_container_width=True):
+                    # Copiar prompt para área de texto (simulado)
+                    st.info("💡 Copie o prompt abaixo e cole no gerador")
+        
+        else:
+            # Múltiplas imagens
+            cols = st.columns(min(len(images), 3))
             
-            else:
-                # Múltiplas imagens
-                cols = st.columns(min(len(images), 3))
-                
-                for j, image in enumerate(images):
-                    with cols[j % 3]:
-                        st.image(image, use_column_width=True)
-                        st.download_button(
-                            f"💾 {j+1}",
-                            data=image,
-                            file_name=f"portrait_gallery_{int(generation['timestamp'])}_{j+1}.png",
-                            mime="image/png",
-                            key=f"gallery_download_{i}_{j}",
-                            use_container_width=True
-                        )
+            for j, image in enumerate(images):
+                with cols[j % 3]:
+                    render_gallery_image(image, f"{gen_key}_{j}")
+                    render_download_button(
+                        image,
+                        f"💾 {j+1}",
+                        f"portrait_gallery_{int(generation['timestamp'])}_{j+1}",
+                        f"{gen_key}_{j}"
+                    )
+        
+        # Mostrar prompt
+        with st.expander(f"📝 Ver prompt da geração #{number}"):
+            st.code(generation['prompt'])
             
-            # Mostrar prompt
-            with st.expander(f"📝 Ver prompt da geração #{len(st.session_state.generation_history) - i}"):
-                st.code(generation['prompt'])
-                
-                # Botão para copiar prompt
-                if st.button("📋 Copiar Prompt", key=f"copy_prompt_{i}"):
-                    # Em uma aplicação real, isso copiaria para o clipboard
-                    st.success("Prompt copiado! (funcionalidade simulada)")
+            # Botão para copiar prompt
+            if st.button("📋 Copiar Prompt", key=f"copy_prompt_{gen_key}"):
+                # Em uma aplicação real, isso copiaria para o clipboard
+                st.success("Prompt copiado! (funcionalidade simulada)")
 
 def render_saved_prompts():
     """Renderiza seção de prompts salvos"""
@@ -105,7 +441,33 @@ def render_saved_prompts():
     
     st.subheader("💾 Prompts Salvos")
     
-    for i, prompt in enumerate(st.session_state.saved_prompts):
+    query = st.text_input(
+        "🔎 Buscar nos prompts salvos",
+        key="saved_prompts_query",
+        placeholder="Palavras do prompt..."
+    )
+    
+    # Mesmo tamanho de página do histórico; "Mostrar mais" amplia o limite e
+    # uma nova busca volta à primeira página
+    page_size = st.session_state.get('gallery_page_size', GALLERY_PAGE_SIZE)
+    if st.session_state.get('saved_prompts_search_key') != (query, page_size):
+        st.session_state.saved_prompts_search_key = (query, page_size)
+        st.session_state.saved_prompts_limit = page_size
+    limit = st.session_state.saved_prompts_limit
+    
+    # Sem busca, mostra os mais recentes primeiro; um a mais indica se há outra página
+    positions = get_prompt_search().prompts.search(query.strip(), limit=limit + 1)
+    total = len(st.session_state.saved_prompts)
+    if not positions:
+        st.info("Nenhum prompt salvo encontrado.")
+        return
+    has_more = len(positions) > limit
+    positions = positions[:limit]
+    if len(positions) < total:
+        st.caption(f"Mostrando {len(positions)} de {total} prompts salvos")
+    
+    for i in positions:
+        prompt = st.session_state.saved_prompts[i]
         with st.expander(f"Prompt {i+1}: {prompt[:50]}..."):
             st.code(prompt)
             
@@ -117,5 +479,11 @@ def render_saved_prompts():
             
             with col2:
                 if st.button("🗑️ Remover", key=f"remove_saved_{i}"):
-                    st.session_state.saved_prompts.pop(i)
-                    st.rerun()
\ No newline at end of file
+                    removed = st.session_state.saved_prompts.pop(i)
+                    get_history_store().remove_saved_prompt(get_user_id(), removed)
+                    st.rerun()
+    
+    if has_more:
+        if st.button("⬇️ Mostrar mais", key="saved_prompts_more", use_container_width=True):
+            st.session_state.saved_prompts_limit = limit + page_size
+            st.rerun()
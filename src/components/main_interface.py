@@ -3,10 +3,29 @@ Interface principal para entrada de prompts e geração de imagens
 """
 
 import streamlit as st
-from generators.image_generator import generate_image
+from generators.fanout import get_fanout_models
+from generators.cache import get_result_cache, make_cache_key
+from generators.image_generator import get_provider
+from generators.jobs import FAILED, JOB_POLL_INTERVAL, GenerationJob, JobLimitError, JobList
+from generators.prompt_similarity import get_prompt_index
+from generators.scheduler import PRIORITY_HIGH
+from components.gallery import render_download_button, render_thumbnail
 from utils.prompt_templates import get_template_prompt
+from utils.blob_store import QuotaExceededError, get_blob_store
+from utils.history_store import get_history_store
+from utils.image_hash import schedule_hashes
+from utils.session_state import get_session_id, get_user_id
+from utils.thumbnails import schedule_thumbnail
+from utils.transcode import get_download, schedule_transcode
 import time
 
+# Campo do estado da sessão com a chave de cada provedor
+PROVIDER_KEY_FIELDS = {
+    "openai": "openai_key",
+    "stability": "stability_key",
+    "replicate": "replicate_key",
+}
+
 def render_main_interface():
     """Renderiza a interface principal"""
     
@@ -62,7 +81,7 @@ def render_main_interface():
         generate_btn = st.button(
             "🎨 Gerar Imagem",
             type="primary",
-            disabled=not combined_prompt or not st.session_state.get('openai_key'),
+            disabled=not combined_prompt or not has_api_key_for_generation(),
             use_container_width=True
         )
     
@@ -76,90 +95,419 @@ def render_main_interface():
                 if 'saved_prompts' not in st.session_state:
                     st.session_state.saved_prompts = []
                 st.session_state.saved_prompts.append(combined_prompt)
+                get_history_store().add_saved_prompt(get_user_id(), combined_prompt)
                 st.success("Prompt salvo!")
     
+    # Gerações anteriores parecidas aguardando a decisão do usuário
+    generate_anyway = False
+    offer = st.session_state.get('similar_offer')
+    if offer and (
+        offer['prompt'] != combined_prompt
+        or offer['model'] != st.session_state.selected_model
+        or offer['owner'] != get_user_id()
+    ):
+        del st.session_state.similar_offer
+        offer = None
+    
+    if offer and not generate_btn:
+        choice = render_similar_offer(offer)
+        if choice is None:
+            render_generation_jobs()
+            return
+        del st.session_state.similar_offer
+        if choice == 'generate':
+            generate_anyway = True
+        else:
+            reuse_generation(combined_prompt, offer['model'], choice)
+            render_generation_jobs()
+            return
+    
     # Área de geração
-    if generate_btn and combined_prompt:
-        if not st.session_state.get('openai_key'):
-            st.error("❌ Por favor, configure sua chave da OpenAI na sidebar")
+    if (generate_btn or generate_anyway) and combined_prompt:
+        start_generation(combined_prompt, generate_anyway)
+    
+    # Gerações em segundo plano desta sessão
+    render_generation_jobs()
+
+def start_generation(prompt, generate_anyway=False):
+    """Valida o pedido e começa a geração em segundo plano (um trabalho por modelo no fan-out)"""
+    
+    if st.session_state.get('fanout_mode'):
+        api_keys = get_api_keys()
+        models = get_fanout_models(api_keys)
+        if not models:
+            st.error("❌ Configure ao menos uma chave de API na sidebar")
             return
         
-        # Mostrar prompt final
+        for model in models:
+            if submit_generation(prompt, model, api_keys[get_provider(model)]) is None:
+                break
+        return
+    
+    model = st.session_state.selected_model
+    api_key = get_api_keys().get(get_provider(model))
+    if not api_key:
+        st.error(f"❌ Por favor, configure a chave de API para {model} na sidebar")
+        return
+    
+    # Antes de uma chamada paga, oferecer gerações anteriores quase iguais
+    if not generate_anyway:
+        matches = find_reusable_generations(prompt, model)
+        if matches:
+            st.session_state.similar_offer = {
+                'prompt': prompt,
+                'model': model,
+                'owner': get_user_id(),
+                'matches': matches
+            }
+            render_similar_offer(st.session_state.similar_offer)
+            return
+    
+    submit_generation(prompt, model, api_key)
+
+def get_api_keys():
+    """Retorna as chaves de API configuradas na sidebar, por provedor"""
+    
+    return {
+        provider: st.session_state.get(field)
+        for provider, field in PROVIDER_KEY_FIELDS.items()
+    }
+
+def has_api_key_for_generation():
+    """Indica se há chave para o modelo escolhido (ou para algum, no fan-out)"""
+    
+    api_keys = get_api_keys()
+    
+    if st.session_state.get('fanout_mode'):
+        return bool(get_fanout_models(api_keys))
+    
+    return bool(api_keys.get(get_provider(st.session_state.get('selected_model', ''))))
+
+def get_generation_params():
+    """Parâmetros de geração escolhidos na sidebar"""
+    
+    return {
+        'quality': st.session_state.quality,
+        'size': st.session_state.image_size,
+        'style': st.session_state.style,
+        'num_images': st.session_state.num_images,
+        'seed': st.session_state.get('seed'),
+        'use_cache': not st.session_state.get('bypass_cache', False)
+    }
+
+def get_storage_params():
+    """Parâmetros guardados no histórico junto com a geração"""
+    
+    return {
+        'quality': st.session_state.quality,
+        'size': st.session_state.image_size,
+        'style': st.session_state.style
+    }
+
+def quota_message(error):
+    """Mensagem para o usuário quando a cota de armazenamento é atingida"""
+    return f"Limite de armazenamento atingido: {str(error)}. Limpe o histórico para liberar espaço."
+
+def store_generation(prompt, model, result, parameters, session_id, user_id, latency=None):
+    """
+    Grava as imagens em disco e a geração no histórico persistido
+    
+    Não usa o estado da sessão, então também roda nas threads dos trabalhos
+    em segundo plano.
+    
+    Returns:
+        Entrada do histórico (com as referências das imagens)
+    
+    Raises:
+        QuotaExceededError: Se as imagens ultrapassarem a cota de armazenamento
+    """
+    
+    # Gravar as imagens em disco; o histórico guarda só as referências
+    store = get_blob_store()
+    image_refs = [store.put(image, session_id) for image in result['images']]
+    
+    entry = {
+        'prompt': prompt,
+        'images': image_refs,
+        'timestamp': time.time(),
+        'model': model,
+        'parameters': dict(parameters)
+    }
+    if latency is not None:
+        entry['latency'] = latency
+    
+    get_history_store().add_generation(user_id, entry)
+    get_prompt_index().add(prompt, model, entry['parameters'], image_refs, owner=user_id)
+    
+    # Miniaturas e versões para download são criadas em segundo plano
+    for ref in image_refs:
+        schedule_thumbnail(str(store.path(ref)), ref)
+        schedule_transcode(str(store.path(ref)), ref)
+    schedule_hashes(image_refs)
+    
+    return entry
+
+def save_generation(prompt, model, result, latency=None):
+    """
+    Grava as imagens em disco e a geração no histórico (a galeria a lê do banco)
+    
+    Returns:
+        Lista de referências das imagens, ou None se a cota foi excedida
+    """
+    
+    try:
+        entry = store_generation(
+            prompt, model, result, get_storage_params(), get_session_id(), get_user_id(), latency
+        )
+    except QuotaExceededError as e:
+        st.error(f"❌ {quota_message(e)}")
+        return None
+    
+    return entry['images']
+
+def find_reusable_generations(prompt, model):
+    """
+    Gerações anteriores do próprio usuário com prompt quase igual, mesmo
+    modelo e parâmetros e ao menos o número de imagens pedido
+    
+    Gerações com mais imagens que o pedido oferecem só as primeiras. Não
+    oferece nada quando o cache exato já tem o resultado (ele é devolvido
+    sem custo) ou quando o usuário pediu para ignorar o cache.
+    """
+    
+    params = get_generation_params()
+    if not params['use_cache']:
+        return []
+    
+    key = make_cache_key(
+        prompt, model, params['size'], params['quality'], params['style'],
+        params['num_images'], params['seed']
+    )
+    if get_result_cache().contains(key):
+        return []
+    
+    wanted = {
+        'quality': params['quality'],
+        'size': params['size'],
+        'style': params['style']
+    }
+    num_images = params['num_images']
+    matches = get_prompt_index().find_similar(
+        prompt, model=model, owner=get_user_id(), parameters=wanted, min_images=num_images
+    )
+    store = get_blob_store()
+    return [
+        {**match, 'images': match['images'][:num_images]}
+        for match in matches
+        if all(store.exists(ref) for ref in match['images'][:num_images])
+    ]
+
+def render_similar_offer(offer):
+    """
+    Mostra as gerações anteriores parecidas e pergunta o que fazer
+    
+    A oferta só tem gerações do usuário que a recebeu (e é descartada se o
+    usuário da sessão mudar).
+    
+    Returns:
+        "generate" para gerar mesmo assim, a geração escolhida para
+        reaproveitar, ou None enquanto o usuário não decidir
+    """
+    
+    store = get_blob_store()
+    st.info(
+        f"♻️ Encontramos {len(offer['matches'])} geração(ões) anterior(es) com prompt quase igual. "
+        "Reaproveitar é instantâneo e não gera custo."
+    )
+    
+    choice = None
+    for i, match in enumerate(offer['matches']):
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            ref = match['images'][0]
+            render_thumbnail(str(store.path(ref)), ref, use_column_width=True)
+        with col2:
+            st.markdown(f"**{match['similarity']:.0%} parecido** · {len(match['images'])} imagem(ns)")
+            st.caption(match['prompt'][:200])
+            if st.button("♻️ Reaproveitar", key=f"reuse_similar_{i}", use_container_width=True):
+                choice = match
+    
+    if st.button("🎨 Gerar mesmo assim", key="generate_anyway", use_container_width=True):
+        choice = 'generate'
+    
+    return choice
+
+def reuse_generation(prompt, model, match):
+    """Adiciona ao histórico as imagens de uma geração anterior, sem chamar o provedor"""
+    
+    store = get_blob_store()
+    try:
+        images = [store.read_bytes(ref) for ref in match['images']]
+    except OSError:
+        st.error("❌ As imagens dessa geração não estão mais disponíveis")
+        return
+    
+    result = {'success': True, 'images': images, 'error': None}
+    image_refs = save_generation(prompt, model, result)
+    if image_refs is None:
+        return
+    
+    st.success("♻️ Imagens reaproveitadas de uma geração anterior!")
+    display_generated_images(image_refs, prompt)
+
+def get_job_list():
+    """Lista de gerações em segundo plano da sessão"""
+    
+    if 'generation_jobs' not in st.session_state:
+        st.session_state.generation_jobs = JobList()
+    return st.session_state.generation_jobs
+
+def submit_generation(prompt, model, api_key):
+    """
+    Começa uma geração em segundo plano
+    
+    As imagens são gravadas pela thread do trabalho e entram no histórico da
+    sessão quando a interface recolhe o trabalho concluído.
+    
+    Returns:
+        O trabalho, ou None se a sessão já tem o máximo em andamento
+    """
+    
+    # A thread do trabalho não acessa o estado da sessão: tudo é lido aqui
+    parameters = get_storage_params()
+    session_id = get_session_id()
+    user_id = get_user_id()
+    
+    def on_success(job, result):
+        try:
+            return store_generation(prompt, model, result, parameters, session_id, user_id, latency=job.elapsed)
+        except QuotaExceededError as e:
+            # Vira o erro do trabalho, mostrado quando ele é exibido como concluído
+            raise RuntimeError(quota_message(e)) from e
+    
+    job = GenerationJob(
+        prompt,
+        model,
+        api_key,
+        get_generation_params(),
+        session_id=session_id,
+        priority=PRIORITY_HIGH
+    )
+    try:
+        return get_job_list().submit(job, on_success)
+    except JobLimitError as e:
+        st.warning(f"⏳ Não foi possível começar a geração em {model}: {str(e)}")
+        return None
+
+def render_generation_jobs():
+    """Mostra as gerações da sessão; as em andamento se atualizam sozinhas"""
+    
+    jobs = get_job_list()
+    
+    if jobs.active():
+        st.fragment(run_every=JOB_POLL_INTERVAL)(render_active_jobs)()
+    else:
+        # Concluídos sem passar pelo fragmento (ex.: antes de um recarregamento)
+        collect_finished_jobs()
+    
+    for job in reversed(jobs.jobs):
+        if job.done:
+            render_finished_job(job)
+
+def collect_finished_jobs():
+    """Recarrega a página quando há gerações concluídas (já gravadas no histórico pelo trabalho)"""
+    
+    if get_job_list().collect():
+        st.rerun()
+
+def render_active_jobs():
+    """Progresso das gerações em andamento (executado periodicamente como fragmento)"""
+    
+    collect_finished_jobs()
+    
+    for job in reversed(get_job_list().active()):
+        with st.container(border=True):
+            st.markdown(f"**{job.model}** · ⏱️ {job.elapsed:.0f}s")
+            st.caption(job.prompt[:200])
+            st.progress(job.progress, text=job.message)
+
+def render_finished_job(job):
+    """Resultado de uma geração concluída, até o usuário dispensá-lo"""
+    
+    jobs = get_job_list()
+    
+    with st.container(border=True):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.markdown(f"**{job.model}** · ⏱️ {job.elapsed:.1f}s")
+        with col2:
+            if st.button("✖️ Dispensar", key=f"dismiss_{job.id}", use_container_width=True):
+                jobs.dismiss(job.id)
+                st.rerun()
+        
         with st.expander("📝 Prompt final enviado para IA"):
-            st.code(combined_prompt)
+            st.code(job.prompt)
         
-        # Área de progresso
-        progress_container = st.container()
+        if job.status == FAILED:
+            st.error(f"❌ Erro na geração: {job.error}")
+            return
         
-        with progress_container:
-            st.info("🎨 Gerando imagem... Isso pode levar alguns segundos.")
-            progress_bar = st.progress(0)
-            
-            # Simular progresso
-            for i in range(100):
-                time.sleep(0.02)
-                progress_bar.progress(i + 1)
+        if job.result.get('cached'):
+            st.success("⚡ Resultado recuperado do cache!")
+        elif job.result.get('coalesced'):
+            st.success("⚡ Resultado compartilhado com uma geração idêntica que já estava em andamento!")
+        else:
+            st.success("✅ Imagem gerada com sucesso!")
         
-        # Gerar imagem
-        try:
-            result = generate_image(
-                prompt=combined_prompt,
-                model=st.session_state.selected_model,
-                api_key=st.session_state.openai_key,
-                quality=st.session_state.quality,
-                size=st.session_state.image_size,
-                style=st.session_state.style,
-                num_images=st.session_state.num_images
+        if job.result.get('error'):
+            st.warning(f"⚠️ {job.result['error']}")
+        
+        display_job_images(job)
+
+def display_job_images(job):
+    """
+    Imagens de uma geração concluída: miniaturas e downloads sob demanda
+    
+    Os trabalhos concluídos são redesenhados a cada rerun até serem
+    dispensados, então não carregam as imagens originais nem os downloads.
+    """
+    
+    st.markdown("### 🖼️ Resultado")
+    
+    store = get_blob_store()
+    images = job.output['images']
+    cols = st.columns(min(len(images), 2))
+    
+    for i, ref in enumerate(images):
+        with cols[i % 2]:
+            render_thumbnail(str(store.path(ref)), ref, caption=f"Variação {i+1}", use_column_width=True)
+            render_download_button(
+                ref,
+                f"💾 Download {i+1}" if len(images) > 1 else "💾 Download",
+                f"portrait_{int(job.created)}_{i+1}",
+                f"job_{job.id}_{i}"
             )
-            
-            progress_container.empty()
-            
-            if result['success']:
-                st.success("✅ Imagem gerada com sucesso!")
-                
-                # Salvar no histórico
-                if 'generation_history' not in st.session_state:
-                    st.session_state.generation_history = []
-                
-                st.session_state.generation_history.append({
-                    'prompt': combined_prompt,
-                    'images': result['images'],
-                    'timestamp': time.time(),
-                    'model': st.session_state.selected_model,
-                    'parameters': {
-                        'quality': st.session_state.quality,
-                        'size': st.session_state.image_size,
-                        'style': st.session_state.style
-                    }
-                })
-                
-                # Mostrar imagens
-                display_generated_images(result['images'], combined_prompt)
-                
-            else:
-                st.error(f"❌ Erro na geração: {result['error']}")
-                
-        except Exception as e:
-            progress_container.empty()
-            st.error(f"❌ Erro inesperado: {str(e)}")
 
 def display_generated_images(images, prompt):
-    """Exibe as imagens geradas"""
+    """Exibe as imagens geradas (referências do armazenamento em disco)"""
     
     st.markdown("### 🖼️ Resultado")
     
+    store = get_blob_store()
+    
     if len(images) == 1:
         # Uma imagem
-        st.image(images[0], caption=prompt[:100] + "...", use_column_width=True)
+        st.image(str(store.path(images[0])), caption=prompt[:100] + "...", use_column_width=True)
         
         # Botão de download
         col1, col2 = st.columns([1, 1])
         with col1:
+            data, mime, ext = get_download(images[0], str(store.path(images[0])), st.session_state.download_format)
             st.download_button(
                 "💾 Download",
-                data=images[0],
-                file_name=f"portrait_{int(time.time())}.png",
-                mime="image/png",
+                data=data,
+                file_name=f"portrait_{int(time.time())}.{ext}",
+                mime=mime,
                 use_container_width=True
             )
         with col2:
@@ -172,12 +520,13 @@ def display_generated_images(images, prompt):
         
         for i, image in enumerate(images):
             with cols[i % 2]:
-                st.image(image, caption=f"Variação {i+1}", use_column_width=True)
+                st.image(str(store.path(image)), caption=f"Variação {i+1}", use_column_width=True)
+                data, mime, ext = get_download(image, str(store.path(image)), st.session_state.download_format)
                 st.download_button(
                     f"💾 Download {i+1}",
-                    data=image,
-                    file_name=f"portrait_{int(time.time())}_{i+1}.png",
-                    mime="image/png",
+                    data=data,
+                    file_name=f"portrait_{int(time.time())}_{i+1}.{ext}",
+                    mime=mime,
                     key=f"download_{i}",
                     use_container_width=True
                 )
\ No newline at end of file
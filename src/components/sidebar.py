@@ -4,6 +4,10 @@ Componente da sidebar com configurações e controles
 
 import streamlit as st
 import os
+from utils.archive import ARCHIVE_FORMATS, EXPORT_DOWNLOAD_MAX_BYTES, export_archive, import_archive, new_export_path
+from utils.history_store import get_history_store
+from utils.session_state import get_user_id
+from utils.transcode import DOWNLOAD_FORMAT, TRANSCODE_FORMATS, transcode_stats
 
 def render_sidebar():
     """Renderiza a sidebar com configurações"""
@@ -47,6 +51,13 @@ def render_sidebar():
     )
     st.session_state.selected_model = model_choice
     
+    fanout_mode = st.checkbox(
+        "🚀 Comparar todos os modelos",
+        value=False,
+        help="Envia o mesmo prompt a todos os provedores com chave configurada, ao mesmo tempo"
+    )
+    st.session_state.fanout_mode = fanout_mode
+    
     # Parâmetros de geração
     st.subheader("🎛️ Parâmetros")
     
@@ -116,4 +127,107 @@ def render_sidebar():
             placeholder="O que NÃO incluir na imagem...",
             help="Elementos a evitar na geração"
         )
-        st.session_state.negative_prompt = negative_prompt
\ No newline at end of file
+        st.session_state.negative_prompt = negative_prompt
+        
+        bypass_cache = st.checkbox(
+            "Ignorar cache",
+            value=False,
+            help="Chama o provedor mesmo se este prompt já foi gerado com os mesmos parâmetros"
+        )
+        st.session_state.bypass_cache = bypass_cache
+        
+        formats = list(dict.fromkeys(TRANSCODE_FORMATS + [DOWNLOAD_FORMAT, "ORIGINAL"]))
+        download_format = st.selectbox(
+            "Formato do download",
+            formats,
+            index=formats.index(st.session_state.download_format),
+            format_func=lambda fmt: "Original do provedor" if fmt == "ORIGINAL" else fmt,
+            help="As imagens são convertidas em segundo plano; a original é usada enquanto a conversão não termina"
+        )
+        st.session_state.download_format = download_format
+        
+        # Resultado da transcodificação: compressão e vazão por formato
+        for fmt, values in transcode_stats()["formats"].items():
+            st.caption(
+                f"{fmt}: {values['compression_ratio']}x menor, "
+                f"{values['images_per_second']} img/s por processo ({values['images']} imagens)"
+            )
+    
+    render_backup()
+
+def render_backup():
+    """Exportação e importação do histórico (imagens + metadados) em um arquivo"""
+    
+    with st.expander("📦 Backup do histórico"):
+        fmt = st.radio("Formato", ARCHIVE_FORMATS, horizontal=True, key="backup_format")
+        user_id = get_user_id()
+        
+        # O arquivo é escrito em disco em fluxo; só o download passa pela memória
+        if st.button("Preparar exportação", use_container_width=True):
+            path = new_export_path(user_id, fmt)
+            st.session_state.pop('backup_download_ready', None)
+            with st.spinner("Exportando..."):
+                with open(path, "wb") as f:
+                    counts = export_archive(f, user_id, fmt, settings={
+                        'selected_model': st.session_state.get('selected_model'),
+                        'quality': st.session_state.get('quality'),
+                        'image_size': st.session_state.get('image_size'),
+                        'style': st.session_state.get('style'),
+                        'num_images': st.session_state.get('num_images'),
+                        'template_choice': st.session_state.get('template_choice')
+                    })
+            st.session_state.backup_export = str(path)
+            st.caption(f"{counts['generations']} gerações, {counts['images']} imagens")
+        
+        export_path = st.session_state.get('backup_export')
+        if export_path and os.path.isfile(export_path):
+            render_backup_download(export_path)
+        
+        uploaded = st.file_uploader("Importar backup", type=["zip", "tar", "gz", "tgz"], key="backup_upload")
+        if uploaded is not None and st.button("Importar", use_container_width=True):
+            with st.spinner("Importando..."):
+                result = import_archive(uploaded, user_id)
+            
+            # Recarrega os prompts salvos da sessão; a galeria lê as gerações do banco
+            st.session_state.saved_prompts = get_history_store().saved_prompts(user_id)
+            
+            if result['error']:
+                st.error(f"❌ Importação interrompida: {result['error']}")
+            st.success(
+                f"✅ {result['generations']} gerações, {result['images']} imagens novas e "
+                f"{result['saved_prompts']} prompts importados ({result['skipped']} itens pulados)"
+            )
+
+def render_backup_download(export_path):
+    """
+    Download do backup preparado, montado só quando o usuário pede
+    
+    Um `st.download_button` carrega o arquivo inteiro na memória do Streamlit
+    a cada rerun; por isso ele só existe no rerun seguinte ao pedido (e no
+    causado pelo próprio clique de download, para não interrompê-lo).
+    """
+    
+    if os.path.getsize(export_path) > EXPORT_DOWNLOAD_MAX_BYTES:
+        st.warning(
+            "Backup grande demais para baixar pela interface. Use a linha de comando: "
+            f"`python -m ai_portrait_generator export backup.zip --user {get_user_id()}`"
+        )
+        return
+    
+    if st.session_state.pop('backup_download_ready', False):
+        with open(export_path, "rb") as f:
+            st.download_button(
+                "💾 Baixar backup",
+                data=f,
+                file_name=f"portraits-backup{os.path.splitext(export_path)[1]}",
+                mime="application/zip" if export_path.endswith(".zip") else "application/x-tar",
+                on_click=keep_backup_download,
+                use_container_width=True
+            )
+    elif st.button("💾 Baixar backup", key="prepare_backup_download", use_container_width=True):
+        st.session_state.backup_download_ready = True
+        st.rerun()
+
+def keep_backup_download():
+    """Mantém o botão no rerun causado pelo clique, enquanto o download acontece"""
+    st.session_state.backup_download_ready = True
@@ -0,0 +1,545 @@
+"""
+API assíncrona (asyncio) para geração de imagens
+
+Permite que código de backend ou lotes mantenham centenas de gerações em
+andamento em um único event loop. O caminho é o mesmo de `generate_image`,
+com as mesmas etapas compartilhadas (`GenerationRun`, `plan_chunks`,
+`scheduler_slot_args` e `provider_call_args`): cache de resultados,
+coalescência de requisições idênticas, vaga no escalonador do processo,
+limite de taxa, eventos de progresso e métricas; só as esperas e as chamadas
+HTTP aos provedores são assíncronas (httpx).
+
+Os clientes HTTP ficam presos ao event loop em que foram criados; quem cria
+o próprio loop deve chamar `close_async_clients()` antes de fechá-lo.
+`generate_image_sync` executa a versão assíncrona a partir de código
+síncrono, em um event loop persistente do processo.
+"""
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from generators.capabilities import merge_results
+from generators.clients import DEFAULT_POOL_MAXSIZE, PROVIDER_BASE_URLS
+from generators.downloads import DOWNLOAD_TIMEOUT, build_download_result
+from generators.image_generator import (
+    REPLICATE_MODEL_NAME,
+    REPLICATE_MODEL_VERSION,
+    REPLICATE_POLL_INTERVAL,
+    STABILITY_MODEL_NAME,
+    GenerationRun,
+    build_dalle_params,
+    build_replicate_input,
+    build_stability_request,
+    get_provider,
+    plan_chunks,
+    provider_call_args,
+    scheduler_slot_args,
+    unsupported_model_result,
+)
+from generators.progress import (
+    DOWNLOAD_PROGRESS_START,
+    POLLING_PROGRESS,
+    SUBMITTED_PROGRESS,
+    ProgressCallback,
+    download_progress,
+    emit_progress,
+)
+from generators.rate_limit import call_with_retry_async, raise_for_retryable
+from generators.scheduler import PRIORITY_NORMAL, get_scheduler
+from generators.single_flight import COALESCE_ENABLED, get_single_flight
+from generators.streaming import STREAM_CHUNK_SIZE, Base64FieldDecoder
+from utils.metrics import get_metrics, stage_timer
+
+# Conexões simultâneas por cliente assíncrono
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", str(DEFAULT_POOL_MAXSIZE * 8)))
+
+# Clientes assíncronos ficam presos ao event loop em que foram criados
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def _get_http_client() -> Any:
+    """Retorna o `httpx.AsyncClient` compartilhado do event loop atual"""
+
+    import httpx
+
+    clients = _loop_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(("http", ""))
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(600.0, connect=5.0),
+        )
+        clients[("http", "")] = client
+    return client
+
+
+def _get_openai_client(api_key: str) -> Any:
+    """Retorna um `openai.AsyncOpenAI` por chave, reutilizando o pool httpx do loop"""
+
+    import openai
+
+    clients = _loop_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(("openai", api_key))
+    if client is None:
+        client = openai.AsyncOpenAI(api_key=api_key, http_client=_get_http_client(), max_retries=0)
+        clients[("openai", api_key)] = client
+    return client
+
+
+async def close_async_clients():
+    """Fecha os clientes (e as conexões keep-alive) do event loop atual"""
+
+    clients = _loop_clients.pop(asyncio.get_running_loop(), {})
+    # Os clientes da OpenAI usam o cliente httpx do loop, fechado aqui
+    http_client = clients.get(("http", ""))
+    if http_client is not None:
+        await http_client.aclose()
+
+
+async def _fetch_image(url: str, timeout: float) -> bytes:
+    """Baixa uma imagem com prazo total de `timeout` segundos"""
+
+    async def fetch() -> bytes:
+        response = await _get_http_client().get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        return response.content
+
+    try:
+        return await asyncio.wait_for(fetch(), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"download excedeu {timeout:.0f}s")
+
+
+async def download_images_async(
+    urls: Sequence[str],
+    timeout: float = DOWNLOAD_TIMEOUT,
+    on_downloaded: Optional[Callable[[int, int], None]] = None,
+) -> Tuple[List[bytes], List[str]]:
+    """
+    Baixa várias imagens concorrentemente mantendo a ordem original
+
+    Args:
+        urls: Endereços das imagens
+        timeout: Prazo de cada download individual
+        on_downloaded: Chamado a cada download concluído, com (concluídos, total)
+
+    Returns:
+        Tupla (imagens baixadas na ordem das URLs, mensagens de erro)
+    """
+
+    completed = 0
+
+    async def fetch(url: str) -> bytes:
+        nonlocal completed
+        try:
+            return await _fetch_image(url, timeout)
+        finally:
+            completed += 1
+            if on_downloaded:
+                on_downloaded(completed, len(urls))
+
+    results = await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
+
+    images = []
+    errors = []
+    for index, result in enumerate(results, start=1):
+        if isinstance(result, BaseException):
+            errors.append(f"imagem {index}: {str(result)}")
+        else:
+            images.append(result)
+
+    return images, errors
+
+
+async def generate_image_async(
+    prompt: str,
+    model: str,
+    api_key: str,
+    quality: str = "hd",
+    size: str = "1024x1024",
+    style: str = "vivid",
+    num_images: int = 1,
+    seed: Optional[int] = None,
+    use_cache: bool = True,
+    progress_callback: Optional[ProgressCallback] = None,
+    session_id: Optional[str] = None,
+    priority: int = PRIORITY_NORMAL,
+    **kwargs
+) -> Dict[str, Any]:
+    """
+    Versão assíncrona de `generate_image` (mesmos argumentos e retorno)
+
+    Args:
+        prompt: Descrição da imagem a ser gerada
+        model: Modelo de IA a usar
+        api_key: Chave da API
+        quality: Qualidade da imagem
+        size: Tamanho da imagem
+        style: Estilo da imagem
+        num_images: Número de imagens a gerar
+        seed: Seed da geração (faz parte da chave do cache)
+        use_cache: Se False, ignora o cache de resultados e chama o provedor
+        progress_callback: Recebe os eventos de progresso (chamado no event loop)
+        session_id: Sessão dona da geração (a fila do escalonador é justa entre sessões)
+        priority: Prioridade na fila do escalonador
+
+    Returns:
+        Dict com success, images (lista de bytes) e error, mais `cached` ou
+        `coalesced` como em `generate_image`
+    """
+
+    generation = GenerationRun(prompt, model, api_key, quality, size, style, num_images, seed, progress_callback)
+
+    # O cache fica em disco: leitura e escrita fora do event loop
+    if use_cache:
+        cached = await asyncio.to_thread(generation.lookup_cache)
+        if cached is not None:
+            return generation.finish_cached(cached)
+
+    async def run(callback: Optional[ProgressCallback]) -> Dict[str, Any]:
+        result = await _run_provider_async(
+            prompt, model, api_key, quality, size, style, num_images, seed,
+            callback, session_id, priority
+        )
+        await asyncio.to_thread(generation.store, result)
+        return result
+
+    coalesced = False
+    if use_cache and COALESCE_ENABLED:
+        result, coalesced = await get_single_flight().run_async(generation.coalesce_key(), run, progress_callback)
+    else:
+        result = await run(progress_callback)
+
+    return generation.finish(result, coalesced)
+
+
+async def _run_provider_async(
+    prompt: str,
+    model: str,
+    api_key: str,
+    quality: str,
+    size: str,
+    style: str,
+    num_images: int,
+    seed: Optional[int],
+    progress_callback: Optional[ProgressCallback],
+    session_id: Optional[str],
+    priority: int,
+) -> Dict[str, Any]:
+    """Gera as imagens pedidas, dividindo em chamadas concorrentes se o modelo exigir"""
+
+    plan = plan_chunks(model, num_images, seed, progress_callback)
+    results = await asyncio.gather(*[
+        _call_provider_async(
+            prompt, model, api_key, quality, size, style, count, part_seed,
+            callback, session_id, priority
+        )
+        for count, part_seed, callback in plan
+    ])
+    if len(results) == 1:
+        return results[0]
+    return merge_results(list(results), num_images)
+
+
+async def _call_provider_async(
+    prompt: str,
+    model: str,
+    api_key: str,
+    quality: str,
+    size: str,
+    style: str,
+    num_images: int,
+    seed: Optional[int],
+    progress_callback: Optional[ProgressCallback],
+    session_id: Optional[str],
+    priority: int,
+) -> Dict[str, Any]:
+    """Faz uma chamada ao provedor com uma vaga do escalonador do processo"""
+
+    function = ASYNC_PROVIDER_FUNCTIONS.get(get_provider(model))
+    if function is None:
+        return unsupported_model_result(model)
+
+    try:
+        async with get_scheduler().slot_async(
+            **scheduler_slot_args(model, num_images, session_id, priority, progress_callback)
+        ):
+            return await function(**provider_call_args(
+                model, prompt, api_key, quality, size, style, num_images, seed, progress_callback
+            ))
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "images": []
+        }
+
+
+async def generate_with_dalle_async(
+    prompt: str,
+    api_key: str,
+    model: str,
+    quality: str,
+    size: str,
+    style: str,
+    num_images: int,
+    progress_callback: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """Gera imagem usando DALL-E (assíncrono)"""
+
+    try:
+        client = _get_openai_client(api_key)
+
+        emit_progress(progress_callback, "submitted", "Enviado para o DALL-E", SUBMITTED_PROGRESS)
+        params = build_dalle_params(prompt, model, quality, size, style, num_images)
+
+        if params["response_format"] == "b64_json":
+            on_decoded = download_progress(progress_callback)
+
+            async def request() -> List[bytes]:
+                submitted = time.perf_counter()
+                async with client.images.with_streaming_response.generate(**params) as response:
+                    get_metrics().observe(
+                        "stage_seconds", time.perf_counter() - submitted,
+                        provider="openai", model=model, stage="submit"
+                    )
+                    with stage_timer("decode", "openai", model):
+                        decoder = Base64FieldDecoder("b64_json")
+                        async for chunk in response.iter_bytes(STREAM_CHUNK_SIZE):
+                            for _ in decoder.feed(chunk):
+                                if on_decoded:
+                                    on_decoded(len(decoder.images), params["n"])
+                    return decoder.images
+
+            images = await call_with_retry_async("openai", api_key, request)
+            return build_download_result(images, [], params["n"])
+
+        async def request():
+            with stage_timer("submit", "openai", model):
+                return await client.images.generate(**params)
+
+        response = await call_with_retry_async("openai", api_key, request)
+
+        urls = [image_data.url for image_data in response.data]
+        emit_progress(progress_callback, "polling", "DALL-E concluiu, baixando imagens", DOWNLOAD_PROGRESS_START)
+        with stage_timer("download", "openai", model):
+            images, errors = await download_images_async(
+                urls, on_downloaded=download_progress(progress_callback)
+            )
+
+        return build_download_result(images, errors, len(urls))
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Erro DALL-E: {str(e)}",
+            "images": []
+        }
+
+
+async def generate_with_stability_async(
+    prompt: str,
+    api_key: str,
+    size: str,
+    num_images: int,
+    seed: Optional[int] = None,
+    progress_callback: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """Gera imagem usando Stability AI (assíncrono)"""
+
+    try:
+        url, headers, body = build_stability_request(prompt, api_key, size, num_images, seed)
+        emit_progress(progress_callback, "submitted", "Enviado para a Stability AI", SUBMITTED_PROGRESS)
+        on_decoded = download_progress(progress_callback)
+
+        async def post() -> Tuple[int, List[bytes]]:
+            submitted = time.perf_counter()
+            async with _get_http_client().stream("POST", url, headers=headers, json=body) as response:
+                get_metrics().observe(
+                    "stage_seconds", time.perf_counter() - submitted,
+                    provider="stability", model=STABILITY_MODEL_NAME, stage="submit"
+                )
+                raise_for_retryable(response)
+                if response.status_code != 200:
+                    return response.status_code, []
+
+                chunks = response.aiter_bytes(STREAM_CHUNK_SIZE)
+                with stage_timer("decode", "stability", STABILITY_MODEL_NAME):
+                    if headers["Accept"] == "image/png":
+                        images = [b"".join([chunk async for chunk in chunks])]
+                        if on_decoded:
+                            on_decoded(1, 1)
+                        return response.status_code, images
+
+                    decoder = Base64FieldDecoder("base64")
+                    async for chunk in chunks:
+                        for _ in decoder.feed(chunk):
+                            if on_decoded:
+                                on_decoded(len(decoder.images), num_images)
+                    return response.status_code, decoder.images
+
+        status, images = await call_with_retry_async("stability", api_key, post)
+
+        if status != 200:
+            return {
+                "success": False,
+                "error": f"Stability API error: {status}",
+                "images": []
+            }
+
+        return build_download_result(images, [], num_images)
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Erro Stability: {str(e)}",
+            "images": []
+        }
+
+
+async def generate_with_replicate_async(
+    prompt: str,
+    api_key: str,
+    size: str,
+    num_images: int,
+    seed: Optional[int] = None,
+    progress_callback: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """Gera imagem usando Replicate (assíncrono, via API HTTP de predições)"""
+
+    try:
+        client = _get_http_client()
+        headers = {"Authorization": f"Bearer {api_key}"}
+
+        async def request(method: str, url: str, ok: Tuple[int, ...], **kwargs) -> Dict[str, Any]:
+            response = await client.request(method, url, headers=headers, **kwargs)
+            raise_for_retryable(response)
+            if response.status_code not in ok:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            return response.json()
+
+        body = {
+            "version": REPLICATE_MODEL_VERSION,
+            "input": build_replicate_input(prompt, size, num_images, seed),
+        }
+
+        async def create() -> Dict[str, Any]:
+            with stage_timer("submit", "replicate", REPLICATE_MODEL_NAME):
+                return await request("POST", f"{PROVIDER_BASE_URLS['replicate']}/v1/predictions", (200, 201), json=body)
+
+        prediction = await call_with_retry_async("replicate", api_key, create)
+        emit_progress(progress_callback, "submitted", "Enviado para o Replicate", SUBMITTED_PROGRESS)
+
+        # Aguardar a predição terminar (fila + execução no provedor)
+        polling_started = time.perf_counter()
+        while prediction["status"] not in ("succeeded", "failed", "canceled"):
+            percentage = (prediction.get("progress") or {}).get("percentage")
+            emit_progress(
+                progress_callback,
+                "polling",
+                f"Replicate: {prediction['status']}",
+                SUBMITTED_PROGRESS + (POLLING_PROGRESS - SUBMITTED_PROGRESS) * (percentage or 0),
+                status=prediction["status"]
+            )
+            await asyncio.sleep(REPLICATE_POLL_INTERVAL)
+            prediction = await call_with_retry_async(
+                "replicate",
+                api_key,
+                lambda: request("GET", prediction["urls"]["get"], (200,)),
+                limited=False,
+            )
+
+        get_metrics().observe(
+            "stage_seconds", time.perf_counter() - polling_started,
+            provider="replicate", model=REPLICATE_MODEL_NAME, stage="poll"
+        )
+
+        if prediction["status"] != "succeeded":
+            raise RuntimeError(prediction.get("error") or f"predição {prediction['status']}")
+
+        output = prediction.get("output") or []
+        urls = [output] if isinstance(output, str) else list(output)
+        emit_progress(progress_callback, "polling", "Replicate: succeeded", DOWNLOAD_PROGRESS_START, status="succeeded")
+        with stage_timer("download", "replicate", REPLICATE_MODEL_NAME):
+            images, errors = await download_images_async(
+                urls, on_downloaded=download_progress(progress_callback)
+            )
+
+        return build_download_result(images, errors, len(urls))
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Erro Replicate: {str(e)}",
+            "images": []
+        }
+
+
+# Função assíncrona de cada provedor (como `PROVIDER_FUNCTIONS`)
+ASYNC_PROVIDER_FUNCTIONS = {
+    "openai": generate_with_dalle_async,
+    "stability": generate_with_stability_async,
+    "replicate": generate_with_replicate_async,
+}
+
+
+class _BackgroundLoop:
+    """Event loop dedicado em uma thread, usado pelo wrapper síncrono"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever,
+            name="async-generator-loop",
+            daemon=True,
+        )
+        self.thread.start()
+        atexit.register(self.close)
+
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def close(self):
+        """Fecha os clientes do loop e o encerra"""
+
+        try:
+            self.run(close_async_clients(), timeout=5)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+_background_loop: Optional[_BackgroundLoop] = None
+_background_loop_lock = threading.Lock()
+
+
+def _get_background_loop() -> _BackgroundLoop:
+    """Retorna o event loop de fundo compartilhado pelo processo"""
+
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                _background_loop = _BackgroundLoop()
+    return _background_loop
+
+
+def generate_image_sync(*args, **kwargs) -> Dict[str, Any]:
+    """
+    Executa `generate_image_async` a partir de código síncrono
+
+    As chamadas rodam em um event loop persistente, então os clientes
+    assíncronos (e suas conexões keep-alive) são reaproveitados entre chamadas.
+    """
+
+    return _get_background_loop().run(generate_image_async(*args, **kwargs))
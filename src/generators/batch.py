@@ -0,0 +1,347 @@
+"""
+Geração em lote a partir de um arquivo de prompts (JSONL ou CSV)
+
+Cada linha do arquivo descreve uma geração (prompt, model, size, quality,
+style, num_images, template, seed e um id opcional). As linhas rodam
+concorrentemente em um único event loop (`generate_image_async`), com limite
+de linhas em andamento e de concorrência por provedor. Cada linha
+concluída é registrada em `manifest.jsonl` no diretório de saída; ao retomar
+um lote interrompido, as linhas já concluídas com sucesso são puladas (e não
+são pagas de novo). Linhas sem `id` são identificadas pelo conteúdo, então
+inserir ou reordenar linhas não muda o id das demais.
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from generators.async_generator import close_async_clients, generate_image_async
+from generators.clients import get_env_api_keys
+from generators.image_generator import get_provider
+from generators.scheduler import PRIORITY_LOW
+from utils.prompt_templates import get_template_prompt
+
+# Número de linhas em andamento ao mesmo tempo
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+
+# Chamadas simultâneas por provedor
+BATCH_PROVIDER_LIMITS = {
+    "openai": int(os.getenv("BATCH_LIMIT_OPENAI", "4")),
+    "stability": int(os.getenv("BATCH_LIMIT_STABILITY", "4")),
+    "replicate": int(os.getenv("BATCH_LIMIT_REPLICATE", "4")),
+}
+
+# Valores usados quando a linha não informa o campo
+BATCH_DEFAULTS = {
+    "model": "DALL-E 3",
+    "size": "1024x1024",
+    "quality": "hd",
+    "style": "vivid",
+    "num_images": 1,
+    "template": "Personalizado",
+    "seed": None,
+}
+
+MANIFEST_FILE = "manifest.jsonl"
+SUMMARY_FILE = "summary.json"
+
+
+def load_prompt_file(path: str) -> List[Dict[str, Any]]:
+    """
+    Lê o arquivo de prompts
+
+    Args:
+        path: Arquivo `.jsonl` (um objeto por linha) ou `.csv` (com cabeçalho)
+
+    Returns:
+        Lista de linhas com os valores padrão aplicados e um `id` estável
+        (derivado do conteúdo da linha quando o arquivo não informa)
+    """
+
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            raw_rows = [row for row in csv.DictReader(f)]
+    else:
+        with open(path, encoding="utf-8") as f:
+            raw_rows = [json.loads(line) for line in f if line.strip()]
+
+    rows = []
+    seen: Dict[str, int] = {}
+    for index, raw in enumerate(raw_rows):
+        # Campos vazios no CSV valem como "não informado"
+        raw = {key: value for key, value in raw.items() if value not in (None, "")}
+        if not raw.get("prompt"):
+            raise ValueError(f"linha {index + 1}: campo 'prompt' obrigatório")
+
+        row = dict(BATCH_DEFAULTS)
+        row.update(raw)
+        row["num_images"] = int(row["num_images"])
+        row["seed"] = int(row["seed"]) if row["seed"] is not None else None
+
+        if "id" not in raw:
+            digest = hashlib.sha256(
+                json.dumps(raw, sort_keys=True, ensure_ascii=False).encode("utf-8")
+            ).hexdigest()[:16]
+            # Linhas repetidas são gerações distintas: numerar as cópias
+            seen[digest] = seen.get(digest, 0) + 1
+            row["id"] = digest if seen[digest] == 1 else f"{digest}-{seen[digest]}"
+        row["id"] = str(row["id"])
+        rows.append(row)
+
+    return rows
+
+
+def build_row_prompt(row: Dict[str, Any]) -> str:
+    """Aplica o template da linha ao prompt, como na interface"""
+
+    template_prompt = get_template_prompt(row.get("template") or "")
+    if template_prompt:
+        return f"{template_prompt}, {row['prompt']}"
+    return row["prompt"]
+
+
+def read_completed(output_dir: Path) -> Set[str]:
+    """Ids das linhas já concluídas com sucesso em execuções anteriores"""
+
+    manifest = output_dir / MANIFEST_FILE
+    if not manifest.is_file():
+        return set()
+
+    completed = set()
+    with open(manifest, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Última linha pode estar truncada se o processo foi morto
+                continue
+            if record.get("status") == "success":
+                completed.add(record["id"])
+    return completed
+
+
+def run_batch(
+    prompt_file: str,
+    output_dir: str,
+    api_keys: Optional[Dict[str, Optional[str]]] = None,
+    max_workers: int = BATCH_WORKERS,
+    provider_limits: Optional[Dict[str, int]] = None,
+    use_cache: bool = True,
+    on_row_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Executa um lote de gerações (em um event loop próprio)
+
+    Args:
+        prompt_file: Arquivo de prompts (JSONL ou CSV)
+        output_dir: Diretório das imagens, do manifesto e do resumo
+        api_keys: Dict provedor -> chave (padrão: variáveis de ambiente)
+        max_workers: Linhas em andamento ao mesmo tempo
+        provider_limits: Chamadas simultâneas por provedor
+        use_cache: Usa o cache de resultados
+        on_row_done: Chamado a cada linha concluída com o registro do manifesto
+
+    Returns:
+        Resumo com total, concluídas, puladas, parciais, falhas e tempo
+    """
+
+    async def run() -> Dict[str, Any]:
+        try:
+            return await run_batch_async(
+                prompt_file, output_dir, api_keys, max_workers, provider_limits, use_cache, on_row_done
+            )
+        finally:
+            await close_async_clients()
+
+    return asyncio.run(run())
+
+
+async def run_batch_async(
+    prompt_file: str,
+    output_dir: str,
+    api_keys: Optional[Dict[str, Optional[str]]] = None,
+    max_workers: int = BATCH_WORKERS,
+    provider_limits: Optional[Dict[str, int]] = None,
+    use_cache: bool = True,
+    on_row_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Versão assíncrona de `run_batch`, para quem já tem um event loop"""
+
+    rows = load_prompt_file(prompt_file)
+    api_keys = api_keys if api_keys is not None else get_env_api_keys()
+    limits = dict(BATCH_PROVIDER_LIMITS)
+    limits.update(provider_limits or {})
+
+    out = Path(output_dir)
+    images_dir = out / "images"
+    images_dir.mkdir(parents=True, exist_ok=True)
+
+    completed = read_completed(out)
+    pending = [row for row in rows if row["id"] not in completed]
+
+    workers = asyncio.Semaphore(max(1, max_workers))
+    semaphores = {provider: asyncio.Semaphore(max(1, limit)) for provider, limit in limits.items()}
+
+    def save_images(row: Dict[str, Any], images: List[bytes]) -> List[str]:
+        from utils.transcode import detect_format, mime_for
+
+        files = []
+        for index, image in enumerate(images, start=1):
+            # Extensão do formato real (PNG, JPEG ou WebP, conforme o provedor)
+            name = f"{row['id']}_{index}.{mime_for(detect_format(image))[1]}"
+            (images_dir / name).write_bytes(image)
+            files.append(f"images/{name}")
+        return files
+
+    async def process(row: Dict[str, Any]) -> Dict[str, Any]:
+        model = row["model"]
+        provider = get_provider(model)
+
+        async with workers:
+            started = time.perf_counter()
+            async with semaphores.get(provider) or asyncio.Semaphore(max_workers):
+                result = await generate_image_async(
+                    prompt=build_row_prompt(row),
+                    model=model,
+                    api_key=api_keys.get(provider) or "",
+                    quality=row["quality"],
+                    size=row["size"],
+                    style=row["style"],
+                    num_images=row["num_images"],
+                    seed=row["seed"],
+                    use_cache=use_cache,
+                    priority=PRIORITY_LOW
+                )
+
+            files = await asyncio.to_thread(save_images, row, result.get("images", []))
+
+        # Menos imagens que o pedido não conta como concluída: a linha é
+        # gerada de novo ao retomar o lote
+        if not result["success"]:
+            status = "error"
+        elif len(files) < row["num_images"]:
+            status = "partial"
+        else:
+            status = "success"
+
+        return {
+            "id": row["id"],
+            "status": status,
+            "prompt": row["prompt"],
+            "model": model,
+            "size": row["size"],
+            "quality": row["quality"],
+            "style": row["style"],
+            "template": row["template"],
+            "seed": row["seed"],
+            "num_images": row["num_images"],
+            "files": files,
+            "error": result.get("error"),
+            "cached": bool(result.get("cached")),
+            "latency": round(time.perf_counter() - started, 3),
+            "timestamp": time.time(),
+        }
+
+    async def process_safely(row: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return await process(row)
+        except Exception as e:
+            return {
+                "id": row["id"],
+                "status": "error",
+                "prompt": row["prompt"],
+                "model": row["model"],
+                "files": [],
+                "error": str(e),
+                "timestamp": time.time(),
+            }
+
+    def record(entry: Dict[str, Any]):
+        # Grava e força para o disco: é o checkpoint usado ao retomar
+        with open(out / MANIFEST_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    started = time.perf_counter()
+    succeeded = 0
+    partial = 0
+    failed = 0
+
+    # Os registros são gravados um de cada vez, na ordem em que terminam
+    for next_done in asyncio.as_completed([process_safely(row) for row in pending]):
+        entry = await next_done
+        await asyncio.to_thread(record, entry)
+        if entry["status"] == "success":
+            succeeded += 1
+        elif entry["status"] == "partial":
+            partial += 1
+        else:
+            failed += 1
+        if on_row_done:
+            on_row_done(entry)
+
+    summary = {
+        "prompt_file": str(prompt_file),
+        "total": len(rows),
+        "skipped": len(rows) - len(pending),
+        "succeeded": succeeded,
+        "partial": partial,
+        "failed": failed,
+        "elapsed": round(time.perf_counter() - started, 3),
+    }
+    (out / SUMMARY_FILE).write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+    return summary
+
+
+def describe_row(entry: Dict[str, Any]) -> str:
+    """Linha de progresso de um registro do manifesto"""
+
+    if entry["status"] == "success":
+        mark = "ok"
+    elif entry["status"] == "partial":
+        mark = f"PARCIAL ({len(entry['files'])} de {entry['num_images']} imagens): {entry['error']}"
+    else:
+        mark = f"ERRO: {entry['error']}"
+    return f"[{entry['id']}] {entry['model']}: {mark}"
+
+
+def batch_succeeded(summary: Dict[str, Any]) -> bool:
+    """Se todas as linhas pendentes foram concluídas com todas as imagens"""
+    return summary["failed"] == 0 and summary["partial"] == 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Ponto de entrada de linha de comando: python -m generators.batch"""
+
+    parser = argparse.ArgumentParser(description="Geração de imagens em lote")
+    parser.add_argument("prompt_file", help="Arquivo de prompts (.jsonl ou .csv)")
+    parser.add_argument("output_dir", help="Diretório de saída")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Linhas em andamento ao mesmo tempo")
+    parser.add_argument("--no-cache", action="store_true", help="Ignora o cache de resultados")
+    args = parser.parse_args(argv)
+
+    def report(entry: Dict[str, Any]):
+        print(describe_row(entry), flush=True)
+
+    summary = run_batch(
+        args.prompt_file,
+        args.output_dir,
+        max_workers=args.workers,
+        use_cache=not args.no_cache,
+        on_row_done=report,
+    )
+    print(json.dumps(summary, indent=2))
+    return 0 if batch_succeeded(summary) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
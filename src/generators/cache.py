@@ -0,0 +1,277 @@
+"""
+Cache em disco de resultados de geração, endereçado pelo conteúdo da requisição
+
+Gerar de novo o mesmo prompt com os mesmos parâmetros devolve as imagens
+salvas em milissegundos, sem chamar (nem pagar) o provedor outra vez. As
+imagens ficam no armazenamento endereçado por conteúdo (`utils.blob_store`),
+o mesmo do histórico, e o cache guarda só as referências: uma imagem em cache
+e no histórico ocupa uma única cópia em disco. As entradas são removidas por
+LRU quando o cache passa do orçamento de bytes e, opcionalmente, quando ficam
+mais velhas que o TTL configurado.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from utils.blob_store import BlobStore, QuotaExceededError, get_blob_store
+from utils.metrics import get_metrics
+from utils.paths import get_data_dir
+
+# Orçamento total do cache em bytes (padrão: 500 MB)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+
+# Tempo de vida das entradas em segundos (0 = sem expiração)
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "0"))
+
+META_FILE = "meta.json"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normaliza espaços e caixa do prompt para a chave do cache"""
+    return " ".join(prompt.split()).casefold()
+
+
+def make_cache_key(
+    prompt: str,
+    model: str,
+    size: str,
+    quality: str,
+    style: str,
+    num_images: int,
+    seed: Optional[int] = None,
+) -> str:
+    """
+    Calcula a chave de cache de uma requisição de geração
+
+    Returns:
+        Hash SHA-256 hexadecimal dos parâmetros normalizados
+    """
+
+    payload = {
+        "prompt": normalize_prompt(prompt),
+        "model": model,
+        "size": size,
+        "quality": quality,
+        "style": style,
+        "num_images": int(num_images),
+        "seed": seed,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache LRU em disco de resultados de `generate_image`
+
+    Cada entrada é um diretório `<chave>/` com `meta.json`, que lista as
+    referências das imagens no armazenamento. O horário de modificação de
+    `meta.json` marca o último acesso. O orçamento conta os bytes das imagens
+    referenciadas; elas saem do disco pela limpeza de órfãos do
+    armazenamento quando nem o cache nem o histórico as referenciam mais.
+
+    Args:
+        root: Diretório do cache
+        max_bytes: Orçamento total em bytes
+        ttl: Tempo de vida das entradas em segundos (0 = sem expiração)
+        blobs: Armazenamento das imagens (padrão: o compartilhado)
+    """
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        ttl: float = RESULT_CACHE_TTL,
+        blobs: Optional[BlobStore] = None,
+    ):
+        self.root = Path(root) if root else get_data_dir("result_cache")
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.blobs = blobs or get_blob_store()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # chave -> (bytes, criado_em, referências); a ordem é a de uso (mais antigo primeiro)
+        self._index: "OrderedDict[str, Tuple[int, float, List[str]]]" = OrderedDict()
+        self._total_bytes = 0
+        self._load_index()
+        self.blobs.add_ref_source(self.refs)
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / key
+
+    def _load_index(self):
+        """Reconstrói o índice LRU a partir das entradas já salvas em disco"""
+
+        entries = []
+        for entry_dir in self.root.iterdir():
+            meta_path = entry_dir / META_FILE
+            if not meta_path.is_file():
+                # Entradas incompletas (escrita interrompida) são descartadas
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+                # Entradas antigas, com cópias das imagens, também são descartadas
+                refs = meta["refs"]
+                entries.append((meta_path.stat().st_mtime, entry_dir.name, meta["bytes"], meta["created_at"], refs))
+            except (OSError, ValueError, KeyError):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+        for _, key, size, created_at, refs in sorted(entries):
+            self._index[key] = (size, created_at, refs)
+            self._total_bytes += size
+
+    def _is_expired(self, created_at: float) -> bool:
+        return bool(self.ttl) and time.time() - created_at > self.ttl
+
+    def _remove(self, key: str):
+        """Remove uma entrada do índice e do disco (chamar com o lock)"""
+        size, _, _ = self._index.pop(key)
+        self._total_bytes -= size
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca um resultado no cache
+
+        Returns:
+            Dict no formato de `generate_image` (com `cached=True`) ou None
+        """
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or self._is_expired(entry[1]):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            refs = entry[2]
+
+        try:
+            images = [self.blobs.read_bytes(ref) for ref in refs]
+            os.utime(self._entry_dir(key) / META_FILE)
+        except OSError:
+            with self._lock:
+                if key in self._index:
+                    self._remove(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+
+        return {
+            "success": True,
+            "images": images,
+            "error": None,
+            "cached": True,
+        }
+
+    def contains(self, key: str) -> bool:
+        """Indica se há uma entrada válida para a chave (sem contar acerto ou falha)"""
+        with self._lock:
+            entry = self._index.get(key)
+            return entry is not None and not self._is_expired(entry[1])
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """Salva um resultado bem-sucedido e completo no cache"""
+
+        images = result.get("images") or []
+        if not result.get("success") or result.get("error") or not images:
+            return
+
+        size = sum(len(image) for image in images)
+        if size > self.max_bytes:
+            return
+
+        # Imagens já armazenadas (por exemplo, no histórico) não são copiadas
+        try:
+            refs = [self.blobs.put(image) for image in images]
+        except QuotaExceededError:
+            return
+
+        # Escreve em um diretório temporário e renomeia (escrita atômica)
+        tmp_dir = self.root / f".tmp-{key}-{threading.get_ident()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+        created_at = time.time()
+        meta = {"refs": refs, "bytes": size, "created_at": created_at}
+        (tmp_dir / META_FILE).write_text(json.dumps(meta), encoding="utf-8")
+
+        with self._lock:
+            if key in self._index:
+                self._remove(key)
+            try:
+                os.replace(tmp_dir, self._entry_dir(key))
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            self._index[key] = (size, created_at, refs)
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Remove as entradas menos usadas até caber no orçamento (com o lock)"""
+        while self._total_bytes > self.max_bytes and self._index:
+            oldest = next(iter(self._index))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def refs(self) -> Iterator[str]:
+        """Referências das imagens em cache (preservadas pela limpeza de órfãos)"""
+        with self._lock:
+            entries = list(self._index.values())
+        for _, _, refs in entries:
+            yield from refs
+
+    def clear(self):
+        """Remove todas as entradas do cache"""
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna contadores de uso do cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Retorna o cache de resultados compartilhado pelo processo"""
+
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache()
+                get_metrics().register_collector(_cache_gauges)
+    return _result_cache
+
+
+def _cache_gauges():
+    """Contadores do cache para a exposição de métricas"""
+
+    for field, value in get_result_cache().stats().items():
+        yield f"result_cache_{field}", {}, value
@@ -0,0 +1,111 @@
+"""
+Capacidades de cada modelo e divisão de pedidos em várias chamadas
+
+Alguns modelos geram poucas imagens por chamada (o DALL-E 3 só gera uma).
+Pedidos maiores são divididos em partes que cabem no limite do modelo,
+executadas em paralelo, e os resultados são combinados em um só, relatando
+as partes que falharam.
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+# Máximo de imagens que cada modelo gera em uma única chamada
+MAX_IMAGES_PER_CALL = {
+    "DALL-E 3": 1,
+    "DALL-E 2": 10,
+    "Stable Diffusion XL": 10,
+    "Midjourney (Replicate)": 4,
+}
+
+# Como as imagens voltam de cada provedor:
+# - openai: "b64_json" (imagem no corpo da resposta) ou "url" (download extra)
+# - stability: "png" (corpo binário, 1 imagem por chamada) ou "json" (base64)
+RESPONSE_MODE_CHOICES = {
+    "openai": ("b64_json", "url"),
+    "stability": ("png", "json"),
+}
+RESPONSE_MODES = {
+    "openai": os.getenv("DALLE_RESPONSE_FORMAT", "b64_json"),
+    "stability": os.getenv("STABILITY_RESPONSE_MODE", "png"),
+}
+
+
+def get_response_mode(provider: str) -> Optional[str]:
+    """Modo de retorno configurado para o provedor (None se não houver escolha)"""
+    return RESPONSE_MODES.get(provider)
+
+
+def max_images_per_call(model: str) -> int:
+    """Máximo de imagens por chamada do modelo (1 se desconhecido)"""
+
+    # O retorno binário da Stability traz uma única imagem por resposta
+    if model == "Stable Diffusion XL" and get_response_mode("stability") == "png":
+        return 1
+    return MAX_IMAGES_PER_CALL.get(model, 1)
+
+
+def split_num_images(model: str, num_images: int) -> List[int]:
+    """
+    Divide o número de imagens pedido em partes que o modelo aceita
+
+    Examples:
+        >>> split_num_images("DALL-E 3", 3)
+        [1, 1, 1]
+        >>> split_num_images("Midjourney (Replicate)", 6)
+        [4, 2]
+    """
+
+    limit = max_images_per_call(model)
+    num_images = max(1, int(num_images))
+    chunks = [limit] * (num_images // limit)
+    if num_images % limit:
+        chunks.append(num_images % limit)
+    return chunks
+
+
+def chunk_seed(seed: Optional[int], offset: int) -> Optional[int]:
+    """
+    Seed de uma parte do pedido
+
+    Cada parte usa `seed + offset` (offset = imagens das partes anteriores)
+    para não repetir a mesma imagem em todas as partes, mantendo o resultado
+    reproduzível para um mesmo seed.
+    """
+
+    return None if seed is None else seed + offset
+
+
+def merge_results(results: List[Dict[str, Any]], requested: int) -> Dict[str, Any]:
+    """
+    Combina os resultados das partes de um pedido dividido
+
+    Args:
+        results: Resultados das partes, na ordem em que foram divididas
+        requested: Total de imagens pedido
+
+    Returns:
+        Dict no formato de `generate_image`. Se ao menos uma imagem foi
+        gerada, `success` é True e `error` descreve as partes que falharam.
+    """
+
+    images = [image for result in results for image in result.get("images", [])]
+    errors = [result["error"] for result in results if result.get("error")]
+
+    if not images:
+        return {
+            "success": False,
+            "error": "; ".join(dict.fromkeys(errors)) or "Nenhuma imagem gerada",
+            "images": []
+        }
+
+    error = None
+    if len(images) < requested or errors:
+        missing = requested - len(images)
+        error = f"{missing} de {requested} imagens falharam: " + "; ".join(dict.fromkeys(errors))
+
+    return {
+        "success": True,
+        "images": images,
+        "error": error
+    }
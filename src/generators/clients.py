@@ -0,0 +1,284 @@
+"""
+Camada de clientes HTTP/SDK reutilizáveis para os provedores de imagem
+
+Mantém sessões `requests.Session` com keep-alive e clientes de SDK (OpenAI,
+Replicate) por provedor e por chave de API, compartilhados entre sessões do
+Streamlit e threads do mesmo processo. Assim cada geração reaproveita
+conexões TCP/TLS já abertas em vez de refazer o handshake.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Optional, Tuple
+
+if TYPE_CHECKING:
+    import requests
+
+# Configurações padrão (podem ser sobrescritas por variáveis de ambiente)
+DEFAULT_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+DEFAULT_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+DEFAULT_IDLE_TIMEOUT = float(os.getenv("HTTP_POOL_IDLE_TIMEOUT", "300"))
+
+# URLs base dos provedores (configuráveis para proxies ou servidores locais)
+PROVIDER_BASE_URLS = {
+    "openai": os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+    "stability": os.getenv("STABILITY_API_BASE", "https://api.stability.ai"),
+    "replicate": os.getenv("REPLICATE_API_BASE", "https://api.replicate.com"),
+}
+
+# Variável de ambiente com a chave de cada provedor
+PROVIDER_ENV_KEYS = {
+    "openai": "OPENAI_API_KEY",
+    "stability": "STABILITY_API_KEY",
+    "replicate": "REPLICATE_API_TOKEN",
+}
+
+
+def _key_fingerprint(api_key: Optional[str]) -> str:
+    """Gera um identificador estável da chave sem guardá-la em claro"""
+    if not api_key:
+        return "anonymous"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class _PoolEntry:
+    """Cliente armazenado no pool junto com seu horário de último uso"""
+
+    def __init__(
+        self,
+        client: Any,
+        close: Callable[[], None],
+        warm: Optional[Callable[[float], Any]] = None,
+    ):
+        self.client = client
+        self.close = close
+        self.warm = warm
+        self.last_used = time.monotonic()
+
+
+class ClientPool:
+    """
+    Pool de clientes por provedor e por chave de API
+
+    Args:
+        pool_connections: Número de pools de conexão por sessão (um por host)
+        pool_maxsize: Máximo de conexões keep-alive por host
+        idle_timeout: Segundos sem uso até o cliente ser descartado
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+        self._entries: Dict[Tuple[str, str, str], _PoolEntry] = {}
+        self._lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+
+    def _get_entry(
+        self,
+        kind: str,
+        provider: str,
+        api_key: Optional[str],
+        factory: Callable[[], _PoolEntry],
+    ) -> _PoolEntry:
+        """Busca um cliente no pool ou cria um novo de forma thread-safe"""
+
+        key = (kind, provider, _key_fingerprint(api_key))
+        self._maybe_evict()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = factory()
+                self._entries[key] = entry
+            entry.last_used = time.monotonic()
+            return entry
+
+    def _session_entry(self, provider: str, api_key: Optional[str]) -> _PoolEntry:
+        """Entrada do pool com a sessão `requests` do provedor"""
+
+        def factory() -> _PoolEntry:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            base_url = PROVIDER_BASE_URLS.get(provider)
+            warm = None
+            if base_url:
+                warm = lambda timeout: session.head(base_url, timeout=timeout)  # noqa: E731
+            return _PoolEntry(session, session.close, warm)
+
+        return self._get_entry("session", provider, api_key, factory)
+
+    def _openai_entry(self, api_key: str) -> _PoolEntry:
+        """Entrada do pool com o cliente OpenAI e seu pool httpx próprio"""
+
+        def factory() -> _PoolEntry:
+            import httpx
+            import openai
+
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=self.pool_maxsize,
+                    max_keepalive_connections=self.pool_maxsize,
+                ),
+                timeout=httpx.Timeout(600.0, connect=5.0),
+            )
+            # As novas tentativas ficam com generators.rate_limit (respeita a cota)
+            client = openai.OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+            base_url = str(client.base_url)
+            return _PoolEntry(
+                client,
+                client.close,
+                lambda timeout: http_client.head(base_url, timeout=timeout),
+            )
+
+        return self._get_entry("sdk", "openai", api_key, factory)
+
+    def get_session(self, provider: str, api_key: Optional[str] = None) -> "requests.Session":
+        """Retorna uma sessão HTTP keep-alive para o provedor e chave informados"""
+        return self._session_entry(provider, api_key).client
+
+    def get_openai_client(self, api_key: str) -> Any:
+        """Retorna um cliente OpenAI reutilizável para a chave informada"""
+        return self._openai_entry(api_key).client
+
+    def get_replicate_client(self, api_key: str) -> Any:
+        """Retorna um cliente Replicate reutilizável para a chave informada"""
+
+        def factory() -> _PoolEntry:
+            import replicate
+
+            kwargs = {}
+            if os.getenv("REPLICATE_API_BASE"):
+                kwargs["base_url"] = PROVIDER_BASE_URLS["replicate"]
+            client = replicate.Client(api_token=api_key, **kwargs)
+            return _PoolEntry(client, lambda: None)
+
+        return self._get_entry("sdk", "replicate", api_key, factory).client
+
+    def _maybe_evict(self):
+        """Executa a limpeza de clientes ociosos no máximo uma vez por minuto"""
+        now = time.monotonic()
+        if now - self._last_eviction >= min(60.0, self.idle_timeout):
+            self.evict_idle()
+
+    def evict_idle(self) -> int:
+        """
+        Fecha e remove clientes sem uso há mais de `idle_timeout` segundos
+
+        Returns:
+            Número de clientes removidos
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self._last_eviction = now
+            expired = [
+                key for key, entry in self._entries.items()
+                if now - entry.last_used > self.idle_timeout
+            ]
+            entries = [self._entries.pop(key) for key in expired]
+
+        for entry in entries:
+            try:
+                entry.close()
+            except Exception:
+                pass
+
+        return len(entries)
+
+    def warm_up(
+        self,
+        provider_keys: Iterable[Tuple[str, Optional[str]]],
+        timeout: float = 5.0,
+    ) -> Dict[str, bool]:
+        """
+        Abre conexões antecipadamente para os provedores informados
+
+        Args:
+            provider_keys: Pares (provedor, chave de API)
+            timeout: Tempo máximo de cada conexão de aquecimento
+
+        Returns:
+            Dict provedor -> se a conexão foi estabelecida
+        """
+
+        def warm(provider: str, api_key: Optional[str]) -> bool:
+            try:
+                # A OpenAI usa o pool httpx do SDK; os demais, a sessão HTTP
+                if provider == "openai" and api_key:
+                    entry = self._openai_entry(api_key)
+                else:
+                    entry = self._session_entry(provider, api_key)
+                if entry.warm is None:
+                    return False
+                # Qualquer resposta serve: o objetivo é só completar o handshake
+                entry.warm(timeout)
+                return True
+            except Exception:
+                return False
+
+        pairs = list(provider_keys)
+        if not pairs:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=len(pairs)) as executor:
+            results = executor.map(lambda pair: warm(*pair), pairs)
+            return {provider: ok for (provider, _), ok in zip(pairs, results)}
+
+    def close_all(self):
+        """Fecha todos os clientes do pool"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+
+        for entry in entries:
+            try:
+                entry.close()
+            except Exception:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_client_pool: Optional[ClientPool] = None
+_client_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """Retorna o pool de clientes compartilhado pelo processo"""
+
+    global _client_pool
+    if _client_pool is None:
+        with _client_pool_lock:
+            if _client_pool is None:
+                _client_pool = ClientPool()
+    return _client_pool
+
+
+def get_env_api_keys() -> Dict[str, Optional[str]]:
+    """Retorna as chaves de API definidas no ambiente, por provedor"""
+    return {provider: os.getenv(var) for provider, var in PROVIDER_ENV_KEYS.items()}
+
+
+def warm_up_from_env() -> Dict[str, bool]:
+    """Aquece conexões dos provedores cujas chaves estão no ambiente"""
+
+    pairs = [(provider, key) for provider, key in get_env_api_keys().items() if key]
+    return get_client_pool().warm_up(pairs)
@@ -0,0 +1,157 @@
+"""
+Download concorrente das imagens retornadas pelos provedores
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    import requests
+
+from generators.clients import get_client_pool
+
+# Tempo máximo (em segundos) de cada download individual
+DOWNLOAD_TIMEOUT = float(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", "60"))
+
+# Número máximo de downloads simultâneos no processo
+MAX_DOWNLOAD_WORKERS = int(os.getenv("IMAGE_DOWNLOAD_WORKERS", "8"))
+
+CHUNK_SIZE = 64 * 1024
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Retorna o pool de threads de download compartilhado pelo processo"""
+
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=MAX_DOWNLOAD_WORKERS,
+                    thread_name_prefix="image-download",
+                )
+    return _executor
+
+
+def fetch_image(
+    url: str,
+    session: "requests.Session",
+    timeout: float = DOWNLOAD_TIMEOUT,
+) -> bytes:
+    """
+    Baixa uma imagem respeitando um prazo total para o download
+
+    Args:
+        url: Endereço da imagem
+        session: Sessão HTTP (keep-alive) a usar
+        timeout: Prazo total em segundos (conexão + leitura do corpo),
+            contado a partir do início deste download
+
+    Returns:
+        Bytes da imagem
+    """
+
+    deadline = time.monotonic() + timeout
+
+    with session.get(url, timeout=timeout, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+
+        chunks = []
+        for chunk in response.iter_content(CHUNK_SIZE):
+            chunks.append(chunk)
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"download excedeu {timeout:.0f}s")
+
+    return b"".join(chunks)
+
+
+def download_images(
+    urls: Sequence[str],
+    session: Optional["requests.Session"] = None,
+    timeout: float = DOWNLOAD_TIMEOUT,
+    on_downloaded: Optional[Callable[[int, int], None]] = None,
+) -> Tuple[List[bytes], List[str]]:
+    """
+    Baixa várias imagens em paralelo mantendo a ordem original
+
+    Args:
+        urls: Endereços das imagens
+        session: Sessão HTTP a usar (padrão: sessão de downloads do pool)
+        timeout: Prazo de cada download individual, contado quando ele
+            começa (o tempo esperando vaga no pool compartilhado não conta)
+        on_downloaded: Chamado na thread de quem chamou a função a cada
+            download concluído, com (concluídos, total)
+
+    Returns:
+        Tupla (imagens baixadas na ordem das URLs, mensagens de erro)
+    """
+
+    if not urls:
+        return [], []
+
+    session = session or get_client_pool().get_session("downloads")
+    executor = _get_executor()
+    futures = [executor.submit(fetch_image, url, session, timeout) for url in urls]
+
+    # O prazo é aplicado por download, dentro de `fetch_image`: downloads
+    # parados na fila do pool (atrás de outras chamadas) não estouram
+    for completed, _ in enumerate(as_completed(futures), start=1):
+        if on_downloaded:
+            on_downloaded(completed, len(futures))
+
+    images = []
+    errors = []
+    for index, future in enumerate(futures, start=1):
+        try:
+            images.append(future.result())
+        except Exception as e:
+            errors.append(f"imagem {index}: {str(e)}")
+
+    return images, errors
+
+
+def build_download_result(
+    images: List[bytes],
+    errors: List[str],
+    total: int,
+) -> Dict[str, Any]:
+    """
+    Monta o dict de resultado padrão a partir dos downloads
+
+    Args:
+        images: Imagens obtidas
+        errors: Mensagens das imagens que falharam
+        total: Número de imagens esperado
+
+    Falhas parciais mantêm `success=True` e descrevem o problema em `error`;
+    nenhuma imagem é sempre uma falha.
+    """
+
+    if not images:
+        return {
+            "success": False,
+            "images": [],
+            "error": (
+                "Falha ao baixar imagens: " + "; ".join(errors)
+                if errors else "Nenhuma imagem na resposta do provedor"
+            ),
+        }
+
+    error = None
+    if errors:
+        error = f"{len(errors)} de {total} downloads falharam: " + "; ".join(errors)
+    elif len(images) < total:
+        error = f"{total - len(images)} de {total} imagens não vieram na resposta do provedor"
+
+    return {
+        "success": True,
+        "images": images,
+        "error": error,
+    }
@@ -0,0 +1,25 @@
+"""
+Fan-out: o mesmo prompt enviado a todos os provedores configurados ao mesmo tempo
+
+Cada modelo vira um trabalho em segundo plano separado (`generators.jobs`),
+então o tempo total passa a ser o do provedor mais lento, e não a soma de
+todos, e cada resultado aparece assim que seu provedor termina.
+"""
+
+from typing import Dict, List, Optional
+
+from generators.image_generator import get_provider
+
+# Modelo representante de cada provedor no modo fan-out
+FANOUT_MODELS = ["DALL-E 3", "Stable Diffusion XL", "Midjourney (Replicate)"]
+
+
+def get_fanout_models(api_keys: Dict[str, Optional[str]]) -> List[str]:
+    """
+    Lista os modelos cujo provedor tem chave configurada
+
+    Args:
+        api_keys: Dict provedor -> chave de API
+    """
+
+    return [model for model in FANOUT_MODELS if api_keys.get(get_provider(model))]
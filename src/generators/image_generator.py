@@ -2,12 +2,256 @@
 Módulo principal para geração de imagens usando diferentes APIs de IA
 """
 
-import openai
-import requests
-from PIL import Image
-import io
-import base64
-from typing import Dict, List, Any
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
+
+from generators.cache import get_result_cache, make_cache_key
+from generators.capabilities import (
+    chunk_seed,
+    get_response_mode,
+    max_images_per_call,
+    merge_results,
+    split_num_images,
+)
+from generators.clients import PROVIDER_BASE_URLS, get_client_pool
+from generators.downloads import build_download_result, download_images
+from generators.rate_limit import call_with_retry, raise_for_retryable
+from generators.scheduler import PRIORITY_NORMAL, get_scheduler
+from generators.single_flight import COALESCE_ENABLED, get_single_flight, make_coalesce_key
+from generators.streaming import STREAM_CHUNK_SIZE, Base64FieldDecoder, read_body
+from generators.progress import (
+    DOWNLOAD_PROGRESS_START,
+    POLLING_PROGRESS,
+    SUBMITTED_PROGRESS,
+    ProgressCallback,
+    download_progress,
+    emit_progress,
+    split_progress,
+)
+from utils.metrics import get_metrics, stage_timer
+
+STABILITY_ENGINE = "stable-diffusion-xl-1024-v1-0"
+
+REPLICATE_MODEL = "prompthero/openjourney"
+REPLICATE_MODEL_VERSION = "9936c2001faa2194a261c01381f90e65261879985476014a0a37a334593a05eb"
+
+# Intervalo entre consultas ao status de predições do Replicate
+REPLICATE_POLL_INTERVAL = float(os.getenv("REPLICATE_POLL_INTERVAL", "1.0"))
+
+# Nomes dos modelos na interface (rótulo `model` das métricas)
+STABILITY_MODEL_NAME = "Stable Diffusion XL"
+REPLICATE_MODEL_NAME = "Midjourney (Replicate)"
+
+# Provedor (e chave de API) usado por cada modelo
+MODEL_PROVIDERS = {
+    "DALL-E 3": "openai",
+    "DALL-E 2": "openai",
+    "Stable Diffusion XL": "stability",
+    "Midjourney (Replicate)": "replicate",
+}
+
+def get_provider(model: str) -> str:
+    """Retorna o provedor do modelo (ou string vazia se desconhecido)"""
+    return MODEL_PROVIDERS.get(model, "")
+
+class GenerationRun:
+    """
+    Etapas comuns de `generate_image` e `generate_image_async`
+    
+    Chave e leitura do cache, chave de coalescência, gravação do resultado,
+    métricas e eventos de progresso ficam aqui; as duas versões só diferem
+    em como esperam (thread ou event loop). `lookup_cache` e `store` acessam
+    o disco e, na versão assíncrona, rodam fora do event loop.
+    """
+    
+    def __init__(
+        self,
+        prompt: str,
+        model: str,
+        api_key: str,
+        quality: str,
+        size: str,
+        style: str,
+        num_images: int,
+        seed: Optional[int],
+        progress_callback: Optional[ProgressCallback]
+    ):
+        self.prompt = prompt
+        self.model = model
+        self.api_key = api_key
+        self.quality = quality
+        self.size = size
+        self.style = style
+        self.num_images = num_images
+        self.seed = seed
+        self.progress_callback = progress_callback
+        self.provider = get_provider(model)
+        self.cache_key = make_cache_key(prompt, model, size, quality, style, num_images, seed)
+        self.started = time.perf_counter()
+        emit_progress(progress_callback, "queued", "Na fila para geração", 0.0)
+    
+    def lookup_cache(self) -> Optional[Dict[str, Any]]:
+        """Resultado guardado no cache (None se não houver)"""
+        with stage_timer("cache_lookup", self.provider, self.model):
+            return get_result_cache().get(self.cache_key)
+    
+    def finish_cached(self, cached: Dict[str, Any]) -> Dict[str, Any]:
+        """Registra a métrica e o progresso de um resultado vindo do cache"""
+        get_metrics().observe(
+            "generation_seconds", time.perf_counter() - self.started,
+            provider=self.provider, model=self.model, outcome="cached"
+        )
+        emit_progress(self.progress_callback, "done", "Recuperado do cache", 1.0, result=cached)
+        return cached
+    
+    def store(self, result: Dict[str, Any]):
+        """
+        Grava o resultado novo no cache
+        
+        Mesmo ignorando a leitura, o resultado novo atualiza o cache (antes de
+        liberar quem espera a mesma chamada, para não haver uma janela sem
+        chamada em andamento e sem cache).
+        """
+        with stage_timer("cache_store", self.provider, self.model):
+            get_result_cache().put(self.cache_key, result)
+    
+    def coalesce_key(self) -> str:
+        """Chave que identifica chamadas idênticas em andamento"""
+        return make_coalesce_key(
+            prompt=self.prompt,
+            model=self.model,
+            size=self.size,
+            quality=self.quality,
+            style=self.style,
+            num_images=self.num_images,
+            seed=self.seed,
+            api_key=self.api_key
+        )
+    
+    def finish(self, result: Dict[str, Any], coalesced: bool) -> Dict[str, Any]:
+        """Marca a coalescência, registra as métricas e emite o evento final"""
+        
+        metrics = get_metrics()
+        if coalesced:
+            result = {**result, "coalesced": True}
+            metrics.inc("coalesced_requests_total", provider=self.provider, model=self.model)
+        
+        metrics.observe(
+            "generation_seconds", time.perf_counter() - self.started,
+            provider=self.provider,
+            model=self.model,
+            outcome="coalesced" if coalesced else ("success" if result["success"] else "error")
+        )
+        
+        emit_progress(
+            self.progress_callback,
+            "done",
+            "Concluído" if result["success"] else "Falhou",
+            1.0,
+            result=result
+        )
+        return result
+
+def plan_chunks(
+    model: str,
+    num_images: int,
+    seed: Optional[int],
+    progress_callback: Optional[ProgressCallback]
+) -> List[Tuple[int, Optional[int], Optional[ProgressCallback]]]:
+    """
+    Partes do pedido quando o modelo aceita menos imagens por chamada (ver
+    `generators.capabilities`): (imagens, seed, callback) de cada parte
+    
+    Com mais de uma parte, o progresso combinado é a média do progresso de
+    cada uma.
+    """
+    
+    chunks = split_num_images(model, num_images)
+    if len(chunks) == 1:
+        return [(chunks[0], seed, progress_callback)]
+    
+    callbacks = split_progress(progress_callback, len(chunks))
+    offsets = [sum(chunks[:index]) for index in range(len(chunks))]
+    return [
+        (count, chunk_seed(seed, offset), callback)
+        for count, offset, callback in zip(chunks, offsets, callbacks)
+    ]
+
+def scheduler_slot_args(
+    model: str,
+    num_images: int,
+    session_id: Optional[str],
+    priority: int,
+    progress_callback: Optional[ProgressCallback]
+) -> Dict[str, Any]:
+    """
+    Argumentos de `slot`/`slot_async` do escalonador para uma chamada
+    
+    A vaga limita a concorrência global e por provedor e é repartida entre
+    as sessões; a posição na fila vira um evento de progresso.
+    """
+    
+    def on_wait(position: int, waiting: int):
+        emit_progress(
+            progress_callback,
+            "queued",
+            f"Na fila: posição {position} de {waiting}",
+            0.0,
+            position=position,
+            waiting=waiting
+        )
+    
+    return {
+        "provider": get_provider(model),
+        "session": session_id,
+        "priority": priority,
+        "cost": num_images,
+        "on_wait": on_wait if progress_callback is not None else None
+    }
+
+def provider_call_args(
+    model: str,
+    prompt: str,
+    api_key: str,
+    quality: str,
+    size: str,
+    style: str,
+    num_images: int,
+    seed: Optional[int],
+    progress_callback: Optional[ProgressCallback]
+) -> Dict[str, Any]:
+    """Argumentos da função do provedor do modelo (síncrona ou assíncrona)"""
+    
+    if get_provider(model) == "openai":
+        return {
+            "prompt": prompt,
+            "api_key": api_key,
+            "model": model,
+            "quality": quality,
+            "size": size,
+            "style": style,
+            "num_images": num_images,
+            "progress_callback": progress_callback
+        }
+    
+    return {
+        "prompt": prompt,
+        "api_key": api_key,
+        "size": size,
+        "num_images": num_images,
+        "seed": seed,
+        "progress_callback": progress_callback
+    }
+
+def unsupported_model_result(model: str) -> Dict[str, Any]:
+    """Resultado de erro para um modelo sem provedor conhecido"""
+    return {
+        "success": False,
+        "error": f"Modelo não suportado: {model}",
+        "images": []
+    }
 
 def generate_image(
     prompt: str,
@@ -17,6 +261,11 @@ def generate_image(
     size: str = "1024x1024",
     style: str = "vivid",
     num_images: int = 1,
+    seed: Optional[int] = None,
+    use_cache: bool = True,
+    progress_callback: Optional[ProgressCallback] = None,
+    session_id: Optional[str] = None,
+    priority: int = PRIORITY_NORMAL,
     **kwargs
 ) -> Dict[str, Any]:
     """
@@ -30,46 +279,106 @@ def generate_image(
         size: Tamanho da imagem
         style: Estilo da imagem
         num_images: Número de imagens a gerar
-        
+        seed: Seed da geração (faz parte da chave do cache)
+        use_cache: Se False, ignora o cache de resultados e chama o provedor
+        progress_callback: Recebe os eventos de progresso (ver `generators.progress`)
+        session_id: Sessão dona da geração (a fila do escalonador é justa entre sessões)
+        priority: Prioridade na fila do escalonador (ver `generators.scheduler`)
+    
     Returns:
-        Dict com success, images (lista de bytes) e error
+        Dict com success, images (lista de bytes) e error. Resultados vindos
+        do cache trazem também `cached=True`, e os que aproveitaram uma
+        chamada idêntica já em andamento, `coalesced=True`.
     """
     
-    try:
-        if model.startswith("DALL-E"):
-            return generate_with_dalle(
-                prompt=prompt,
-                api_key=api_key,
-                model=model,
-                quality=quality,
-                size=size,
-                style=style,
-                num_images=num_images
-            )
-        
-        elif model == "Stable Diffusion XL":
-            return generate_with_stability(
-                prompt=prompt,
-                api_key=api_key,
-                size=size,
-                num_images=num_images
-            )
-        
-        elif model == "Midjourney (Replicate)":
-            return generate_with_replicate(
-                prompt=prompt,
-                api_key=api_key,
-                size=size,
-                num_images=num_images
+    generation = GenerationRun(prompt, model, api_key, quality, size, style, num_images, seed, progress_callback)
+    
+    if use_cache:
+        cached = generation.lookup_cache()
+        if cached is not None:
+            return generation.finish_cached(cached)
+    
+    def run(callback: Optional[ProgressCallback]) -> Dict[str, Any]:
+        result = _run_provider(
+            prompt, model, api_key, quality, size, style, num_images, seed,
+            callback, session_id, priority
+        )
+        generation.store(result)
+        return result
+    
+    # Requisições idênticas em andamento compartilham a chamada; quem pediu
+    # para ignorar o cache sempre faz uma chamada nova
+    coalesced = False
+    if use_cache and COALESCE_ENABLED:
+        result, coalesced = get_single_flight().run(generation.coalesce_key(), run, progress_callback)
+    else:
+        result = run(progress_callback)
+    
+    return generation.finish(result, coalesced)
+
+def _run_provider(
+    prompt: str,
+    model: str,
+    api_key: str,
+    quality: str,
+    size: str,
+    style: str,
+    num_images: int,
+    seed: Optional[int] = None,
+    progress_callback: Optional[ProgressCallback] = None,
+    session_id: Optional[str] = None,
+    priority: int = PRIORITY_NORMAL
+) -> Dict[str, Any]:
+    """Gera as imagens pedidas, dividindo em chamadas paralelas se o modelo exigir"""
+    
+    plan = plan_chunks(model, num_images, seed, progress_callback)
+    if len(plan) == 1:
+        count, part_seed, callback = plan[0]
+        return _call_provider(
+            prompt, model, api_key, quality, size, style, count, part_seed, callback,
+            session_id, priority
+        )
+    
+    with ThreadPoolExecutor(max_workers=len(plan), thread_name_prefix="split") as executor:
+        futures = [
+            executor.submit(
+                _call_provider,
+                prompt, model, api_key, quality, size, style, count,
+                part_seed, callback, session_id, priority
             )
-        
-        else:
-            return {
-                "success": False,
-                "error": f"Modelo não suportado: {model}",
-                "images": []
-            }
-            
+            for count, part_seed, callback in plan
+        ]
+        results = [future.result() for future in futures]
+    
+    return merge_results(results, num_images)
+
+def _call_provider(
+    prompt: str,
+    model: str,
+    api_key: str,
+    quality: str,
+    size: str,
+    style: str,
+    num_images: int,
+    seed: Optional[int] = None,
+    progress_callback: Optional[ProgressCallback] = None,
+    session_id: Optional[str] = None,
+    priority: int = PRIORITY_NORMAL
+) -> Dict[str, Any]:
+    """Faz uma chamada ao provedor do modelo com uma vaga do escalonador do processo"""
+    
+    function = PROVIDER_FUNCTIONS.get(get_provider(model))
+    if function is None:
+        return unsupported_model_result(model)
+    
+    try:
+        with get_scheduler().slot(
+            **scheduler_slot_args(model, num_images, session_id, priority, progress_callback)
+        ):
+            return function(**provider_call_args(
+                model, prompt, api_key, quality, size, style, num_images, seed, progress_callback
+            ))
+    
     except Exception as e:
         return {
             "success": False,
@@ -77,6 +386,109 @@ def generate_image(
             "images": []
         }
 
+def build_dalle_params(
+    prompt: str,
+    model: str,
+    quality: str,
+    size: str,
+    style: str,
+    num_images: int,
+    response_format: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Monta os parâmetros da chamada `images.generate` do DALL-E
+    
+    `response_format` é "b64_json" ou "url" (padrão: `DALLE_RESPONSE_FORMAT`)
+    """
+    
+    # Determinar versão do modelo
+    dalle_model = "dall-e-3" if model == "DALL-E 3" else "dall-e-2"
+    
+    # DALL-E 3 só suporta 1 imagem por vez (pedidos maiores são divididos
+    # antes, em plan_chunks)
+    num_images = min(num_images, max_images_per_call(model))
+    
+    return {
+        "model": dalle_model,
+        "prompt": prompt,
+        "size": size,
+        "quality": quality if dalle_model == "dall-e-3" else "standard",
+        "style": style if dalle_model == "dall-e-3" else None,
+        "n": num_images,
+        "response_format": response_format or get_response_mode("openai")
+    }
+
+def build_stability_request(
+    prompt: str,
+    api_key: str,
+    size: str,
+    num_images: int,
+    seed: Optional[int] = None,
+    response_mode: Optional[str] = None
+) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """
+    Monta URL, headers e corpo da requisição text-to-image da Stability
+    
+    Com `response_mode` "png" (padrão: `STABILITY_RESPONSE_MODE`) a resposta
+    é a própria imagem binária; com "json", os artefatos vêm em base64.
+    """
+    
+    # Converter tamanho para formato Stability
+    width, height = map(int, size.split('x'))
+    
+    url = f"{PROVIDER_BASE_URLS['stability']}/v1/generation/{STABILITY_ENGINE}/text-to-image"
+    
+    response_mode = response_mode or get_response_mode("stability")
+    
+    headers = {
+        "Accept": "image/png" if response_mode == "png" else "application/json",
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}",
+    }
+    
+    body = {
+        "text_prompts": [
+            {
+                "text": prompt,
+                "weight": 1
+            }
+        ],
+        "cfg_scale": 7,
+        "height": height,
+        "width": width,
+        "samples": num_images,
+        "steps": 30,
+    }
+    
+    if seed is not None:
+        body["seed"] = seed
+    
+    return url, headers, body
+
+def build_replicate_input(
+    prompt: str,
+    size: str,
+    num_images: int,
+    seed: Optional[int] = None
+) -> Dict[str, Any]:
+    """Monta a entrada do modelo Midjourney-style no Replicate"""
+    
+    width, height = map(int, size.split('x'))
+    
+    model_input = {
+        "prompt": prompt,
+        "width": width,
+        "height": height,
+        "num_outputs": num_images,
+        "num_inference_steps": 50,
+        "guidance_scale": 7.5
+    }
+    
+    if seed is not None:
+        model_input["seed"] = seed
+    
+    return model_input
+
 def generate_with_dalle(
     prompt: str,
     api_key: str,
@@ -84,42 +496,52 @@ def generate_with_dalle(
     quality: str,
     size: str,
     style: str,
-    num_images: int
+    num_images: int,
+    progress_callback: Optional[ProgressCallback] = None
 ) -> Dict[str, Any]:
     """Gera imagem usando DALL-E"""
     
     try:
-        client = openai.OpenAI(api_key=api_key)
-        
-        # Determinar versão do modelo
-        dalle_model = "dall-e-3" if model == "DALL-E 3" else "dall-e-2"
-        
-        # DALL-E 3 só suporta 1 imagem por vez
-        if dalle_model == "dall-e-3":
-            num_images = 1
-        
-        response = client.images.generate(
-            model=dalle_model,
-            prompt=prompt,
-            size=size,
-            quality=quality if dalle_model == "dall-e-3" else "standard",
-            style=style if dalle_model == "dall-e-3" else None,
-            n=num_images,
-            response_format="url"
-        )
+        client = get_client_pool().get_openai_client(api_key)
         
-        # Baixar imagens
-        images = []
-        for image_data in response.data:
-            img_response = requests.get(image_data.url)
-            if img_response.status_code == 200:
-                images.append(img_response.content)
+        emit_progress(progress_callback, "submitted", "Enviado para o DALL-E", SUBMITTED_PROGRESS)
+        params = build_dalle_params(prompt, model, quality, size, style, num_images)
         
-        return {
-            "success": True,
-            "images": images,
-            "error": None
-        }
+        if params["response_format"] == "b64_json":
+            # Imagens no corpo da resposta, decodificadas enquanto chegam
+            on_decoded = download_progress(progress_callback)
+            
+            def request() -> List[bytes]:
+                submitted = time.perf_counter()
+                with client.images.with_streaming_response.generate(**params) as response:
+                    get_metrics().observe(
+                        "stage_seconds", time.perf_counter() - submitted,
+                        provider="openai", model=model, stage="submit"
+                    )
+                    with stage_timer("decode", "openai", model):
+                        decoder = Base64FieldDecoder("b64_json")
+                        for chunk in response.iter_bytes(STREAM_CHUNK_SIZE):
+                            for _ in decoder.feed(chunk):
+                                if on_decoded:
+                                    on_decoded(len(decoder.images), params["n"])
+                    return decoder.images
+            
+            images = call_with_retry("openai", api_key, request)
+            return build_download_result(images, [], params["n"])
+        
+        def request():
+            with stage_timer("submit", "openai", model):
+                return client.images.generate(**params)
+        
+        response = call_with_retry("openai", api_key, request)
+        
+        # Baixar imagens em paralelo
+        urls = [image_data.url for image_data in response.data]
+        emit_progress(progress_callback, "polling", "DALL-E concluiu, baixando imagens", DOWNLOAD_PROGRESS_START)
+        with stage_timer("download", "openai", model):
+            images, errors = download_images(urls, on_downloaded=download_progress(progress_callback))
+        
+        return build_download_result(images, errors, len(urls))
         
     except Exception as e:
         return {
@@ -132,57 +554,56 @@ def generate_with_stability(
     prompt: str,
     api_key: str,
     size: str,
-    num_images: int
+    num_images: int,
+    seed: Optional[int] = None,
+    progress_callback: Optional[ProgressCallback] = None
 ) -> Dict[str, Any]:
     """Gera imagem usando Stability AI"""
     
     try:
-        # Converter tamanho para formato Stability
-        width, height = map(int, size.split('x'))
-        
-        url = "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image"
-        
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        }
-        
-        body = {
-            "text_prompts": [
-                {
-                    "text": prompt,
-                    "weight": 1
-                }
-            ],
-            "cfg_scale": 7,
-            "height": height,
-            "width": width,
-            "samples": num_images,
-            "steps": 30,
-        }
+        url, headers, body = build_stability_request(prompt, api_key, size, num_images, seed)
         
-        response = requests.post(url, headers=headers, json=body)
+        session = get_client_pool().get_session("stability", api_key)
+        emit_progress(progress_callback, "submitted", "Enviado para a Stability AI", SUBMITTED_PROGRESS)
         
-        if response.status_code != 200:
-            return {
-                "success": False,
-                "error": f"Stability API error: {response.status_code}",
-                "images": []
-            }
+        def post():
+            with stage_timer("submit", "stability", STABILITY_MODEL_NAME):
+                response = session.post(url, headers=headers, json=body, stream=True)
+            try:
+                raise_for_retryable(response)
+            except Exception:
+                response.close()
+                raise
+            return response
         
-        data = response.json()
-        images = []
+        response = call_with_retry("stability", api_key, post)
         
-        for artifact in data["artifacts"]:
-            image_data = base64.b64decode(artifact["base64"])
-            images.append(image_data)
+        with response:
+            if response.status_code != 200:
+                return {
+                    "success": False,
+                    "error": f"Stability API error: {response.status_code}",
+                    "images": []
+                }
+            
+            on_decoded = download_progress(progress_callback)
+            chunks = response.iter_content(STREAM_CHUNK_SIZE)
+            
+            with stage_timer("decode", "stability", STABILITY_MODEL_NAME):
+                if headers["Accept"] == "image/png":
+                    images = [read_body(chunks)]
+                    if on_decoded:
+                        on_decoded(1, 1)
+                else:
+                    # Artefatos em base64 decodificados enquanto chegam
+                    decoder = Base64FieldDecoder("base64")
+                    for chunk in chunks:
+                        for _ in decoder.feed(chunk):
+                            if on_decoded:
+                                on_decoded(len(decoder.images), num_images)
+                    images = decoder.images
         
-        return {
-            "success": True,
-            "images": images,
-            "error": None
-        }
+        return build_download_result(images, [], num_images)
         
     except Exception as e:
         return {
@@ -195,45 +616,68 @@ def generate_with_replicate(
     prompt: str,
     api_key: str,
     size: str,
-    num_images: int
+    num_images: int,
+    seed: Optional[int] = None,
+    progress_callback: Optional[ProgressCallback] = None
 ) -> Dict[str, Any]:
     """Gera imagem usando Replicate (Midjourney style)"""
     
     try:
-        import replicate
-        
-        # Configurar cliente
-        replicate.Client(api_token=api_key)
+        # Cliente reutilizável por chave (evita novo handshake a cada chamada)
+        client = get_client_pool().get_replicate_client(api_key)
         
         # Usar modelo Midjourney-style no Replicate
-        output = replicate.run(
-            "prompthero/openjourney:9936c2001faa2194a261c01381f90e65261879985476014a0a37a334593a05eb",
-            input={
-                "prompt": prompt,
-                "width": int(size.split('x')[0]),
-                "height": int(size.split('x')[1]),
-                "num_outputs": num_images,
-                "num_inference_steps": 50,
-                "guidance_scale": 7.5
-            }
+        model_input = build_replicate_input(prompt, size, num_images, seed)
+        
+        def create():
+            with stage_timer("submit", "replicate", REPLICATE_MODEL_NAME):
+                return client.predictions.create(version=REPLICATE_MODEL_VERSION, input=model_input)
+        
+        prediction = call_with_retry("replicate", api_key, create)
+        emit_progress(progress_callback, "submitted", "Enviado para o Replicate", SUBMITTED_PROGRESS)
+        
+        # Acompanhar o status da predição até terminar (fila + execução no provedor)
+        polling_started = time.perf_counter()
+        while prediction.status not in ("succeeded", "failed", "canceled"):
+            percentage = getattr(getattr(prediction, "progress", None), "percentage", None)
+            fraction = SUBMITTED_PROGRESS + (POLLING_PROGRESS - SUBMITTED_PROGRESS) * (percentage or 0)
+            emit_progress(
+                progress_callback,
+                "polling",
+                f"Replicate: {prediction.status}",
+                fraction,
+                status=prediction.status
+            )
+            time.sleep(REPLICATE_POLL_INTERVAL)
+            call_with_retry("replicate", api_key, prediction.reload, limited=False)
+        
+        get_metrics().observe(
+            "stage_seconds", time.perf_counter() - polling_started,
+            provider="replicate", model=REPLICATE_MODEL_NAME, stage="poll"
         )
         
-        # Baixar imagens
-        images = []
-        for url in output:
-            img_response = requests.get(url)
-            if img_response.status_code == 200:
-                images.append(img_response.content)
+        if prediction.status != "succeeded":
+            raise RuntimeError(prediction.error or f"predição {prediction.status}")
         
-        return {
-            "success": True,
-            "images": images,
-            "error": None
-        }
+        # Baixar imagens em paralelo
+        output = prediction.output or []
+        urls = [output] if isinstance(output, str) else [str(url) for url in output]
+        emit_progress(progress_callback, "polling", "Replicate: succeeded", DOWNLOAD_PROGRESS_START, status="succeeded")
+        with stage_timer("download", "replicate", REPLICATE_MODEL_NAME):
+            images, errors = download_images(urls, on_downloaded=download_progress(progress_callback))
+        
+        return build_download_result(images, errors, len(urls))
         
     except Exception as e:
         return {
             "success": False,
             "error": f"Erro Replicate: {str(e)}",
             "images": []
-        }
\ No newline at end of file
+        }
+
+# Função de cada provedor (ver `MODEL_PROVIDERS`)
+PROVIDER_FUNCTIONS = {
+    "openai": generate_with_dalle,
+    "stability": generate_with_stability,
+    "replicate": generate_with_replicate,
+}
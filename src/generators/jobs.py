@@ -0,0 +1,207 @@
+"""
+Gerações em segundo plano, várias ao mesmo tempo por sessão
+
+Cada clique em "Gerar Imagem" vira um trabalho executado em um pool de
+threads do processo, fora da thread do script do Streamlit: a interface
+continua respondendo e o usuário pode enfileirar outros prompts. Cada sessão
+tem sua lista de trabalhos; a interface consulta o estado (progresso,
+resultado) periodicamente e recolhe os que terminaram.
+
+Os resultados são gravados (armazenamento, histórico persistido) pela
+própria thread do trabalho, por meio do callback `on_success`, então nada se
+perde se a sessão for fechada antes de a geração terminar.
+"""
+
+import atexit
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from generators.image_generator import generate_image
+from generators.scheduler import PRIORITY_NORMAL
+
+# Threads do pool de trabalhos (a concorrência real com os provedores é
+# limitada pelo escalonador; aqui as threads passam a maior parte do tempo
+# esperando)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "32"))
+
+# Trabalhos em andamento por sessão
+JOB_MAX_ACTIVE_PER_SESSION = int(os.getenv("JOB_MAX_ACTIVE_PER_SESSION", "4"))
+
+# Trabalhos concluídos mantidos na lista da sessão
+JOB_HISTORY_LIMIT = 10
+
+# Intervalo (segundos) com que a interface consulta os trabalhos em andamento
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+
+# Estados de um trabalho
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Pool de threads compartilhado pelos trabalhos de todas as sessões"""
+
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+                atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+    return _executor
+
+
+class JobLimitError(Exception):
+    """A sessão já tem o máximo de trabalhos em andamento"""
+
+
+class GenerationJob:
+    """
+    Uma geração em segundo plano
+
+    Os campos de estado são escritos pela thread do trabalho e lidos pela
+    interface; cada escrita é de um único atributo.
+
+    Args:
+        prompt: Prompt enviado ao provedor
+        model: Modelo usado
+        api_key: Chave da API (não é exibida)
+        parameters: Demais argumentos de `generate_image` (quality, size, ...)
+        session_id: Sessão dona do trabalho
+        priority: Prioridade no escalonador
+    """
+
+    def __init__(
+        self,
+        prompt: str,
+        model: str,
+        api_key: str,
+        parameters: Dict[str, Any],
+        session_id: Optional[str] = None,
+        priority: int = PRIORITY_NORMAL,
+    ):
+        self.id = uuid.uuid4().hex[:12]
+        self.prompt = prompt
+        self.model = model
+        self.parameters = dict(parameters)
+        self.session_id = session_id
+        self.priority = priority
+        self._api_key = api_key
+
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = "Na fila para geração"
+        self.result: Optional[Dict[str, Any]] = None
+        self.output: Any = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.collected = False
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    @property
+    def elapsed(self) -> float:
+        """Segundos desde a criação (até o fim, se já terminou)"""
+        return (self.finished or time.time()) - self.created
+
+    def _on_progress(self, event: Dict[str, Any]):
+        if event["stage"] != "queued":
+            self.status = RUNNING
+        self.progress = event["progress"]
+        self.message = event["message"]
+
+    def _run(self, on_success: Optional[Callable[["GenerationJob", Dict[str, Any]], Any]]):
+        status = FAILED
+        try:
+            result = generate_image(
+                prompt=self.prompt,
+                model=self.model,
+                api_key=self._api_key,
+                session_id=self.session_id,
+                priority=self.priority,
+                progress_callback=self._on_progress,
+                **self.parameters
+            )
+            if result["success"] and on_success is not None:
+                self.output = on_success(self, result)
+            # As imagens já foram gravadas; o trabalho guarda só os metadados
+            self.result = {**result, "images": []}
+            self.error = None if result["success"] else result.get("error")
+            status = DONE if result["success"] else FAILED
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.progress = 1.0
+            self.finished = time.time()
+            # Por último: quem lê `done` encontra o resto já preenchido
+            self.status = status
+
+
+class JobList:
+    """Trabalhos de uma sessão, do mais antigo ao mais recente"""
+
+    def __init__(self, max_active: int = JOB_MAX_ACTIVE_PER_SESSION):
+        self.max_active = max_active
+        self.jobs: List[GenerationJob] = []
+        self._lock = threading.Lock()
+
+    def active(self) -> List[GenerationJob]:
+        return [job for job in self.jobs if not job.done]
+
+    def submit(
+        self,
+        job: GenerationJob,
+        on_success: Optional[Callable[[GenerationJob, Dict[str, Any]], Any]] = None,
+    ) -> GenerationJob:
+        """
+        Começa o trabalho em segundo plano
+
+        Args:
+            job: Trabalho a executar
+            on_success: Chamado na thread do trabalho com (trabalho, resultado)
+                quando a geração dá certo; o retorno fica em `job.output`
+
+        Raises:
+            JobLimitError: Se a sessão já tem `max_active` trabalhos em andamento
+        """
+
+        with self._lock:
+            if len(self.active()) >= self.max_active:
+                raise JobLimitError(
+                    f"já há {self.max_active} gerações em andamento; aguarde uma terminar"
+                )
+            self.jobs.append(job)
+            self._prune()
+        _get_executor().submit(job._run, on_success)
+        return job
+
+    def collect(self) -> List[GenerationJob]:
+        """Trabalhos que terminaram desde a última chamada"""
+
+        with self._lock:
+            finished = [job for job in self.jobs if job.done and not job.collected]
+            for job in finished:
+                job.collected = True
+            return finished
+
+    def dismiss(self, job_id: str):
+        """Remove um trabalho concluído da lista"""
+        with self._lock:
+            self.jobs = [job for job in self.jobs if job.id != job_id or not job.done]
+
+    def _prune(self):
+        """Descarta os concluídos mais antigos além do limite (chamar com o lock)"""
+        finished = [job for job in self.jobs if job.done and job.collected]
+        for job in finished[:max(0, len(finished) - JOB_HISTORY_LIMIT)]:
+            self.jobs.remove(job)
@@ -0,0 +1,87 @@
+"""
+Eventos de progresso emitidos durante a geração de imagens
+
+Cada evento é um dict com:
+    stage: "queued", "submitted", "polling", "downloaded" ou "done"
+    message: Texto legível para mostrar na interface
+    progress: Fração de 0.0 a 1.0
+e campos extras por etapa (por exemplo `status` no polling e `result` no done).
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+# Faixas de progresso reservadas para cada etapa
+SUBMITTED_PROGRESS = 0.1
+POLLING_PROGRESS = 0.5
+DOWNLOAD_PROGRESS_START = 0.6
+DOWNLOAD_PROGRESS_END = 0.95
+
+
+def emit_progress(
+    callback: Optional[ProgressCallback],
+    stage: str,
+    message: str,
+    progress: float,
+    **extra
+):
+    """Envia um evento de progresso ao callback, se houver"""
+
+    if callback is None:
+        return
+
+    event = {"stage": stage, "message": message, "progress": min(max(progress, 0.0), 1.0)}
+    event.update(extra)
+
+    try:
+        callback(event)
+    except Exception:
+        # Falhas na interface não devem interromper a geração
+        pass
+
+
+def download_progress(callback: Optional[ProgressCallback]) -> Optional[Callable[[int, int], None]]:
+    """Adapta o callback de progresso para o formato usado pelos downloads"""
+
+    if callback is None:
+        return None
+
+    def on_downloaded(completed: int, total: int):
+        emit_progress(
+            callback,
+            "downloaded",
+            f"Imagem {completed} de {total} recebida",
+            DOWNLOAD_PROGRESS_START + (DOWNLOAD_PROGRESS_END - DOWNLOAD_PROGRESS_START) * completed / total,
+            completed=completed,
+            total=total,
+        )
+
+    return on_downloaded
+
+
+def split_progress(callback: Optional[ProgressCallback], parts: int) -> List[Optional[ProgressCallback]]:
+    """
+    Callbacks para cada parte de um pedido dividido em várias chamadas
+
+    O progresso repassado a `callback` é a média do progresso das partes, e
+    a mensagem indica de qual parte veio o evento.
+    """
+
+    if callback is None:
+        return [None] * parts
+
+    fractions = [0.0] * parts
+    lock = threading.Lock()
+
+    def part_callback(index: int) -> ProgressCallback:
+        def on_event(event: Dict[str, Any]):
+            with lock:
+                fractions[index] = max(fractions[index], event["progress"])
+                progress = sum(fractions) / parts
+            emit_progress(callback, event["stage"], f"[{index + 1}/{parts}] {event['message']}", progress)
+
+        return on_event
+
+    return [part_callback(index) for index in range(parts)]
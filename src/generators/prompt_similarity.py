@@ -0,0 +1,408 @@
+"""
+Detecção de prompts quase iguais a gerações anteriores
+
+O cache de resultados só acerta prompts idênticos. Aqui cada prompt é
+normalizado (sem o prefixo do template, pontuação, caixa e ordem das
+palavras) e resumido em uma assinatura MinHash; um índice LSH por faixas
+encontra, em tempo praticamente constante, as gerações anteriores cujo
+prompt tem similaridade de Jaccard acima do limiar, para que a interface
+ofereça reaproveitá-las antes de uma chamada paga. Cada entrada guarda o dono
+da geração, e a interface só oferece gerações do próprio usuário.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from utils.metrics import get_metrics
+from utils.paths import get_data_dir
+from utils.prompt_templates import PROMPT_TEMPLATES
+
+# Similaridade de Jaccard mínima (entre 0 e 1) para oferecer o reaproveitamento
+PROMPT_SIMILARITY_THRESHOLD = float(os.getenv("PROMPT_SIMILARITY_THRESHOLD", "0.8"))
+
+# Máximo de prompts no índice (os mais antigos saem primeiro)
+PROMPT_INDEX_MAX_ENTRIES = int(os.getenv("PROMPT_INDEX_MAX_ENTRIES", "100000"))
+
+# Permutações da assinatura MinHash. O número de faixas LSH é escolhido a
+# partir do limiar, para que pares acima dele virem candidatos com ≥ 99% de
+# chance sem trazer candidatos demais (ver `lsh_shape`).
+NUM_PERMUTATIONS = 128
+LSH_TARGET_RECALL = 0.99
+
+# Inserções mantidas fora dos vetores ordenados até a próxima mesclagem
+LSH_MERGE_BATCH = 256
+
+MAX_MATCHES = 3
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Coeficientes fixos das permutações (a assinatura precisa ser estável)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_BAND_MIX = _rng.randint(1, 1 << 63, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+# Prefixos de template, do mais longo ao mais curto
+_TEMPLATE_PREFIXES = sorted(
+    (" ".join(_PUNCTUATION.sub(" ", t["template"].casefold()).split()) for t in PROMPT_TEMPLATES.values()),
+    key=len,
+    reverse=True,
+)
+
+
+def canonicalize_prompt(prompt: str) -> str:
+    """
+    Forma canônica do prompt usada na comparação
+
+    Remove caixa, pontuação, espaços extras e o prefixo de template aplicado
+    pela interface (`"<template>, <prompt>"`).
+    """
+
+    text = " ".join(_PUNCTUATION.sub(" ", prompt.casefold()).split())
+    for prefix in _TEMPLATE_PREFIXES:
+        if text.startswith(prefix + " "):
+            return text[len(prefix) + 1:]
+    return text
+
+
+def prompt_features(prompt: str) -> FrozenSet[str]:
+    """Conjunto de palavras do prompt canônico (ignora a ordem e repetições)"""
+    return frozenset(canonicalize_prompt(prompt).split())
+
+
+def minhash_signature(features: FrozenSet[str]) -> np.ndarray:
+    """
+    Assinatura MinHash de um conjunto de palavras
+
+    Cada palavra vira um hash de 32 bits e as `NUM_PERMUTATIONS` permutações
+    (a*x + b mod primo) são calculadas de uma vez com NumPy.
+    """
+
+    if not features:
+        return np.full(NUM_PERMUTATIONS, _MAX_HASH, dtype=np.uint64)
+
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=4).digest(), "little") for f in features),
+        dtype=np.uint64,
+        count=len(features),
+    )
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=1)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def lsh_shape(threshold: float, permutations: int = NUM_PERMUTATIONS) -> Tuple[int, int]:
+    """
+    Número de faixas e de linhas por faixa do LSH para o limiar
+
+    Escolhe o maior número de linhas (menos candidatos falsos) que ainda
+    encontra pares com similaridade `threshold` com `LSH_TARGET_RECALL`.
+    """
+
+    best = (permutations, 1)
+    for rows in range(1, permutations + 1):
+        bands = permutations // rows
+        if 1 - (1 - threshold ** rows) ** bands < LSH_TARGET_RECALL:
+            break
+        best = (bands, rows)
+    return best
+
+
+def band_keys(signature: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    """Chave de 64 bits de cada faixa LSH (mistura das linhas da faixa)"""
+    used = bands * rows
+    mixed = (signature[:used] * _BAND_MIX[:used]).reshape(bands, rows)
+    return mixed.sum(axis=1, dtype=np.uint64) + np.arange(bands, dtype=np.uint64)
+
+
+class PromptIndex:
+    """
+    Índice MinHash/LSH das gerações anteriores
+
+    Cada entrada ocupa uma posição (slot) e suas chaves de faixa ficam em um
+    vetor NumPy ordenado; a busca é um `searchsorted` por faixa, sem percorrer
+    as entradas. Inserções recentes ficam em um dicionário pequeno até serem
+    mescladas ao vetor ordenado. As entradas (prompt, modelo, parâmetros,
+    referências das imagens e dono) são gravadas em um JSONL só de acréscimos e
+    recarregadas ao iniciar.
+
+    Args:
+        path: Arquivo JSONL do índice
+        max_entries: Máximo de entradas mantidas (as mais antigas saem)
+        threshold: Similaridade mínima padrão
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_entries: int = PROMPT_INDEX_MAX_ENTRIES,
+        threshold: float = PROMPT_SIMILARITY_THRESHOLD,
+    ):
+        self.path = Path(path) if path else get_data_dir("prompt_index") / "prompts.jsonl"
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.bands, self.rows = lsh_shape(threshold)
+        self._lock = threading.Lock()
+        # slot -> entrada (com as palavras do prompt para o Jaccard exato), na
+        # ordem de inserção: a mais antiga sai primeiro em O(1)
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._slots: Dict[str, int] = {}
+        self._keys = np.zeros((0, self.bands), dtype=np.uint64)
+        self._next_slot = 0
+        # Vetores ordenados de (chave de faixa, slot) e as inserções pendentes
+        self._sorted_keys = np.zeros(0, dtype=np.uint64)
+        self._sorted_slots = np.zeros(0, dtype=np.int64)
+        self._pending: Dict[int, List[int]] = {}
+        self._pending_slots: List[int] = []
+        self._load()
+
+    @staticmethod
+    def _entry_id(prompt: str, model: str, parameters: Dict[str, Any], owner: Optional[str]) -> str:
+        payload = json.dumps([canonicalize_prompt(prompt), model, parameters, owner], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def _load(self):
+        if not self.path.is_file():
+            return
+
+        records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        lines = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                    records.pop(record["id"], None)
+                    records[record["id"]] = record
+                except (ValueError, KeyError):
+                    continue
+
+        # Na carga as chaves vão direto para uma única mesclagem no final
+        for record in list(records.values())[-self.max_entries:]:
+            self._insert(record, merge=False)
+        self._merge()
+
+        # Compacta o arquivo quando ele acumulou muitas linhas substituídas
+        if lines > 2 * len(self._entries):
+            self._rewrite()
+
+    def _rewrite(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(self._record(entry), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _record(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in entry.items() if key != "features"}
+
+    def _insert(self, record: Dict[str, Any], merge: bool = True):
+        """
+        Adiciona a entrada ao índice em memória (chamar com o lock ou na carga)
+
+        Com `merge=False`, as chaves só ficam buscáveis após `_merge()`.
+        """
+
+        if record["id"] in self._slots:
+            self._remove(self._slots[record["id"]])
+
+        features = prompt_features(record["prompt"])
+        keys = band_keys(minhash_signature(features), self.bands, self.rows)
+
+        slot = self._next_slot
+        self._next_slot += 1
+        if slot >= len(self._keys):
+            grown = np.zeros((max(1024, 2 * len(self._keys)), self.bands), dtype=np.uint64)
+            grown[:len(self._keys)] = self._keys
+            self._keys = grown
+        self._keys[slot] = keys
+
+        self._entries[slot] = {**record, "features": features}
+        self._slots[record["id"]] = slot
+        self._pending_slots.append(slot)
+
+        while len(self._entries) > self.max_entries:
+            _, oldest = self._entries.popitem(last=False)
+            self._slots.pop(oldest["id"], None)
+
+        if merge:
+            for key in keys.tolist():
+                self._pending.setdefault(key, []).append(slot)
+            if len(self._pending_slots) >= LSH_MERGE_BATCH:
+                self._merge()
+
+    def _remove(self, slot: int):
+        """Remove a entrada; suas chaves saem dos vetores na próxima mesclagem"""
+        entry = self._entries.pop(slot)
+        self._slots.pop(entry["id"], None)
+
+    def _merge(self):
+        """Mescla as inserções pendentes aos vetores ordenados e descarta slots removidos"""
+
+        if self._pending_slots:
+            slots = np.asarray(self._pending_slots, dtype=np.int64)
+            keys = self._keys[slots].ravel()
+            slots = np.repeat(slots, self.bands)
+            order = np.argsort(keys, kind="stable")
+            keys, slots = keys[order], slots[order]
+            positions = np.searchsorted(self._sorted_keys, keys)
+            self._sorted_keys = np.insert(self._sorted_keys, positions, keys)
+            self._sorted_slots = np.insert(self._sorted_slots, positions, slots)
+            self._pending.clear()
+            self._pending_slots.clear()
+
+        # Slots removidos ocupam espaço até passarem de um quarto do vetor
+        live = len(self._entries) * self.bands
+        if len(self._sorted_slots) > live + live // 4 + self.bands:
+            alive = np.fromiter(self._entries, dtype=np.int64, count=len(self._entries))
+            mask = np.isin(self._sorted_slots, alive)
+            self._sorted_keys = self._sorted_keys[mask]
+            self._sorted_slots = self._sorted_slots[mask]
+
+    def add(
+        self,
+        prompt: str,
+        model: str,
+        parameters: Dict[str, Any],
+        images: List[str],
+        owner: Optional[str] = None,
+    ):
+        """
+        Registra uma geração bem-sucedida
+
+        Args:
+            prompt: Prompt enviado ao provedor
+            model: Modelo usado
+            parameters: Qualidade, tamanho e estilo
+            images: Referências das imagens no armazenamento
+            owner: Dono da geração (usuário ou sessão)
+        """
+
+        if not images:
+            return
+
+        record = {
+            "id": self._entry_id(prompt, model, parameters, owner),
+            "prompt": prompt,
+            "model": model,
+            "parameters": parameters,
+            "images": list(images),
+            "owner": owner,
+            "timestamp": time.time(),
+        }
+        with self._lock:
+            self._insert(record)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def find_similar(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        owner: Optional[str] = None,
+        parameters: Optional[Dict[str, Any]] = None,
+        min_images: int = 0,
+        threshold: Optional[float] = None,
+        limit: int = MAX_MATCHES,
+    ) -> List[Dict[str, Any]]:
+        """
+        Gerações anteriores com prompt quase igual
+
+        Args:
+            prompt: Prompt a procurar
+            model: Se informado, só entradas desse modelo
+            owner: Se informado, só entradas desse dono (entradas sem dono,
+                gravadas antes de o índice guardá-lo, nunca são devolvidas)
+            parameters: Se informado, só entradas com exatamente esses parâmetros
+            min_images: Número mínimo de imagens da entrada
+            threshold: Similaridade mínima (padrão: a do índice; limiares
+                menores que o do índice podem perder alguns pares)
+            limit: Máximo de resultados (aplicado depois de todos os filtros)
+
+        Returns:
+            Lista de dicts (prompt, modelo, parâmetros, imagens, timestamp e
+            `similarity`), da mais parecida para a menos parecida
+        """
+
+        threshold = self.threshold if threshold is None else threshold
+        started = time.perf_counter()
+
+        features = prompt_features(prompt)
+        keys = band_keys(minhash_signature(features), self.bands, self.rows)
+
+        with self._lock:
+            lo = np.searchsorted(self._sorted_keys, keys, side="left")
+            hi = np.searchsorted(self._sorted_keys, keys, side="right")
+            candidates = set()
+            for start, end in zip(lo.tolist(), hi.tolist()):
+                if end > start:
+                    candidates.update(self._sorted_slots[start:end].tolist())
+            for key in keys.tolist():
+                candidates.update(self._pending.get(key, ()))
+
+            matches = []
+            for slot in candidates:
+                entry = self._entries.get(slot)
+                if entry is None or (model is not None and entry["model"] != model):
+                    continue
+                if owner is not None and entry.get("owner") != owner:
+                    continue
+                if parameters is not None and entry["parameters"] != parameters:
+                    continue
+                if len(entry["images"]) < min_images:
+                    continue
+                # Confirma com o Jaccard exato (o LSH só seleciona candidatos)
+                similarity = jaccard(features, entry["features"])
+                if similarity >= threshold:
+                    matches.append({**self._record(entry), "similarity": similarity})
+
+        matches.sort(key=lambda match: (match["similarity"], match["timestamp"]), reverse=True)
+        get_metrics().observe("similar_prompt_lookup_seconds", time.perf_counter() - started)
+        return matches[:limit]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        """Remove todas as entradas"""
+        with self._lock:
+            self._entries.clear()
+            self._slots.clear()
+            self._pending.clear()
+            self._pending_slots.clear()
+            self._sorted_keys = np.zeros(0, dtype=np.uint64)
+            self._sorted_slots = np.zeros(0, dtype=np.int64)
+            self.path.unlink(missing_ok=True)
+
+
+_prompt_index: Optional[PromptIndex] = None
+_prompt_index_lock = threading.Lock()
+
+
+def get_prompt_index() -> PromptIndex:
+    """Retorna o índice de prompts compartilhado pelo processo"""
+
+    global _prompt_index
+    if _prompt_index is None:
+        with _prompt_index_lock:
+            if _prompt_index is None:
+                _prompt_index = PromptIndex()
+    return _prompt_index
@@ -0,0 +1,366 @@
+"""
+Limite de taxa por provedor/chave e novas tentativas com backoff
+
+Um token bucket por (provedor, chave de API), compartilhado por todas as
+sessões do processo, segura as chamadas antes que o provedor responda 429.
+Quando mesmo assim vier um 429 ou 5xx, a chamada é repetida com backoff
+exponencial com jitter, respeitando o cabeçalho `Retry-After`.
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+from generators.clients import _key_fingerprint
+from utils.metrics import get_metrics
+
+# Requisições por minuto e rajada máxima por provedor (ajuste conforme a cota)
+RATE_LIMITS = {
+    "openai": (
+        float(os.getenv("RATE_LIMIT_OPENAI_RPM", "50")),
+        int(os.getenv("RATE_LIMIT_OPENAI_BURST", "5")),
+    ),
+    "stability": (
+        float(os.getenv("RATE_LIMIT_STABILITY_RPM", "150")),
+        int(os.getenv("RATE_LIMIT_STABILITY_BURST", "10")),
+    ),
+    "replicate": (
+        float(os.getenv("RATE_LIMIT_REPLICATE_RPM", "600")),
+        int(os.getenv("RATE_LIMIT_REPLICATE_BURST", "20")),
+    ),
+}
+
+# Novas tentativas para 429/5xx
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))
+# Maior espera entre tentativas; um `Retry-After` maior faz a chamada desistir
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30.0"))
+
+# Tempo máximo esperando um token antes de desistir da chamada
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "120"))
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class ProviderHTTPError(Exception):
+    """Resposta HTTP de erro de um provedor, com o `Retry-After` se houver"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None, message: str = ""):
+        super().__init__(message or f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RateLimitedError(Exception):
+    """O limite do provedor continuou estourado após todas as tentativas"""
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Converte o cabeçalho `Retry-After` (segundos ou data HTTP) em segundos"""
+
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    import email.utils
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def raise_for_retryable(response: Any):
+    """Lança `ProviderHTTPError` se a resposta (`requests`/`httpx`) for 429/5xx"""
+
+    if response.status_code in RETRYABLE_STATUS:
+        raise ProviderHTTPError(response.status_code, parse_retry_after(response.headers))
+
+
+def _retry_info(exc: BaseException) -> Optional[Tuple[int, Optional[float]]]:
+    """Extrai (status, retry_after) de erros dos SDKs e de `ProviderHTTPError`"""
+
+    if isinstance(exc, ProviderHTTPError):
+        return exc.status, exc.retry_after
+
+    # openai.APIStatusError (status_code) e replicate.ReplicateError (status)
+    status = getattr(exc, "status_code", None) or getattr(exc, "status", None)
+    if isinstance(status, int):
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+        return status, parse_retry_after(headers)
+
+    return None
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe
+
+    Args:
+        rate: Tokens repostos por segundo
+        capacity: Máximo de tokens acumulados (tamanho da rajada)
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.waiting = 0
+        self.throttled = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """
+        Tenta pegar um token sem bloquear
+
+        Returns:
+            0 se conseguiu; senão, segundos até o próximo token
+        """
+
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def _start_wait(self):
+        with self._lock:
+            self.waiting += 1
+            self.throttled += 1
+
+    def _end_wait(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        """Bloqueia até conseguir um token (ou estoura `RateLimitedError`)"""
+
+        wait = self.try_acquire()
+        if wait == 0:
+            return
+
+        deadline = time.monotonic() + max_wait
+        self._start_wait()
+        try:
+            while wait > 0:
+                if time.monotonic() + wait > deadline:
+                    raise RateLimitedError("tempo de espera pelo limite de taxa esgotado")
+                time.sleep(wait)
+                wait = self.try_acquire()
+        finally:
+            self._end_wait()
+
+    async def acquire_async(self, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        """Versão assíncrona de `acquire` (não bloqueia o event loop)"""
+
+        import asyncio
+
+        wait = self.try_acquire()
+        if wait == 0:
+            return
+
+        deadline = time.monotonic() + max_wait
+        self._start_wait()
+        try:
+            while wait > 0:
+                if time.monotonic() + wait > deadline:
+                    raise RateLimitedError("tempo de espera pelo limite de taxa esgotado")
+                await asyncio.sleep(wait)
+                wait = self.try_acquire()
+        finally:
+            self._end_wait()
+
+    def count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill()
+            return {
+                "rpm": self.rate * 60,
+                "burst": self.capacity,
+                "tokens": round(self.tokens, 2),
+                "queue_depth": self.waiting,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "rate_limited_responses": self.rate_limited,
+            }
+
+
+class RateLimiter:
+    """Registro de token buckets por (provedor, chave de API)"""
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, int]]] = None):
+        self.limits = limits or RATE_LIMITS
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, provider: str, api_key: Optional[str]) -> TokenBucket:
+        """Retorna o bucket do provedor e chave, criando-o se necessário"""
+
+        key = (provider, _key_fingerprint(api_key))
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                rpm, burst = self.limits.get(provider, (600.0, 10))
+                bucket = TokenBucket(rpm / 60.0, burst)
+                self._buckets[key] = bucket
+            return bucket
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Estatísticas por bucket, indexadas por "provedor:impressão-da-chave" """
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {f"{provider}:{fingerprint}": bucket.stats() for (provider, fingerprint), bucket in buckets.items()}
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Retorna o limitador de taxa compartilhado pelo processo"""
+
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+                get_metrics().register_collector(_rate_limit_gauges)
+    return _rate_limiter
+
+
+def _rate_limit_gauges():
+    """Estado dos buckets para a exposição de métricas"""
+
+    for name, stats in get_rate_limiter().stats().items():
+        provider, fingerprint = name.split(":", 1)
+        labels = {"provider": provider, "key": fingerprint}
+        for field in ("tokens", "queue_depth", "throttled", "retries", "rate_limited_responses"):
+            yield f"rate_limit_{field}", labels, stats[field]
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[float]) -> float:
+    """Backoff exponencial com jitter total, nunca abaixo do `Retry-After`"""
+
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _next_delay(bucket: TokenBucket, exc: Exception, attempt: int, max_attempts: int) -> float:
+    """
+    Decide se a chamada que falhou deve ser repetida
+
+    Returns:
+        Segundos a esperar antes da próxima tentativa
+
+    Raises:
+        O próprio erro, se não for repetível, se as tentativas acabaram ou se
+        o provedor pediu para esperar mais que `RETRY_MAX_DELAY`
+        (`RateLimitedError` no caso de 429)
+    """
+
+    info = _retry_info(exc)
+    if info is None or info[0] not in RETRYABLE_STATUS:
+        raise exc
+    status, retry_after = info
+
+    if status == 429:
+        bucket.count("rate_limited")
+    # Tentar antes do `Retry-After` só gastaria outra tentativa
+    too_long = retry_after is not None and retry_after > RETRY_MAX_DELAY
+    if attempt == max_attempts - 1 or too_long:
+        if status == 429:
+            when = f"em {retry_after:.0f}s" if too_long else "em instantes"
+            raise RateLimitedError(
+                f"limite de requisições do provedor atingido, tente novamente {when}"
+            ) from exc
+        raise exc
+
+    bucket.count("retries")
+    return _backoff_delay(attempt, retry_after)
+
+
+def call_with_retry(
+    provider: str,
+    api_key: Optional[str],
+    func: Callable[[], Any],
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    limited: bool = True,
+) -> Any:
+    """
+    Executa `func` respeitando o limite de taxa e repetindo em 429/5xx
+
+    Args:
+        provider: Provedor chamado
+        api_key: Chave usada (cada chave tem seu próprio limite)
+        func: Chamada ao provedor; deve lançar um erro com status HTTP
+            (ver `raise_for_retryable`) para ser repetida
+        max_attempts: Número máximo de tentativas
+        limited: Consome um token do bucket (False para consultas de status,
+            que os provedores limitam bem mais folgadamente que a criação)
+
+    Returns:
+        O retorno de `func`
+
+    Raises:
+        RateLimitedError: Se o provedor continuar respondendo 429
+    """
+
+    bucket = get_rate_limiter().bucket(provider, api_key)
+
+    for attempt in range(max_attempts):
+        if limited:
+            waited = time.perf_counter()
+            bucket.acquire()
+            get_metrics().observe("rate_limit_wait_seconds", time.perf_counter() - waited, provider=provider)
+        try:
+            return func()
+        except Exception as e:
+            delay = _next_delay(bucket, e, attempt, max_attempts)
+        time.sleep(delay)
+
+
+async def call_with_retry_async(
+    provider: str,
+    api_key: Optional[str],
+    func: Callable[[], Awaitable[Any]],
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    limited: bool = True,
+) -> Any:
+    """Versão assíncrona de `call_with_retry` (`func` retorna um awaitable)"""
+
+    import asyncio
+
+    bucket = get_rate_limiter().bucket(provider, api_key)
+
+    for attempt in range(max_attempts):
+        if limited:
+            waited = time.perf_counter()
+            await bucket.acquire_async()
+            get_metrics().observe("rate_limit_wait_seconds", time.perf_counter() - waited, provider=provider)
+        try:
+            return await func()
+        except Exception as e:
+            delay = _next_delay(bucket, e, attempt, max_attempts)
+        await asyncio.sleep(delay)
@@ -0,0 +1,381 @@
+"""
+Escalonador das chamadas aos provedores, compartilhado por todas as sessões
+
+Cada chamada ao provedor pede uma vaga ao escalonador, que limita quantas
+rodam ao mesmo tempo no processo e por provedor. Quem não consegue vaga
+entra em uma fila por provedor ordenada por prioridade e, dentro da mesma
+prioridade, por fila justa entre sessões (start-time fair queuing): cada
+sessão recebe marcas de tempo virtuais que avançam com o custo (número de
+imagens) do que ela já pediu, então uma sessão com vários trabalhos grandes
+não passa na frente de quem pediu uma imagem só. A posição na fila é
+informada a quem espera, para a interface mostrar.
+
+`slot` bloqueia a thread enquanto espera; `slot_async` espera sem bloquear
+o event loop. Os dois usam as mesmas filas e limites.
+
+O escalonador é um singleton do módulo (`get_scheduler`), e não um recurso
+`st.cache_resource`: o lote e a linha de comando rodam sem Streamlit e
+precisam da mesma instância que a interface, e um acessor em cache na
+interface só devolveria este mesmo objeto.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.metrics import get_metrics
+
+# Chamadas simultâneas no processo inteiro
+SCHEDULER_MAX_CONCURRENT = int(os.getenv("SCHEDULER_MAX_CONCURRENT", "8"))
+
+# Chamadas simultâneas por provedor
+SCHEDULER_PROVIDER_LIMITS = {
+    "openai": int(os.getenv("SCHEDULER_LIMIT_OPENAI", "4")),
+    "stability": int(os.getenv("SCHEDULER_LIMIT_STABILITY", "4")),
+    "replicate": int(os.getenv("SCHEDULER_LIMIT_REPLICATE", "4")),
+}
+
+# Tempo máximo na fila antes de desistir da chamada
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "300"))
+
+# Intervalo entre atualizações da posição na fila para quem espera
+SCHEDULER_POSITION_INTERVAL = 0.5
+
+# Prioridades (maior passa na frente): gerações da interface, trabalhos em
+# segundo plano e lotes da linha de comando
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 0
+
+# Sessão usada quando a chamada não informa uma (linha de comando, lotes)
+DEFAULT_SESSION = ""
+
+# (posição na fila começando em 1, total de chamadas esperando o mesmo provedor)
+WaitCallback = Callable[[int, int], None]
+
+
+class SchedulerTimeoutError(Exception):
+    """A chamada esperou na fila mais que o tempo máximo"""
+
+
+class _Ticket:
+    """Pedido de vaga na fila"""
+
+    __slots__ = ("key", "provider", "session", "granted", "on_granted", "position", "waiting")
+
+    def __init__(
+        self,
+        key: Tuple[int, float, int],
+        provider: str,
+        session: str,
+        on_granted: Optional[Callable[[], None]] = None,
+    ):
+        self.key = key
+        self.provider = provider
+        self.session = session
+        self.granted = threading.Event()
+        self.on_granted = on_granted
+        self.position = 0
+        self.waiting = 0
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return self.key < other.key
+
+
+class GenerationScheduler:
+    """
+    Limites de concorrência global e por provedor com fila justa entre sessões
+
+    Args:
+        max_concurrent: Chamadas simultâneas no processo
+        provider_limits: Chamadas simultâneas por provedor (provedores
+            ausentes só respeitam o limite global)
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = SCHEDULER_MAX_CONCURRENT,
+        provider_limits: Optional[Dict[str, int]] = None,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.provider_limits = dict(SCHEDULER_PROVIDER_LIMITS if provider_limits is None else provider_limits)
+        self._lock = threading.Lock()
+        self._running: Dict[str, int] = {}
+        self._total_running = 0
+        self._queues: Dict[str, List[_Ticket]] = {}
+        self._virtual_time = 0.0
+        self._session_finish: Dict[str, float] = {}
+        self._sequence = itertools.count()
+        # Posições recalculadas só quando a fila muda, para todos de uma vez
+        self._version = 0
+        self._positions_version = -1
+
+    def _has_capacity(self, provider: str) -> bool:
+        limit = self.provider_limits.get(provider)
+        return limit is None or self._running.get(provider, 0) < max(1, limit)
+
+    def _start(self, ticket: _Ticket):
+        """Ocupa a vaga do pedido (chamar com o lock)"""
+        self._running[ticket.provider] = self._running.get(ticket.provider, 0) + 1
+        self._total_running += 1
+        self._virtual_time = max(self._virtual_time, ticket.key[1])
+        ticket.granted.set()
+        if ticket.on_granted is not None:
+            ticket.on_granted()
+
+    def _dispatch(self):
+        """Libera os melhores pedidos enquanto houver vagas (chamar com o lock)"""
+
+        while self._total_running < self.max_concurrent:
+            best = None
+            for provider, queue in self._queues.items():
+                if queue and self._has_capacity(provider) and (best is None or queue[0] < best):
+                    best = queue[0]
+            if best is None:
+                return
+            heapq.heappop(self._queues[best.provider])
+            self._start(best)
+            self._version += 1
+
+    def _update_positions(self):
+        """Recalcula a posição de todos os pedidos na fila (chamar com o lock)"""
+
+        if self._positions_version == self._version:
+            return
+        for queue in self._queues.values():
+            for position, ticket in enumerate(sorted(queue), start=1):
+                ticket.position = position
+                ticket.waiting = len(queue)
+        self._positions_version = self._version
+
+    def _submit(
+        self,
+        provider: str,
+        session: str,
+        priority: int,
+        cost: float,
+        on_granted: Optional[Callable[[], None]] = None,
+    ) -> _Ticket:
+        with self._lock:
+            # Marcas que já ficaram para trás do tempo virtual não mudam nada
+            if len(self._session_finish) > 1024:
+                self._session_finish = {
+                    name: finish for name, finish in self._session_finish.items()
+                    if finish > self._virtual_time
+                }
+            start = max(self._virtual_time, self._session_finish.get(session, 0.0))
+            self._session_finish[session] = start + max(cost, 1e-6)
+            ticket = _Ticket((-priority, start, next(self._sequence)), provider, session, on_granted)
+
+            if self._total_running < self.max_concurrent and self._has_capacity(provider) and not self._queues.get(provider):
+                self._start(ticket)
+            else:
+                heapq.heappush(self._queues.setdefault(provider, []), ticket)
+                self._version += 1
+            return ticket
+
+    def _cancel(self, ticket: _Ticket) -> bool:
+        """Tira o pedido da fila; False se ele já tinha recebido a vaga"""
+
+        with self._lock:
+            if ticket.granted.is_set():
+                return False
+            queue = self._queues[ticket.provider]
+            if ticket not in queue:
+                return True
+            queue.remove(ticket)
+            heapq.heapify(queue)
+            self._version += 1
+            return True
+
+    def _release(self, ticket: _Ticket):
+        with self._lock:
+            self._running[ticket.provider] -= 1
+            self._total_running -= 1
+            self._dispatch()
+
+    def _report_position(
+        self,
+        ticket: _Ticket,
+        on_wait: Optional[WaitCallback],
+        reported: Optional[Tuple[int, int]],
+    ) -> Optional[Tuple[int, int]]:
+        """Avisa a posição na fila se ela mudou desde o último aviso"""
+
+        if on_wait is None:
+            return reported
+        with self._lock:
+            self._update_positions()
+            current = (ticket.position, ticket.waiting)
+        if current != reported and not ticket.granted.is_set():
+            try:
+                on_wait(*current)
+            except Exception:
+                # Falhas na interface não devem tirar o pedido da fila
+                pass
+            return current
+        return reported
+
+    def _give_up(self, ticket: _Ticket, max_wait: float):
+        """Desiste do pedido ao fim do prazo (a não ser que a vaga tenha acabado de sair)"""
+
+        if self._cancel(ticket):
+            raise SchedulerTimeoutError(
+                f"fila de geração cheia: nenhuma vaga em {max_wait:.0f}s, tente novamente"
+            )
+
+    def _wait(self, ticket: _Ticket, on_wait: Optional[WaitCallback], max_wait: float):
+        """Espera a vaga, avisando a posição na fila quando ela muda"""
+
+        deadline = time.monotonic() + max_wait
+        reported = None
+        while not ticket.granted.is_set():
+            reported = self._report_position(ticket, on_wait, reported)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._give_up(ticket, max_wait)
+                return
+            ticket.granted.wait(min(SCHEDULER_POSITION_INTERVAL, remaining))
+
+    async def _wait_async(
+        self,
+        ticket: _Ticket,
+        granted: asyncio.Event,
+        on_wait: Optional[WaitCallback],
+        max_wait: float,
+    ):
+        """Versão assíncrona de `_wait`"""
+
+        deadline = time.monotonic() + max_wait
+        reported = None
+        while not ticket.granted.is_set():
+            reported = self._report_position(ticket, on_wait, reported)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._give_up(ticket, max_wait)
+                return
+            try:
+                await asyncio.wait_for(granted.wait(), min(SCHEDULER_POSITION_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    @contextmanager
+    def slot(
+        self,
+        provider: str,
+        session: Optional[str] = None,
+        priority: int = PRIORITY_NORMAL,
+        cost: float = 1.0,
+        on_wait: Optional[WaitCallback] = None,
+        max_wait: float = SCHEDULER_MAX_WAIT,
+    ) -> Iterator[None]:
+        """
+        Ocupa uma vaga do provedor durante o bloco `with`
+
+        Args:
+            provider: Provedor chamado
+            session: Sessão dona da chamada (a justiça é entre sessões)
+            priority: Prioridade (maior passa na frente)
+            cost: Peso da chamada na fila justa (ex.: número de imagens)
+            on_wait: Recebe (posição, total na fila) enquanto a chamada espera
+            max_wait: Tempo máximo na fila
+
+        Raises:
+            SchedulerTimeoutError: Se nenhuma vaga abrir a tempo
+        """
+
+        started = time.perf_counter()
+        ticket = self._submit(provider, session or DEFAULT_SESSION, priority, cost)
+        try:
+            self._wait(ticket, on_wait, max_wait)
+        except BaseException:
+            if not self._cancel(ticket):
+                self._release(ticket)
+            raise
+        get_metrics().observe("scheduler_wait_seconds", time.perf_counter() - started, provider=provider)
+
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    @asynccontextmanager
+    async def slot_async(
+        self,
+        provider: str,
+        session: Optional[str] = None,
+        priority: int = PRIORITY_NORMAL,
+        cost: float = 1.0,
+        on_wait: Optional[WaitCallback] = None,
+        max_wait: float = SCHEDULER_MAX_WAIT,
+    ) -> AsyncIterator[None]:
+        """Versão assíncrona de `slot`: a espera não bloqueia o event loop"""
+
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+
+        def on_granted():
+            # Chamado com o lock do escalonador, possivelmente em outra thread
+            try:
+                loop.call_soon_threadsafe(granted.set)
+            except RuntimeError:
+                # Event loop já fechado: o pedido é liberado pelo `finally`
+                pass
+
+        started = time.perf_counter()
+        ticket = self._submit(provider, session or DEFAULT_SESSION, priority, cost, on_granted)
+        try:
+            await self._wait_async(ticket, granted, on_wait, max_wait)
+        except BaseException:
+            if not self._cancel(ticket):
+                self._release(ticket)
+            raise
+        get_metrics().observe("scheduler_wait_seconds", time.perf_counter() - started, provider=provider)
+
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Chamadas em andamento, na fila e limite, por provedor"""
+
+        with self._lock:
+            providers = set(self._running) | set(self._queues) | set(self.provider_limits)
+            return {
+                provider: {
+                    "running": self._running.get(provider, 0),
+                    "waiting": len(self._queues.get(provider, ())),
+                    "limit": self.provider_limits.get(provider),
+                }
+                for provider in sorted(providers)
+            }
+
+
+_scheduler: Optional[GenerationScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> GenerationScheduler:
+    """Retorna o escalonador compartilhado pelo processo"""
+
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = GenerationScheduler()
+                get_metrics().register_collector(_scheduler_gauges)
+    return _scheduler
+
+
+def _scheduler_gauges():
+    """Ocupação do escalonador para a exposição de métricas"""
+
+    for provider, stats in get_scheduler().stats().items():
+        yield "scheduler_running", {"provider": provider}, stats["running"]
+        yield "scheduler_waiting", {"provider": provider}, stats["waiting"]
@@ -0,0 +1,241 @@
+"""
+Coalescência de requisições de geração idênticas em andamento (single-flight)
+
+O cache de resultados só ajuda depois que a primeira chamada termina. Se
+outra requisição idêntica chega enquanto ela ainda está no provedor (duas
+sessões com o mesmo prompt, ou um clique duplo em "Gerar Imagem"), ela
+espera o resultado da chamada em andamento em vez de pagar outra. Quem
+espera recebe os mesmos eventos de progresso da chamada original.
+
+Os campos que tornam duas requisições "idênticas" são configuráveis com
+`COALESCE_KEY_FIELDS` (padrão: os mesmos da chave do cache mais `api_key`,
+para que uma chamada nunca seja cobrada de outra chave). Um resultado com
+falha não é compartilhado: quem esperava por ele tenta de novo, pois o erro
+pode ser só da chamada original (chave inválida, cota esgotada).
+
+Chamadas síncronas (`run`) e assíncronas (`run_async`) compartilham as
+mesmas chamadas em andamento.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from generators.cache import normalize_prompt
+from generators.clients import _key_fingerprint
+from generators.progress import ProgressCallback
+from utils.metrics import get_metrics
+
+# Campos da requisição que podem compor a chave de coalescência
+COALESCE_FIELDS = ("prompt", "model", "size", "quality", "style", "num_images", "seed", "api_key")
+
+# Liga/desliga a coalescência
+COALESCE_ENABLED = os.getenv("COALESCE_REQUESTS", "true").lower() in ("1", "true", "yes")
+
+# Campos usados na chave (separados por vírgula)
+COALESCE_KEY_FIELDS = tuple(
+    field.strip()
+    for field in os.getenv("COALESCE_KEY_FIELDS", "prompt,model,size,quality,style,num_images,seed,api_key").split(",")
+    if field.strip()
+)
+
+_unknown = set(COALESCE_KEY_FIELDS) - set(COALESCE_FIELDS)
+if _unknown:
+    raise ValueError(f"campos desconhecidos em COALESCE_KEY_FIELDS: {', '.join(sorted(_unknown))}")
+
+
+def make_coalesce_key(fields: Tuple[str, ...] = COALESCE_KEY_FIELDS, **request: Any) -> str:
+    """
+    Calcula a chave de coalescência de uma requisição
+
+    Args:
+        fields: Campos que compõem a chave (ver `COALESCE_FIELDS`)
+        **request: Parâmetros da requisição (prompt, model, size, ...)
+
+    Returns:
+        Hash SHA-256 hexadecimal dos campos escolhidos
+    """
+
+    payload = {}
+    for field in fields:
+        value = request.get(field)
+        if field == "prompt" and value is not None:
+            value = normalize_prompt(value)
+        elif field == "api_key":
+            # A chave nunca entra em claro na chave de coalescência
+            value = _key_fingerprint(value)
+        elif field == "num_images" and value is not None:
+            value = int(value)
+        payload[field] = value
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class _Flight:
+    """Chamada em andamento e quem espera por ela"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.callbacks: List[ProgressCallback] = []
+        self.last_event: Optional[Dict[str, Any]] = None
+        # Avisos para quem espera em um event loop (ver `run_async`)
+        self.waiters: List[Callable[[], None]] = []
+
+
+class SingleFlight:
+    """Executa uma única chamada por chave; chamadas simultâneas compartilham o resultado"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+    def _broadcast(self, flight: _Flight, event: Dict[str, Any]):
+        with self._lock:
+            flight.last_event = event
+            callbacks = list(flight.callbacks)
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                # Falhas na interface de uma sessão não afetam as outras
+                pass
+
+    def _join(
+        self,
+        key: str,
+        progress_callback: Optional[ProgressCallback],
+        waiter: Optional[Callable[[], None]] = None,
+    ) -> Tuple[_Flight, bool]:
+        """Entra na chamada em andamento com a chave ou abre uma nova"""
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            elif waiter is not None:
+                flight.waiters.append(waiter)
+            if progress_callback is not None:
+                flight.callbacks.append(progress_callback)
+            last_event = flight.last_event
+
+        # Quem chega depois vê a etapa atual da chamada em andamento
+        if not leader and progress_callback is not None and last_event is not None:
+            try:
+                progress_callback(last_event)
+            except Exception:
+                pass
+        return flight, leader
+
+    def _finish(self, key: str, flight: _Flight, result: Dict[str, Any]):
+        """Publica o resultado e libera quem espera"""
+
+        with self._lock:
+            self._flights.pop(key, None)
+        # Depois de sair do dicionário ninguém mais entra em `waiters`
+        flight.result = result
+        flight.done.set()
+        for waiter in flight.waiters:
+            try:
+                waiter()
+            except RuntimeError:
+                # Event loop de quem esperava já foi fechado
+                pass
+
+    def run(
+        self,
+        key: str,
+        func: Callable[[ProgressCallback], Dict[str, Any]],
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Executa `func` ou espera a execução em andamento com a mesma chave
+
+        Args:
+            key: Chave de coalescência (ver `make_coalesce_key`)
+            func: Faz a chamada; recebe o callback que repassa o progresso a
+                todos os participantes
+            progress_callback: Callback de progresso de quem chamou
+
+        Returns:
+            (resultado, True se veio de uma chamada já em andamento)
+        """
+
+        while True:
+            flight, leader = self._join(key, progress_callback)
+            if leader:
+                break
+            flight.done.wait()
+            if flight.result["success"]:
+                return flight.result, True
+            # A falha pode ser só da chamada original: tentar de novo
+
+        # Mesmo se a chamada for interrompida, quem espera é liberado
+        result = {"success": False, "error": "geração interrompida", "images": []}
+        try:
+            result = func(lambda event: self._broadcast(flight, event))
+        except Exception as e:
+            result = {"success": False, "error": str(e), "images": []}
+        finally:
+            self._finish(key, flight, result)
+        return result, False
+
+    async def run_async(
+        self,
+        key: str,
+        func: Callable[[ProgressCallback], Awaitable[Dict[str, Any]]],
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Versão assíncrona de `run` (`func` retorna um awaitable)"""
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            done = asyncio.Event()
+            flight, leader = self._join(
+                key, progress_callback, lambda: loop.call_soon_threadsafe(done.set)
+            )
+            if leader:
+                break
+            await done.wait()
+            if flight.result["success"]:
+                return flight.result, True
+
+        result = {"success": False, "error": "geração interrompida", "images": []}
+        try:
+            result = await func(lambda event: self._broadcast(flight, event))
+        except Exception as e:
+            result = {"success": False, "error": str(e), "images": []}
+        finally:
+            self._finish(key, flight, result)
+        return result, False
+
+    def in_flight(self) -> int:
+        """Número de chamadas em andamento"""
+        with self._lock:
+            return len(self._flights)
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Retorna o coalescedor compartilhado pelo processo"""
+
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+                get_metrics().register_collector(_single_flight_gauges)
+    return _single_flight
+
+
+def _single_flight_gauges():
+    """Chamadas em andamento que podem receber requisições coalescidas"""
+    yield "coalesce_in_flight", {}, get_single_flight().in_flight()
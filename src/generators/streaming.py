@@ -0,0 +1,100 @@
+"""
+Leitura em streaming das respostas dos provedores
+
+As imagens que chegam em base64 dentro de um JSON (`b64_json` do DALL-E,
+`artifacts[].base64` da Stability) são decodificadas à medida que os bytes
+chegam, sem montar a string JSON inteira nem a cópia em base64 na memória.
+"""
+
+import base64
+from typing import Iterable, List, Optional
+
+# Tamanho dos pedaços lidos do corpo da resposta
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Base64FieldDecoder:
+    """
+    Extrai e decodifica os valores de um campo base64 de um JSON em pedaços
+
+    Não é um parser JSON completo: procura `"<campo>": "` e decodifica o
+    texto até a próxima aspa, o que basta porque o alfabeto base64 não tem
+    aspas (barras invertidas de escape, como em `\\/`, são descartadas).
+
+    Args:
+        field: Nome do campo (por exemplo, "b64_json" ou "base64")
+    """
+
+    def __init__(self, field: str):
+        self._marker = f'"{field}"'.encode("ascii")
+        self._buffer = bytearray()
+        self._pending = bytearray()
+        self._current: Optional[bytearray] = None
+        self.images: List[bytes] = []
+
+    def _decode_pending(self, final: bool = False):
+        """Decodifica o base64 pendente em blocos de 4 caracteres"""
+
+        usable = len(self._pending) if final else len(self._pending) // 4 * 4
+        if usable:
+            self._current += base64.b64decode(bytes(self._pending[:usable]))
+            del self._pending[:usable]
+
+    def _open_field(self) -> bool:
+        """Procura o início do próximo valor do campo no buffer"""
+
+        while True:
+            start = self._buffer.find(self._marker)
+            if start < 0:
+                # Guarda só o final, que pode conter o começo do marcador
+                del self._buffer[:max(0, len(self._buffer) - len(self._marker))]
+                return False
+
+            quote = self._buffer.find(b'"', start + len(self._marker))
+            if quote < 0:
+                del self._buffer[:start]
+                return False
+
+            # Entre o nome e a aspa só pode haver ":" e espaços (senão é null)
+            if self._buffer[start + len(self._marker):quote].strip(b" \t\r\n:"):
+                del self._buffer[:start + len(self._marker)]
+                continue
+
+            del self._buffer[:quote + 1]
+            self._current = bytearray()
+            return True
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """
+        Processa mais um pedaço da resposta
+
+        Returns:
+            Imagens que terminaram de chegar neste pedaço
+        """
+
+        self._buffer += chunk
+        completed = []
+
+        while self._current is not None or self._open_field():
+            end = self._buffer.find(b'"')
+            data = self._buffer if end < 0 else self._buffer[:end]
+            self._pending += data.replace(b"\\", b"")
+
+            if end < 0:
+                self._buffer.clear()
+                self._decode_pending()
+                break
+
+            del self._buffer[:end + 1]
+            self._decode_pending(final=True)
+            image = bytes(self._current)
+            self._current = None
+            self.images.append(image)
+            completed.append(image)
+
+        return completed
+
+
+def read_body(chunks: Iterable[bytes]) -> bytes:
+    """Junta o corpo binário de uma resposta lida em pedaços"""
+    return b"".join(chunks)
@@ -22,14 +22,32 @@ st.set_page_config(
 # Importar componentes
 from components.sidebar import render_sidebar
 from components.main_interface import render_main_interface
-from components.gallery import render_gallery
+from components.gallery import render_gallery, render_saved_prompts, render_thumbnail_refresh
 from utils.session_state import initialize_session_state
+from components.admin_panel import render_admin_panel
+from generators.clients import warm_up_from_env
+from utils.metrics import get_metrics, start_metrics_export
+
+@st.cache_resource
+def warm_up_connections():
+    """Aquece as conexões com os provedores uma única vez por processo"""
+    if os.getenv("HTTP_WARMUP", "false").lower() in ("1", "true", "yes"):
+        return warm_up_from_env()
+    return {}
+
+@st.cache_resource
+def start_metrics():
+    """Liga o endpoint/arquivo de métricas uma única vez por processo"""
+    return start_metrics_export()
 
 def main():
     """Função principal da aplicação"""
     
     # Inicializar estado da sessão
     initialize_session_state()
+    warm_up_connections()
+    start_metrics()
+    metrics = get_metrics()
     
     # Título principal
     st.title("🎨 AI Portrait Generator")
@@ -44,11 +62,20 @@ def main():
     
     with col2:
         # Interface principal
-        render_main_interface()
+        with metrics.timer("render_seconds", view="main_interface"):
+            render_main_interface()
     
     # Galeria de imagens geradas
     st.markdown("---")
-    render_gallery()
+    with metrics.timer("render_seconds", view="gallery"):
+        render_gallery()
+    
+    render_saved_prompts()
+    
+    render_admin_panel()
+    
+    # Atualiza a página quando as miniaturas em criação ficarem prontas
+    render_thumbnail_refresh()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
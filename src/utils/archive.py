@@ -0,0 +1,325 @@
+"""
+Exportação e importação do histórico em um arquivo compactado, em fluxo
+
+O arquivo (zip ou tar) contém as imagens em `images/<ref>` e, depois delas,
+`history.jsonl` (uma geração por linha), `saved_prompts.jsonl` e
+`settings.json`. Tudo é lido e escrito um item por vez: o histórico vem do
+banco em páginas, cada imagem é copiada direto do armazenamento em disco e o
+JSONL é gerado linha a linha, então a memória usada não cresce com o tamanho
+do histórico. As imagens vêm antes dos metadados para que a importação
+funcione lendo o arquivo em sequência (inclusive de um stream tar).
+"""
+
+import hashlib
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, Optional
+
+from utils.blob_store import QuotaExceededError, get_blob_store, is_valid_ref
+from utils.history_store import get_history_store
+from utils.paths import get_data_dir
+
+ARCHIVE_FORMATS = ("zip", "tar")
+
+IMAGES_DIR = "images/"
+HISTORY_MEMBER = "history.jsonl"
+PROMPTS_MEMBER = "saved_prompts.jsonl"
+SETTINGS_MEMBER = "settings.json"
+
+# Gerações gravadas entre esperas pelo banco (limita a fila de escrita)
+IMPORT_FLUSH_EVERY = 1000
+
+# Arquivos exportados pela interface são apagados depois desse tempo (segundos)
+EXPORT_TTL = float(os.getenv("EXPORT_TTL", "3600"))
+
+# Exportações maiores que isso não são oferecidas para download pela interface
+# (o download passa pela memória do Streamlit); use a linha de comando
+EXPORT_DOWNLOAD_MAX_BYTES = int(os.getenv("EXPORT_DOWNLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+def _history_lines(user: str) -> Iterator[bytes]:
+    for generation in get_history_store().iter_generations(user):
+        generation.pop("id", None)
+        yield (json.dumps(generation, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _prompt_lines(user: str) -> Iterator[bytes]:
+    for prompt in get_history_store().saved_prompts(user):
+        yield (json.dumps({"prompt": prompt}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _image_refs(user: str) -> Iterator[str]:
+    """Referências das imagens do usuário, cada uma uma única vez"""
+
+    seen = set()
+    for generation in get_history_store().iter_generations(user):
+        for ref in generation["images"]:
+            if not is_valid_ref(ref):
+                continue
+            # Guarda o digest binário (32 bytes), não a string hexadecimal
+            digest = bytes.fromhex(ref)
+            if digest not in seen:
+                seen.add(digest)
+                yield ref
+
+
+class _ZipWriter:
+    def __init__(self, fileobj: IO[bytes]):
+        self.archive = zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    def add_file(self, name: str, path: str):
+        # As imagens já são comprimidas; guardá-las sem recompressão é mais rápido
+        self.archive.write(path, name)
+
+    def add_lines(self, name: str, lines: Iterator[bytes]):
+        with self.archive.open(
+            zipfile.ZipInfo(name, date_time=time.localtime()[:6]), "w", force_zip64=True
+        ) as member:
+            for line in lines:
+                member.write(line)
+
+    def close(self):
+        self.archive.close()
+
+
+class _TarWriter:
+    def __init__(self, fileobj: IO[bytes]):
+        self.archive = tarfile.open(fileobj=fileobj, mode="w|")
+
+    def add_file(self, name: str, path: str):
+        self.archive.add(path, arcname=name, recursive=False)
+        # O tarfile guarda todos os membros escritos; em fluxo eles não são necessários
+        self.archive.members.clear()
+
+    def add_lines(self, name: str, lines: Iterator[bytes]):
+        # O tar exige o tamanho antes do conteúdo: as linhas passam por um
+        # arquivo temporário em disco, não pela memória
+        with tempfile.TemporaryFile() as spool:
+            for line in lines:
+                spool.write(line)
+            info = tarfile.TarInfo(name)
+            info.size = spool.tell()
+            info.mtime = int(time.time())
+            spool.seek(0)
+            self.archive.addfile(info, spool)
+
+    def close(self):
+        self.archive.close()
+
+
+def export_archive(
+    fileobj: IO[bytes],
+    user: str,
+    fmt: str = "zip",
+    settings: Optional[Dict[str, Any]] = None,
+) -> Dict[str, int]:
+    """
+    Escreve o histórico do usuário em um arquivo zip ou tar
+
+    Args:
+        fileobj: Destino binário (arquivo aberto ou stream)
+        user: Dono do histórico
+        fmt: "zip" ou "tar"
+        settings: Configurações da sessão a incluir
+
+    Returns:
+        Contadores de imagens, imagens ausentes e gerações exportadas
+    """
+
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"formato de arquivo desconhecido: {fmt}")
+
+    store = get_blob_store()
+    writer = _ZipWriter(fileobj) if fmt == "zip" else _TarWriter(fileobj)
+    counts = {"images": 0, "missing_images": 0, "generations": 0, "saved_prompts": 0}
+
+    try:
+        for ref in _image_refs(user):
+            path = store.path(ref)
+            if not path.is_file():
+                counts["missing_images"] += 1
+                continue
+            writer.add_file(IMAGES_DIR + ref, str(path))
+            counts["images"] += 1
+
+        def history_lines():
+            for line in _history_lines(user):
+                counts["generations"] += 1
+                yield line
+
+        def prompt_lines():
+            for line in _prompt_lines(user):
+                counts["saved_prompts"] += 1
+                yield line
+
+        writer.add_lines(HISTORY_MEMBER, history_lines())
+        writer.add_lines(PROMPTS_MEMBER, prompt_lines())
+        writer.add_lines(SETTINGS_MEMBER, iter([json.dumps(settings or {}, ensure_ascii=False).encode("utf-8")]))
+    finally:
+        writer.close()
+
+    return counts
+
+
+def new_export_path(user: str, fmt: str) -> Path:
+    """
+    Caminho para uma nova exportação do usuário em `.data/exports`
+
+    Apaga as exportações anteriores do usuário e as de qualquer usuário com
+    mais de `EXPORT_TTL` segundos.
+    """
+
+    exports = get_data_dir("exports")
+    cutoff = time.time() - EXPORT_TTL
+    for path in exports.iterdir():
+        try:
+            if path.name.startswith(f"{user}-") or path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            continue
+    return exports / f"{user}-{int(time.time())}.{fmt}"
+
+
+def _generation_key(generation: Dict[str, Any]) -> bytes:
+    """Digest (16 bytes) do par timestamp + prompt que identifica a geração"""
+    payload = json.dumps([generation["timestamp"], generation["prompt"]], ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+
+def _iter_members(fileobj: IO[bytes]) -> Iterator[tuple]:
+    """
+    (nome, stream) de cada membro, em ordem, para zip ou tar
+
+    No zip, só o diretório central (alguns bytes por membro) fica em memória.
+    """
+
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as member:
+                        yield info.filename, member
+        return
+
+    fileobj.seek(0)
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for info in archive:
+            if info.isfile():
+                yield info.name, archive.extractfile(info)
+            archive.members.clear()
+
+
+def import_archive(fileobj: IO[bytes], user: str) -> Dict[str, Any]:
+    """
+    Restaura um arquivo exportado no histórico do usuário, em fluxo
+
+    As imagens são gravadas no armazenamento à medida que aparecem e as
+    gerações são enviadas ao banco linha a linha. Gerações cujas imagens
+    faltam no arquivo e no disco, ou que já estão no histórico (ou repetidas
+    no próprio arquivo), são puladas, assim como prompts salvos que o usuário
+    já tem e referências de imagem fora do formato do hash.
+
+    Args:
+        fileobj: Arquivo zip ou tar (precisa aceitar seek para zip)
+        user: Dono do histórico que recebe os dados
+
+    Returns:
+        Contadores de imagens, gerações, prompts e itens pulados, as
+        configurações salvas e, se a importação parou, o erro
+    """
+
+    blobs = get_blob_store()
+    history = get_history_store()
+    result: Dict[str, Any] = {
+        "images": 0,
+        "generations": 0,
+        "saved_prompts": 0,
+        "skipped": 0,
+        "settings": {},
+        "error": None,
+    }
+
+    # As gravações no banco são em lote: `has_generation` não vê as gerações
+    # deste arquivo ainda na fila, então as já importadas ficam aqui
+    imported = set()
+
+    try:
+        for name, member in _iter_members(fileobj):
+            if name.startswith(IMAGES_DIR):
+                ref = name[len(IMAGES_DIR):]
+                # Nomes fora do formato do hash (ex.: "../../etc/passwd") são recusados
+                if not is_valid_ref(ref):
+                    result["skipped"] += 1
+                    continue
+                if blobs.exists(ref):
+                    continue
+                # Uma imagem por vez; a referência confere o conteúdo
+                if blobs.put(member.read()) != ref:
+                    result["skipped"] += 1
+                    continue
+                result["images"] += 1
+
+            elif name == HISTORY_MEMBER:
+                for line in member:
+                    try:
+                        generation = json.loads(line)
+                    except ValueError:
+                        result["skipped"] += 1
+                        continue
+                    images = generation.get("images") if isinstance(generation, dict) else None
+                    # `exists` também recusa referências fora do formato do hash
+                    if not isinstance(images, list) or not images or not all(blobs.exists(ref) for ref in images):
+                        result["skipped"] += 1
+                        continue
+                    try:
+                        key = _generation_key(generation)
+                        if key in imported or history.has_generation(
+                            user, generation["timestamp"], generation["prompt"]
+                        ):
+                            result["skipped"] += 1
+                            continue
+                        history.add_generation(user, generation)
+                    except KeyError:
+                        result["skipped"] += 1
+                        continue
+                    imported.add(key)
+                    result["generations"] += 1
+                    if result["generations"] % IMPORT_FLUSH_EVERY == 0:
+                        history.flush(user)
+
+            elif name == PROMPTS_MEMBER:
+                # Prompts que o usuário já tem (ou repetidos no arquivo) são pulados
+                saved = set(history.saved_prompts(user))
+                for line in member:
+                    try:
+                        prompt = json.loads(line)["prompt"]
+                    except (ValueError, KeyError, TypeError):
+                        result["skipped"] += 1
+                        continue
+                    if not isinstance(prompt, str) or prompt in saved:
+                        result["skipped"] += 1
+                        continue
+                    history.add_saved_prompt(user, prompt)
+                    saved.add(prompt)
+                    result["saved_prompts"] += 1
+
+            elif name == SETTINGS_MEMBER:
+                try:
+                    result["settings"] = json.loads(member.read())
+                except ValueError:
+                    pass
+
+    except QuotaExceededError as e:
+        result["error"] = f"limite de armazenamento atingido: {e}"
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+        result["error"] = f"arquivo inválido: {e}"
+    finally:
+        history.flush(user)
+
+    return result
@@ -0,0 +1,319 @@
+"""
+Armazenamento em disco das imagens geradas, endereçado pelo hash do conteúdo
+
+As imagens são gravadas uma única vez em `<raiz>/<2 primeiros hex>/<sha256>`
+e o estado da sessão guarda só a referência (o hash). Leituras usam mmap
+para evitar cópias, e há cotas de bytes por sessão e global, além da
+limpeza de arquivos que nenhuma sessão referencia mais (junto com as
+miniaturas e versões transcodificadas derivadas deles). Só referências no
+formato do hash (64 caracteres hexadecimais) viram caminhos: referências
+vindas de arquivos importados não apontam para fora do armazenamento.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from utils.paths import get_data_dir
+
+# Cotas de armazenamento em bytes
+BLOB_SESSION_QUOTA = int(os.getenv("BLOB_SESSION_QUOTA", str(500 * 1024 * 1024)))
+BLOB_GLOBAL_QUOTA = int(os.getenv("BLOB_GLOBAL_QUOTA", str(10 * 1024 * 1024 * 1024)))
+
+# Sessões sem atividade há mais tempo que isso deixam de proteger seus arquivos
+BLOB_SESSION_TTL = float(os.getenv("BLOB_SESSION_TTL", str(6 * 3600)))
+
+# Arquivos órfãos mais novos que isso são preservados (gravações em andamento)
+BLOB_ORPHAN_GRACE = float(os.getenv("BLOB_ORPHAN_GRACE", "3600"))
+
+# Intervalo mínimo entre limpezas automáticas
+BLOB_CLEANUP_INTERVAL = float(os.getenv("BLOB_CLEANUP_INTERVAL", "600"))
+
+# Formato de uma referência: SHA-256 hexadecimal em minúsculas
+REF_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def is_valid_ref(ref: object) -> bool:
+    """Indica se o valor tem o formato de uma referência do armazenamento"""
+    return isinstance(ref, str) and REF_PATTERN.fullmatch(ref) is not None
+
+
+class QuotaExceededError(Exception):
+    """Gravar a imagem ultrapassaria a cota da sessão ou a cota global"""
+
+
+class BlobStore:
+    """
+    Armazenamento de imagens por hash de conteúdo com cotas
+
+    Args:
+        root: Diretório de armazenamento
+        session_quota: Máximo de bytes referenciados por sessão
+        global_quota: Máximo de bytes em disco
+    """
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        session_quota: int = BLOB_SESSION_QUOTA,
+        global_quota: int = BLOB_GLOBAL_QUOTA,
+    ):
+        self.root = Path(root) if root else get_data_dir("blobs")
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.session_quota = session_quota
+        self.global_quota = global_quota
+        self._lock = threading.Lock()
+        # Serializa verificação de cota + gravação e a remoção de arquivos
+        # (reentrante: `put` chama `cleanup_orphans` para liberar espaço)
+        self._write_lock = threading.RLock()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._session_refs: Dict[str, Set[str]] = {}
+        self._session_seen: Dict[str, float] = {}
+        self._ref_sources: List[Callable[[], Iterable[str]]] = []
+        self._last_cleanup = time.monotonic()
+        self._scan()
+
+    def _scan(self):
+        """Carrega o tamanho dos arquivos já existentes em disco"""
+        for path in self.root.glob("*/*"):
+            if path.is_file() and is_valid_ref(path.name):
+                self._sizes[path.name] = path.stat().st_size
+        self._total_bytes = sum(self._sizes.values())
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def path(self, ref: str) -> Path:
+        """
+        Caminho do arquivo de uma referência
+
+        Raises:
+            ValueError: Se a referência não tem o formato de um SHA-256
+        """
+        if not is_valid_ref(ref):
+            raise ValueError(f"referência de imagem inválida: {ref!r}")
+        return self.root / ref[:2] / ref
+
+    def exists(self, ref: str) -> bool:
+        """Indica se a imagem está armazenada (False para referências inválidas)"""
+        if not is_valid_ref(ref):
+            return False
+        return ref in self._sizes or self.path(ref).is_file()
+
+    def session_bytes(self, session_id: str) -> int:
+        """Bytes referenciados pela sessão"""
+        with self._lock:
+            return sum(self._sizes.get(ref, 0) for ref in self._session_refs.get(session_id, ()))
+
+    def put(self, data: bytes, session_id: Optional[str] = None) -> str:
+        """
+        Grava a imagem (se ainda não existir) e a associa à sessão
+
+        Args:
+            data: Bytes da imagem
+            session_id: Sessão dona da referência
+
+        Returns:
+            Referência da imagem (hash SHA-256 hexadecimal)
+
+        Raises:
+            QuotaExceededError: Se a gravação ultrapassar alguma cota
+        """
+
+        ref = hashlib.sha256(data).hexdigest()
+        size = len(data)
+
+        # Cotas verificadas e arquivo gravado sob o mesmo lock: gravações
+        # simultâneas não passam juntas por uma cota quase cheia
+        with self._write_lock:
+            with self._lock:
+                is_new = ref not in self._sizes
+                refs = self._session_refs.get(session_id, set()) if session_id else set()
+
+                if session_id and ref not in refs:
+                    used = sum(self._sizes.get(r, 0) for r in refs)
+                    if used + size > self.session_quota:
+                        raise QuotaExceededError(
+                            f"cota da sessão excedida ({used + size} de {self.session_quota} bytes)"
+                        )
+
+            if is_new and self.total_bytes + size > self.global_quota:
+                # Tenta liberar espaço de arquivos órfãos antes de recusar
+                self.cleanup_orphans()
+                if self.total_bytes + size > self.global_quota:
+                    raise QuotaExceededError(
+                        f"cota global excedida ({self.total_bytes + size} de {self.global_quota} bytes)"
+                    )
+
+            if is_new:
+                path = self.path(ref)
+                path.parent.mkdir(exist_ok=True)
+                tmp_path = path.with_name(f"{ref}.{threading.get_ident()}.tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+            else:
+                # Renova o mtime para protegê-lo da limpeza de órfãos
+                os.utime(self.path(ref))
+
+            with self._lock:
+                if ref not in self._sizes:
+                    self._sizes[ref] = size
+                    self._total_bytes += size
+                if session_id:
+                    self._session_refs.setdefault(session_id, set()).add(ref)
+                    self._session_seen[session_id] = time.monotonic()
+
+        return ref
+
+    def read(self, ref: str) -> memoryview:
+        """
+        Lê a imagem sem copiá-la para a memória do processo (mmap)
+
+        Returns:
+            memoryview somente leitura sobre o arquivo mapeado
+        """
+
+        with open(self.path(ref), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"")
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)
+
+    def read_bytes(self, ref: str) -> bytes:
+        """Lê a imagem como bytes (para APIs que exigem bytes)"""
+        return self.path(ref).read_bytes()
+
+    def touch_session(self, session_id: str):
+        """Marca a sessão como ativa e dispara a limpeza periódica se for a hora"""
+
+        with self._lock:
+            self._session_seen[session_id] = time.monotonic()
+            due = time.monotonic() - self._last_cleanup >= BLOB_CLEANUP_INTERVAL
+            if due:
+                self._last_cleanup = time.monotonic()
+
+        if due:
+            threading.Thread(target=self.cleanup_orphans, name="blob-cleanup", daemon=True).start()
+
+    def retain(self, session_id: str, refs: Iterable[str]):
+        """Substitui o conjunto de referências mantidas pela sessão"""
+        with self._lock:
+            self._session_refs[session_id] = {ref for ref in refs if ref in self._sizes}
+            self._session_seen[session_id] = time.monotonic()
+
+    def release_session(self, session_id: str):
+        """Remove todas as referências da sessão"""
+        with self._lock:
+            self._session_refs.pop(session_id, None)
+            self._session_seen.pop(session_id, None)
+
+    def add_ref_source(self, source: Callable[[], Iterable[str]]):
+        """Adiciona uma fonte de referências persistidas que a limpeza deve preservar"""
+        with self._lock:
+            if source not in self._ref_sources:
+                self._ref_sources.append(source)
+
+    def cleanup_orphans(
+        self,
+        live_refs: Optional[Iterable[str]] = None,
+        grace_seconds: float = BLOB_ORPHAN_GRACE,
+    ) -> int:
+        """
+        Apaga arquivos que nenhuma sessão ativa referencia, com suas
+        miniaturas e versões transcodificadas
+
+        Args:
+            live_refs: Referências extras a preservar (por exemplo, persistidas)
+            grace_seconds: Idade mínima do arquivo para ser considerado órfão
+
+        Returns:
+            Número de arquivos removidos
+        """
+
+        # Sem saber o que está persistido, não é seguro apagar nada
+        protected = set(live_refs or ())
+        try:
+            for source in list(self._ref_sources):
+                protected.update(source())
+        except Exception:
+            return 0
+
+        now = time.monotonic()
+        with self._lock:
+            # Sessões inativas há muito tempo deixam de proteger seus arquivos
+            for session_id, seen in list(self._session_seen.items()):
+                if now - seen > BLOB_SESSION_TTL:
+                    self._session_refs.pop(session_id, None)
+                    self._session_seen.pop(session_id, None)
+
+            for refs in self._session_refs.values():
+                protected |= refs
+            candidates = [ref for ref in self._sizes if ref not in protected]
+
+        removed = 0
+        cutoff = time.time() - grace_seconds
+        for ref in candidates:
+            path = self.path(ref)
+            # Sob o lock de gravação: um `put` da mesma imagem renova o mtime
+            # antes da verificação ou espera a remoção terminar
+            with self._write_lock:
+                try:
+                    if path.stat().st_mtime > cutoff:
+                        continue
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                with self._lock:
+                    self._total_bytes -= self._sizes.pop(ref, 0)
+            self._delete_derived(ref)
+            removed += 1
+
+        return removed
+
+    def _delete_derived(self, ref: str):
+        """Apaga as miniaturas e versões transcodificadas de uma imagem removida"""
+
+        # Importados aqui para não carregar o pool de processos com o armazenamento
+        from utils.thumbnails import delete_thumbnails
+        from utils.transcode import delete_variants
+
+        try:
+            delete_thumbnails(ref)
+            delete_variants(ref)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        """Retorna números de uso do armazenamento"""
+        with self._lock:
+            return {
+                "blobs": len(self._sizes),
+                "bytes": self._total_bytes,
+                "sessions": len(self._session_refs),
+                "global_quota": self.global_quota,
+                "session_quota": self.session_quota,
+            }
+
+
+_blob_store: Optional[BlobStore] = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """Retorna o armazenamento de imagens compartilhado pelo processo"""
+
+    global _blob_store
+    if _blob_store is None:
+        with _blob_store_lock:
+            if _blob_store is None:
+                _blob_store = BlobStore()
+    return _blob_store
@@ -0,0 +1,365 @@
+"""
+Índice invertido para busca no histórico de gerações e nos prompts salvos
+
+Cada geração é indexada uma vez, quando entra no histórico: as palavras do
+prompt (sem acentos nem caixa) apontam para os documentos que as contêm e
+modelo, tamanho, qualidade e estilo têm listas próprias. A busca intersecta
+as listas mais curtas primeiro e o intervalo de datas vira um intervalo de
+documentos (o histórico só cresce em ordem de tempo), então nenhuma consulta
+percorre todas as gerações.
+
+O índice do histórico é um por usuário, compartilhado pelas sessões do
+processo e montado a partir do banco em páginas; as sessões não carregam as
+gerações, só buscam os ids e leem do banco as que vão mostrar.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from utils.history_store import HISTORY_SEARCH_LIMIT, Cursor, HistoryStore, get_history_store
+
+# Campos de `parameters` (e o modelo) que podem ser filtrados
+FILTER_FIELDS = ("model", "size", "quality", "style")
+
+# Tamanho mínimo da última palavra para casar como prefixo
+MIN_PREFIX_LENGTH = 3
+
+# Usuários com o índice do histórico mantido em memória (os menos usados saem)
+HISTORY_SEARCH_MAX_USERS = int(os.getenv("HISTORY_SEARCH_MAX_USERS", "64"))
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Palavras do texto sem acentos e em caixa baixa"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _WORD.findall(stripped)
+
+
+class InvertedIndex:
+    """
+    Índice invertido de textos com filtros por campo
+
+    Os documentos recebem ids crescentes na ordem em que são adicionados;
+    cada termo e cada valor de filtro guarda o conjunto de ids. A última
+    palavra da consulta casa como prefixo, para a busca funcionar enquanto o
+    usuário digita.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[int]] = {}
+        self._vocabulary: List[str] = []
+        self._filters: Dict[Tuple[str, str], Set[int]] = {}
+        self._timestamps: List[float] = []
+        self._payloads: List[Any] = []
+        self._deleted: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._payloads) - len(self._deleted)
+
+    def add(
+        self,
+        text: str,
+        payload: Any,
+        timestamp: float = 0.0,
+        fields: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """
+        Indexa um documento
+
+        Args:
+            text: Texto pesquisável
+            payload: Valor devolvido na busca (ex.: posição no histórico)
+            timestamp: Data do documento (deve ser não decrescente)
+            fields: Valores dos filtros (modelo, tamanho, qualidade, estilo)
+
+        Returns:
+            Id do documento
+        """
+
+        doc_id = len(self._payloads)
+        self._payloads.append(payload)
+        # Mantém os timestamps ordenados mesmo se o relógio voltar
+        if self._timestamps and timestamp < self._timestamps[-1]:
+            timestamp = self._timestamps[-1]
+        self._timestamps.append(timestamp)
+
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = set()
+                insort(self._vocabulary, term)
+            postings.add(doc_id)
+
+        for field, value in (fields or {}).items():
+            if value is not None:
+                self._filters.setdefault((field, str(value)), set()).add(doc_id)
+
+        return doc_id
+
+    def remove(self, doc_id: int):
+        """Marca o documento como removido (deixa de aparecer nas buscas)"""
+        self._deleted.add(doc_id)
+
+    def _term_postings(self, term: str, prefix: bool) -> Set[int]:
+        # Prefixos muito curtos casariam com boa parte do vocabulário
+        if not prefix or len(term) < MIN_PREFIX_LENGTH:
+            return self._postings.get(term, set())
+
+        # Todos os termos do vocabulário que começam com o prefixo
+        start = bisect_left(self._vocabulary, term)
+        end = bisect_left(self._vocabulary, term + "\uffff")
+        if end - start == 1:
+            return self._postings[self._vocabulary[start]]
+        matched: Set[int] = set()
+        for vocab_term in self._vocabulary[start:end]:
+            matched |= self._postings[vocab_term]
+        return matched
+
+    def values(self, field: str) -> List[str]:
+        """Valores já indexados de um filtro (para montar as opções da interface)"""
+        return sorted(
+            value for (name, value), docs in self._filters.items()
+            if name == field and docs - self._deleted
+        )
+
+    def search(
+        self,
+        query: str = "",
+        filters: Optional[Dict[str, Iterable[str]]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> List[Any]:
+        """
+        Busca documentos que contêm todas as palavras e passam nos filtros
+
+        Args:
+            query: Texto da busca (vazio = todos)
+            filters: Valores aceitos por campo (ex.: {"model": ["DALL-E 3"]})
+            start: Data mínima (timestamp, inclusiva)
+            end: Data máxima (timestamp, exclusiva)
+            limit: Máximo de resultados
+
+        Returns:
+            Payloads dos documentos encontrados, do mais recente ao mais antigo
+        """
+
+        candidates: List[Set[int]] = []
+
+        terms = tokenize(query)
+        typing = bool(query) and not query[-1].isspace()
+        for position, term in enumerate(terms):
+            candidates.append(self._term_postings(term, prefix=typing and position == len(terms) - 1))
+
+        for field, values in (filters or {}).items():
+            values = list(values)
+            if not values:
+                continue
+            if len(values) == 1:
+                candidates.append(self._filters.get((field, str(values[0])), set()))
+            else:
+                candidates.append(set().union(*(self._filters.get((field, str(v)), set()) for v in values)))
+
+        # Intervalo de datas -> intervalo de ids (timestamps em ordem)
+        low = bisect_left(self._timestamps, start) if start is not None else 0
+        high = bisect_left(self._timestamps, end) if end is not None else len(self._timestamps)
+
+        if candidates:
+            candidates.sort(key=len)
+            smallest = len(candidates[0])
+            if limit is not None and smallest * smallest > limit * (high - low):
+                # Filtros pouco seletivos: mais barato descer a partir dos
+                # documentos mais recentes até completar o limite
+                ordered = []
+                for doc in range(high - 1, low - 1, -1):
+                    if doc not in self._deleted and all(doc in docs for docs in candidates):
+                        ordered.append(doc)
+                        if len(ordered) >= limit:
+                            break
+                return [self._payloads[doc] for doc in ordered]
+
+            matched = set(candidates[0])
+            for docs in candidates[1:]:
+                if not matched:
+                    break
+                matched &= docs
+            ordered: Sequence[int] = sorted(
+                (doc for doc in matched if low <= doc < high and doc not in self._deleted),
+                reverse=True,
+            )
+        else:
+            ordered = []
+            for doc in range(high - 1, low - 1, -1):
+                if limit is not None and len(ordered) >= limit:
+                    break
+                if doc not in self._deleted:
+                    ordered.append(doc)
+
+        if limit is not None:
+            ordered = ordered[:limit]
+        return [self._payloads[doc] for doc in ordered]
+
+
+class HistorySearch:
+    """
+    Índice de busca do histórico de gerações de um usuário
+
+    Compartilhado pelas sessões do usuário (ver `get_history_search`). Cobre
+    as `limit` gerações mais recentes, lidas do banco em páginas, e guarda só
+    o texto indexado, os filtros e as referências das imagens: cada resultado
+    é (id da geração, número da geração no histórico). `sync` acrescenta as
+    gerações gravadas desde a última chamada, por qualquer sessão, trabalho
+    em segundo plano ou importação; se o histórico foi apagado ou recebeu
+    gerações mais antigas que as indexadas, o índice é refeito.
+
+    Args:
+        user: Dono do histórico
+        store: Histórico persistente (padrão: o compartilhado)
+        limit: Máximo de gerações indexadas na montagem
+    """
+
+    def __init__(
+        self,
+        user: str,
+        store: Optional[HistoryStore] = None,
+        limit: int = HISTORY_SEARCH_LIMIT,
+    ):
+        self.user = user
+        self.store = store or get_history_store()
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._built = False
+        self._reset(first_number=1, cursor=None)
+
+    def _reset(self, first_number: int, cursor: Optional[Cursor]):
+        self._generations = InvertedIndex()
+        # Referência da imagem -> (timestamp, id, número) das gerações que a contêm
+        self._images: Dict[str, List[Tuple[float, int, int]]] = {}
+        self._first_number = first_number
+        self._cursor = cursor
+        self._count = 0
+
+    def _build(self, total: int):
+        """Recomeça o índice a partir das `limit` gerações mais recentes (com o lock)"""
+        self._reset(
+            first_number=max(0, total - self.limit) + 1,
+            cursor=self.store.recent_cursor(self.user, self.limit),
+        )
+        self._built = True
+
+    def _pull(self) -> List[str]:
+        """Indexa as gerações depois do cursor (com o lock); devolve as imagens delas"""
+
+        refs = []
+        for generation in self.store.iter_generations(self.user, after=self._cursor):
+            number = self._first_number + self._count
+            parameters = generation.get("parameters") or {}
+            self._generations.add(
+                generation["prompt"],
+                (generation["id"], number),
+                generation["timestamp"],
+                {
+                    "model": generation["model"],
+                    **{field: parameters.get(field) for field in FILTER_FIELDS[1:]},
+                },
+            )
+            for ref in generation["images"]:
+                self._images.setdefault(ref, []).append((generation["timestamp"], generation["id"], number))
+                refs.append(ref)
+            self._cursor = (generation["timestamp"], generation["id"])
+            self._count += 1
+        return refs
+
+    def sync(self) -> List[str]:
+        """
+        Atualiza o índice com as gerações novas do banco
+
+        Returns:
+            Referências das imagens das gerações indexadas nesta chamada
+        """
+
+        with self._lock:
+            total = self.store.count(self.user)
+            if not self._built:
+                self._build(total)
+            refs = self._pull()
+            if self._first_number - 1 + self._count != total:
+                self._build(total)
+                refs = self._pull()
+            return refs
+
+    def search(
+        self,
+        query: str = "",
+        filters: Optional[Dict[str, Iterable[str]]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        Busca no histórico (argumentos de `InvertedIndex.search`)
+
+        Returns:
+            (id, número) das gerações encontradas, da mais recente à mais antiga
+        """
+        with self._lock:
+            return self._generations.search(query, filters, start, end, limit)
+
+    def values(self, field: str) -> List[str]:
+        """Valores já indexados de um filtro"""
+        with self._lock:
+            return self._generations.values(field)
+
+    def with_image(self, ref: str) -> List[Tuple[float, int, int]]:
+        """(timestamp, id, número) das gerações indexadas que contêm a imagem"""
+        with self._lock:
+            return list(self._images.get(ref, ()))
+
+    def newest_with_image(self, ref: str) -> Optional[float]:
+        """Timestamp da geração mais recente que contém a imagem (None se nenhuma)"""
+        with self._lock:
+            found = self._images.get(ref)
+            return max(timestamp for timestamp, _, _ in found) if found else None
+
+
+class PromptSearch:
+    """Índice dos prompts salvos da sessão; refeito se a lista for alterada no meio"""
+
+    def __init__(self):
+        self.prompts = InvertedIndex()
+        self._synced: Tuple[int, Any] = (0, None)
+
+    def sync(self, saved_prompts: Sequence[str]):
+        """Indexa os prompts adicionados desde a última chamada"""
+
+        count, last = self._synced
+        if count > len(saved_prompts) or (count > 0 and saved_prompts[count - 1] is not last):
+            self.prompts = InvertedIndex()
+            count = 0
+        for position in range(count, len(saved_prompts)):
+            self.prompts.add(saved_prompts[position], position)
+        self._synced = (len(saved_prompts), saved_prompts[-1] if saved_prompts else None)
+
+
+_history_searches: "OrderedDict[str, HistorySearch]" = OrderedDict()
+_history_searches_lock = threading.Lock()
+
+
+def get_history_search(user: str) -> HistorySearch:
+    """Retorna o índice do histórico do usuário, compartilhado pelas sessões do processo"""
+
+    with _history_searches_lock:
+        search = _history_searches.get(user)
+        if search is None:
+            search = _history_searches[user] = HistorySearch(user)
+        _history_searches.move_to_end(user)
+        while len(_history_searches) > HISTORY_SEARCH_MAX_USERS:
+            _history_searches.popitem(last=False)
+    return search
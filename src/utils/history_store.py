@@ -0,0 +1,406 @@
+"""
+Histórico de gerações e prompts salvos persistido em SQLite
+
+O banco fica em modo WAL: leituras não bloqueiam escritas nem outras
+leituras, então as sessões do Streamlit consultam o histórico ao mesmo tempo
+sem esperar umas pelas outras. Todas as escritas passam por uma única thread,
+que as agrupa em lotes (uma transação por lote); quem precisa ler o que
+acabou de escrever espera só as próprias escritas. A galeria pagina por
+conjunto de chaves (timestamp, id), sem OFFSET, então qualquer página custa
+o mesmo que a primeira.
+"""
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from utils.blob_store import get_blob_store
+from utils.paths import get_data_dir
+
+# Arquivo do banco (padrão: <APP_DATA_DIR>/history/history.db)
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "")
+
+# Escritas agrupadas: até HISTORY_BATCH_SIZE operações ou HISTORY_FLUSH_INTERVAL segundos
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "64"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))
+
+# Gerações mais recentes cobertas pela busca no histórico (por usuário)
+HISTORY_SEARCH_LIMIT = int(os.getenv("HISTORY_SEARCH_LIMIT", "10000"))
+
+# Cursor da paginação: (timestamp, id) da última geração da página anterior
+Cursor = Tuple[float, int]
+
+# Marca na fila de escrita: fecha o lote em formação sem esperar o prazo
+_FLUSH = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    model TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    images TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    latency REAL
+);
+CREATE INDEX IF NOT EXISTS generations_user_time ON generations (user, timestamp, id);
+CREATE INDEX IF NOT EXISTS generations_model_time ON generations (model, timestamp);
+CREATE INDEX IF NOT EXISTS generations_time ON generations (timestamp);
+
+CREATE TABLE IF NOT EXISTS saved_prompts (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    prompt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS saved_prompts_user ON saved_prompts (user, id);
+"""
+
+
+def _row_to_generation(row: sqlite3.Row) -> Dict[str, Any]:
+    generation = {
+        "id": row["id"],
+        "prompt": row["prompt"],
+        "images": json.loads(row["images"]),
+        "timestamp": row["timestamp"],
+        "model": row["model"],
+        "parameters": json.loads(row["parameters"]),
+    }
+    if row["latency"] is not None:
+        generation["latency"] = row["latency"]
+    return generation
+
+
+class HistoryStore:
+    """
+    Histórico persistente, com uma thread de escrita e leituras por thread
+
+    Args:
+        path: Arquivo do banco SQLite
+        batch_size: Máximo de operações por transação
+        flush_interval: Espera máxima para completar um lote, em segundos
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        batch_size: int = HISTORY_BATCH_SIZE,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL,
+    ):
+        if path is None:
+            path = Path(HISTORY_DB_PATH) if HISTORY_DB_PATH else get_data_dir("history") / "history.db"
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Conexões de leitura reaproveitadas entre threads (uma por leitura em andamento)
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        # Escritas ainda na fila, por usuário (leituras só esperam as próprias)
+        self._pending: Dict[str, int] = {}
+        self._pending_changed = threading.Condition()
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """
+        Empresta uma conexão de leitura
+
+        Os reruns do Streamlit rodam em threads novas; reaproveitar conexões
+        evita abrir o banco a cada rerun. Cada conexão é usada por uma thread
+        de cada vez.
+        """
+
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    # Escritas
+
+    def _enqueue(self, user: str, sql: str, params: Tuple[Any, ...]):
+        with self._pending_changed:
+            self._pending[user] = self._pending.get(user, 0) + 1
+        self._queue.put((user, sql, params))
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Completa o lote até o tamanho máximo, o prazo ou um pedido de flush
+            while batch[-1] is not _FLUSH and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            operations = [item for item in batch if isinstance(item, tuple)]
+            if operations:
+                try:
+                    with conn:
+                        for _, sql, params in operations:
+                            conn.execute(sql, params)
+                except sqlite3.Error:
+                    # Um lote com erro é aplicado operação por operação
+                    for _, sql, params in operations:
+                        try:
+                            with conn:
+                                conn.execute(sql, params)
+                        except sqlite3.Error:
+                            pass
+                with self._pending_changed:
+                    for user, _, _ in operations:
+                        self._pending[user] -= 1
+                        if not self._pending[user]:
+                            del self._pending[user]
+                    self._pending_changed.notify_all()
+
+    def flush(self, user: Optional[str] = None, timeout: float = 10.0):
+        """
+        Espera as escritas pendentes serem gravadas
+
+        Args:
+            user: Se informado, espera só as escritas desse usuário, e não as
+                de outros usuários que estão depois delas na fila
+            timeout: Espera máxima em segundos
+        """
+
+        def written() -> bool:
+            return not (self._pending.get(user) if user is not None else self._pending)
+
+        with self._pending_changed:
+            if written():
+                return
+        self._queue.put(_FLUSH)
+        with self._pending_changed:
+            self._pending_changed.wait_for(written, timeout)
+
+    def add_generation(self, user: str, generation: Dict[str, Any]):
+        """Agenda a gravação de uma geração (mesmo formato do histórico da sessão)"""
+
+        self._enqueue(
+            user,
+            "INSERT INTO generations (user, timestamp, model, prompt, images, parameters, latency)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                user,
+                generation["timestamp"],
+                generation["model"],
+                generation["prompt"],
+                json.dumps(generation["images"]),
+                json.dumps(generation.get("parameters") or {}, ensure_ascii=False),
+                generation.get("latency"),
+            ),
+        )
+
+    def add_saved_prompt(self, user: str, prompt: str):
+        self._enqueue(
+            user,
+            "INSERT INTO saved_prompts (user, timestamp, prompt) VALUES (?, ?, ?)",
+            (user, time.time(), prompt),
+        )
+
+    def remove_saved_prompt(self, user: str, prompt: str):
+        """Remove uma ocorrência do prompt salvo (a mais antiga)"""
+        self._enqueue(
+            user,
+            "DELETE FROM saved_prompts WHERE id = "
+            "(SELECT MIN(id) FROM saved_prompts WHERE user = ? AND prompt = ?)",
+            (user, prompt),
+        )
+
+    def clear_user(self, user: str):
+        """Apaga o histórico de gerações do usuário"""
+        self._enqueue(user, "DELETE FROM generations WHERE user = ?", (user,))
+
+    # Leituras
+
+    def count(self, user: str) -> int:
+        self.flush(user)
+        with self._reader() as conn:
+            return conn.execute("SELECT COUNT(*) FROM generations WHERE user = ?", (user,)).fetchone()[0]
+
+    def page(
+        self,
+        user: str,
+        before: Optional[Cursor] = None,
+        limit: int = 10,
+    ) -> Tuple[List[Dict[str, Any]], Optional[Cursor]]:
+        """
+        Uma página do histórico, da geração mais recente para a mais antiga
+
+        Args:
+            user: Dono do histórico
+            before: Cursor devolvido pela página anterior (None = primeira)
+            limit: Gerações por página
+
+        Returns:
+            Gerações da página e o cursor da próxima (None se acabou)
+        """
+
+        self.flush(user)
+        with self._reader() as conn:
+            if before is None:
+                rows = conn.execute(
+                    "SELECT * FROM generations WHERE user = ?"
+                    " ORDER BY timestamp DESC, id DESC LIMIT ?",
+                    (user, limit + 1),
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM generations WHERE user = ? AND (timestamp, id) < (?, ?)"
+                    " ORDER BY timestamp DESC, id DESC LIMIT ?",
+                    (user, before[0], before[1], limit + 1),
+                ).fetchall()
+
+        generations = [_row_to_generation(row) for row in rows[:limit]]
+        cursor = None
+        if len(rows) > limit:
+            last = generations[-1]
+            cursor = (last["timestamp"], last["id"])
+        return generations, cursor
+
+    def recent(self, user: str, limit: int = HISTORY_SEARCH_LIMIT) -> List[Dict[str, Any]]:
+        """As `limit` gerações mais recentes, em ordem cronológica"""
+
+        self.flush(user)
+        with self._reader() as conn:
+            rows = conn.execute(
+                "SELECT * FROM generations WHERE user = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (user, limit),
+            ).fetchall()
+        return [_row_to_generation(row) for row in reversed(rows)]
+
+    def recent_cursor(self, user: str, limit: int) -> Optional[Cursor]:
+        """Cursor da geração anterior às `limit` mais recentes (None se não há)"""
+
+        self.flush(user)
+        with self._reader() as conn:
+            row = conn.execute(
+                "SELECT timestamp, id FROM generations WHERE user = ?"
+                " ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?",
+                (user, limit),
+            ).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def generations_by_id(self, user: str, ids: List[int]) -> List[Dict[str, Any]]:
+        """Gerações do usuário com os ids pedidos, na mesma ordem (ids ausentes são ignorados)"""
+
+        found: Dict[int, Dict[str, Any]] = {}
+        with self._reader() as conn:
+            # Em blocos, abaixo do limite de parâmetros do SQLite
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT * FROM generations WHERE user = ? AND id IN ({','.join('?' * len(chunk))})",
+                    (user, *chunk),
+                ).fetchall()
+                for row in rows:
+                    found[row["id"]] = _row_to_generation(row)
+        return [found[generation_id] for generation_id in ids if generation_id in found]
+
+    def has_generation(self, user: str, timestamp: float, prompt: str) -> bool:
+        """Indica se a geração já está no histórico (evita duplicar em importações)"""
+        with self._reader() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM generations WHERE user = ? AND timestamp = ? AND prompt = ? LIMIT 1",
+                (user, timestamp, prompt),
+            ).fetchone()
+        return row is not None
+
+    def iter_generations(
+        self,
+        user: str,
+        batch_size: int = 500,
+        after: Optional[Cursor] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Gerações do usuário em ordem cronológica, lidas em páginas
+
+        Cada página é uma consulta por cursor, e a conexão é devolvida entre
+        páginas; só uma página fica em memória por vez.
+
+        Args:
+            user: Dono do histórico
+            batch_size: Gerações por página
+            after: Só as gerações depois desse cursor (None = todas)
+        """
+
+        self.flush(user)
+        after = after or (float("-inf"), 0)
+        while True:
+            with self._reader() as conn:
+                rows = conn.execute(
+                    "SELECT * FROM generations WHERE user = ? AND (timestamp, id) > (?, ?)"
+                    " ORDER BY timestamp, id LIMIT ?",
+                    (user, after[0], after[1], batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield _row_to_generation(row)
+            after = (rows[-1]["timestamp"], rows[-1]["id"])
+
+    def saved_prompts(self, user: str) -> List[str]:
+        self.flush(user)
+        with self._reader() as conn:
+            rows = conn.execute(
+                "SELECT prompt FROM saved_prompts WHERE user = ? ORDER BY id", (user,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_image_refs(self) -> Iterator[str]:
+        """Referências de todas as imagens do histórico (para proteger da limpeza)"""
+        conn = self._connect()
+        try:
+            for (images,) in conn.execute("SELECT images FROM generations"):
+                yield from json.loads(images)
+        finally:
+            conn.close()
+
+
+_history_store: Optional[HistoryStore] = None
+_history_store_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    """Retorna o histórico persistente compartilhado pelo processo"""
+
+    global _history_store
+    if _history_store is None:
+        with _history_store_lock:
+            if _history_store is None:
+                _history_store = HistoryStore()
+                atexit.register(_history_store.flush)
+                # Imagens do histórico persistido não são órfãs
+                get_blob_store().add_ref_source(_history_store.iter_image_refs)
+    return _history_store
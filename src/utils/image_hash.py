@@ -0,0 +1,439 @@
+"""
+Hashes perceptuais das imagens geradas e busca de imagens parecidas
+
+Cada imagem recebe dois hashes de 64 bits calculados com NumPy: o dHash
+(gradiente horizontal de uma miniatura 9x8) e o pHash (sinal dos
+coeficientes de baixa frequência da DCT de uma miniatura 32x32). Imagens
+quase iguais têm hashes a poucos bits de distância (Hamming).
+
+O índice é uma tabela multi-índice: o pHash é dividido em 4 blocos de 16
+bits e cada bloco tem um vetor NumPy ordenado. Duas imagens a distância
+≤ d têm, pelo princípio da casa dos pombos, algum bloco a distância
+≤ d // 4; a busca consulta só os valores vizinhos do bloco (um
+`searchsorted` para todos de uma vez) e confirma a distância exata dos
+candidatos, sem percorrer o índice inteiro. Os hashes são calculados uma
+única vez por imagem (pelo conteúdo), no pool de processos, e gravados em
+um arquivo binário só de acréscimos.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from utils.metrics import get_metrics
+from utils.paths import get_data_dir
+from utils.process_pool import submit
+
+# Distância máxima (bits do pHash) para considerar duas imagens quase iguais
+IMAGE_DUPLICATE_DISTANCE = int(os.getenv("IMAGE_DUPLICATE_DISTANCE", "6"))
+
+# Distância máxima para "imagens semelhantes"
+IMAGE_SIMILAR_DISTANCE = int(os.getenv("IMAGE_SIMILAR_DISTANCE", "12"))
+
+# Imagens por tarefa enviada ao pool de processos
+IMAGE_HASH_BATCH = 32
+
+# Blocos de 16 bits do pHash indexados separadamente
+HASH_CHUNKS = 4
+CHUNK_BITS = 16
+
+# Inserções mantidas fora dos vetores ordenados até a próxima mesclagem
+HASH_MERGE_BATCH = 256
+
+# Registro gravado em disco: sha256 da imagem, dHash e pHash
+_RECORD = np.dtype([("digest", "V32"), ("dhash", "<u8"), ("phash", "<u8")])
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    """Número de bits 1 de cada elemento de um vetor uint64"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _chunk_masks(max_distance: int) -> np.ndarray:
+    """Todas as máscaras de 16 bits com no máximo `max_distance` bits ligados"""
+    masks = [0]
+    for distance in range(1, max_distance + 1):
+        for bits in combinations(range(CHUNK_BITS), distance):
+            masks.append(sum(1 << bit for bit in bits))
+    return np.array(masks, dtype=np.uint16)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Matriz da DCT-II ortonormal de tamanho n"""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(32)
+
+
+def _pack_bits(bits: np.ndarray) -> np.ndarray:
+    """Linhas de 64 booleanos -> inteiros de 64 bits (primeiro bit = mais significativo)"""
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def compute_hashes(images: Sequence[Union[bytes, str]]) -> List[Optional[Tuple[int, int]]]:
+    """
+    Calcula (dHash, pHash) de várias imagens (executado nos processos de trabalho)
+
+    As miniaturas em tons de cinza são empilhadas e os dois hashes são
+    calculados para o lote inteiro de uma vez.
+
+    Args:
+        images: Bytes ou caminhos das imagens
+
+    Returns:
+        Um par de inteiros por imagem, ou None se ela não puder ser lida
+    """
+
+    import io
+
+    from PIL import Image
+
+    small = np.zeros((len(images), 8, 9), dtype=np.float32)
+    large = np.zeros((len(images), 32, 32), dtype=np.float64)
+    readable = np.zeros(len(images), dtype=bool)
+
+    for i, image in enumerate(images):
+        source = image if isinstance(image, str) else io.BytesIO(image)
+        try:
+            with Image.open(source) as img:
+                gray = img.convert("L")
+                small[i] = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.float32)
+                large[i] = np.asarray(gray.resize((32, 32), Image.LANCZOS), dtype=np.float64)
+            readable[i] = True
+        except (OSError, ValueError):
+            continue
+
+    # dHash: cada pixel é mais claro que o vizinho da esquerda?
+    dhashes = _pack_bits((small[:, :, 1:] > small[:, :, :-1]).reshape(len(images), 64))
+
+    # pHash: DCT 2D do lote (D · X · Dᵀ) e os 8x8 coeficientes de baixa
+    # frequência comparados com a mediana (sem o termo constante)
+    low = (_DCT @ large @ _DCT.T)[:, :8, :8].reshape(len(images), 64)
+    medians = np.median(low[:, 1:], axis=1, keepdims=True)
+    phashes = _pack_bits(low > medians)
+
+    return [
+        (int(dhash), int(phash)) if ok else None
+        for dhash, phash, ok in zip(dhashes.tolist(), phashes.tolist(), readable.tolist())
+    ]
+
+
+def _digest(ref: str) -> bytes:
+    return bytes.fromhex(ref)
+
+
+def _prefix(digest: bytes) -> int:
+    return int.from_bytes(digest[:8], "little")
+
+
+def _digest_matrix(records: np.ndarray) -> np.ndarray:
+    """Digests dos registros como matriz (n, 32) de bytes"""
+    return np.frombuffer(records["digest"].tobytes(), dtype=np.uint8).reshape(-1, 32)
+
+
+class _SortedColumn:
+    """Vetor ordenado de (valor, slot) que cresce por mesclagens em lote"""
+
+    def __init__(self, dtype):
+        self.values = np.zeros(0, dtype=dtype)
+        self.slots = np.zeros(0, dtype=np.int64)
+
+    def merge(self, values: np.ndarray, slots: np.ndarray):
+        order = np.argsort(values, kind="stable")
+        values, slots = values[order], slots[order]
+        positions = np.searchsorted(self.values, values)
+        self.values = np.insert(self.values, positions, values)
+        self.slots = np.insert(self.slots, positions, slots)
+
+    def lookup(self, probes: np.ndarray) -> np.ndarray:
+        """Slots de todas as entradas cujo valor está em `probes`"""
+
+        lo = np.searchsorted(self.values, probes, side="left")
+        hi = np.searchsorted(self.values, probes, side="right")
+        lengths = hi - lo
+        total = int(lengths.sum())
+        if not total:
+            return np.zeros(0, dtype=np.int64)
+        # Concatena os intervalos [lo, hi) sem laço em Python
+        starts = np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)
+        return self.slots[starts + np.arange(total)]
+
+
+class ImageHashIndex:
+    """
+    Índice dos hashes perceptuais por referência de imagem
+
+    Os registros ficam em um vetor NumPy (um slot por imagem); os blocos do
+    pHash e o prefixo do sha256 têm vetores ordenados próprios. Os slots
+    mais recentes ficam fora deles até a próxima mesclagem e são conferidos
+    diretamente.
+
+    Args:
+        path: Arquivo binário dos hashes
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else get_data_dir("image_hashes") / "hashes.bin"
+        self._lock = threading.Lock()
+        self._records = np.zeros(0, dtype=_RECORD)
+        self._count = 0
+        self._merged = 0
+        self._chunks = [_SortedColumn(np.uint16) for _ in range(HASH_CHUNKS)]
+        self._refs = _SortedColumn(np.uint64)
+        self._pending_refs: Dict[bytes, int] = {}
+        self._masks: Dict[int, np.ndarray] = {}
+        self._load()
+
+    def _load(self):
+        if not self.path.is_file():
+            return
+        data = self.path.read_bytes()
+        # Descarta um registro incompleto no fim (gravação interrompida)
+        usable = len(data) - len(data) % _RECORD.itemsize
+        records = np.frombuffer(data[:usable], dtype=_RECORD)
+        # Mantém só a primeira ocorrência de cada imagem (pelo prefixo do sha256)
+        _, first = np.unique(_digest_matrix(records)[:, :8].copy().view("<u8").ravel(), return_index=True)
+        self._records = records[np.sort(first)].copy()
+        self._count = len(self._records)
+        self._merge()
+
+    def _grow(self):
+        grown = np.zeros(max(1024, 2 * len(self._records)), dtype=_RECORD)
+        grown[:self._count] = self._records[:self._count]
+        self._records = grown
+
+    def _merge(self):
+        """Mescla os slots pendentes aos vetores ordenados (chamar com o lock ou na carga)"""
+
+        if self._merged == self._count:
+            return
+        slots = np.arange(self._merged, self._count, dtype=np.int64)
+        records = self._records[self._merged:self._count]
+        phashes = records["phash"]
+        for i, column in enumerate(self._chunks):
+            column.merge(((phashes >> np.uint64(i * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.uint16), slots)
+        self._refs.merge(_digest_matrix(records)[:, :8].copy().view("<u8").ravel(), slots)
+        self._pending_refs.clear()
+        self._merged = self._count
+
+    def _slot(self, digest: bytes) -> Optional[int]:
+        """Slot da imagem, ou None (chamar com o lock)"""
+
+        slot = self._pending_refs.get(digest)
+        if slot is not None:
+            return slot
+        for slot in self._refs.lookup(np.array([_prefix(digest)], dtype=np.uint64)).tolist():
+            if self._records[slot]["digest"].tobytes() == digest:
+                return slot
+        return None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def contains(self, ref: str) -> bool:
+        with self._lock:
+            return self._slot(_digest(ref)) is not None
+
+    def hashes(self, ref: str) -> Optional[Tuple[int, int]]:
+        """(dHash, pHash) da imagem, se já calculados"""
+        with self._lock:
+            slot = self._slot(_digest(ref))
+            if slot is None:
+                return None
+            record = self._records[slot]
+            return int(record["dhash"]), int(record["phash"])
+
+    def add(self, ref: str, dhash: int, phash: int):
+        """Registra os hashes de uma imagem (ignora imagens já registradas)"""
+        self.add_many([(ref, dhash, phash)])
+
+    def add_many(self, entries: Iterable[Tuple[str, int, int]]):
+        """Registra (referência, dHash, pHash) de várias imagens de uma vez"""
+
+        with self._lock:
+            first = self._count
+            for ref, dhash, phash in entries:
+                digest = _digest(ref)
+                if self._slot(digest) is not None:
+                    continue
+                if self._count >= len(self._records):
+                    self._grow()
+                record = self._records[self._count]
+                record["digest"] = digest
+                record["dhash"] = dhash
+                record["phash"] = phash
+                self._pending_refs[digest] = self._count
+                self._count += 1
+            if self._count == first:
+                return
+            with open(self.path, "ab") as f:
+                f.write(self._records[first:self._count].tobytes())
+            if self._count - self._merged >= HASH_MERGE_BATCH:
+                self._merge()
+
+    def _chunk_masks(self, distance: int) -> np.ndarray:
+        masks = self._masks.get(distance)
+        if masks is None:
+            masks = self._masks[distance] = _chunk_masks(distance)
+        return masks
+
+    def search(self, phash: int, max_distance: int) -> List[Tuple[str, int]]:
+        """
+        Imagens cujo pHash está a no máximo `max_distance` bits
+
+        Returns:
+            Lista de (referência, distância), da mais próxima para a mais distante
+        """
+
+        started = time.perf_counter()
+        masks = self._chunk_masks(max_distance // HASH_CHUNKS)
+        query = np.uint64(phash)
+
+        with self._lock:
+            candidates = [np.arange(self._merged, self._count, dtype=np.int64)]
+            for i, column in enumerate(self._chunks):
+                chunk = np.uint16((phash >> (i * CHUNK_BITS)) & 0xFFFF)
+                candidates.append(column.lookup(np.sort(masks ^ chunk)))
+            slots = np.concatenate(candidates)
+            distances = _popcount(self._records["phash"][slots] ^ query)
+            # Um slot pode vir de mais de um bloco: deduplica só os aprovados
+            slots, first = np.unique(slots[distances <= max_distance], return_index=True)
+            distances = distances[distances <= max_distance][first]
+            digests = self._records["digest"][slots]
+
+        order = np.argsort(distances, kind="stable")
+        matches = [(digests[i].tobytes().hex(), int(distances[i])) for i in order.tolist()]
+        get_metrics().observe("image_similarity_lookup_seconds", time.perf_counter() - started)
+        return matches
+
+    def clear(self):
+        """Remove todos os hashes"""
+        with self._lock:
+            self._records = np.zeros(0, dtype=_RECORD)
+            self._count = self._merged = 0
+            self._chunks = [_SortedColumn(np.uint16) for _ in range(HASH_CHUNKS)]
+            self._refs = _SortedColumn(np.uint64)
+            self._pending_refs.clear()
+            self.path.unlink(missing_ok=True)
+
+
+_index: Optional[ImageHashIndex] = None
+_index_lock = threading.Lock()
+
+# Referência -> (tarefa, lote de referências da tarefa)
+_pending: Dict[str, Tuple[Future, List[str]]] = {}
+# Imagens cujos hashes não puderam ser calculados (não são reagendadas)
+_failed: Set[str] = set()
+_pending_lock = threading.Lock()
+
+
+def get_image_hash_index() -> ImageHashIndex:
+    """Retorna o índice de hashes compartilhado pelo processo"""
+
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ImageHashIndex()
+    return _index
+
+
+def _on_done(refs: List[str], future: Future):
+    """Registra os hashes quando o processo de trabalho termina"""
+
+    if future.cancelled() or future.exception() is not None:
+        results = [None] * len(refs)
+    else:
+        results = future.result()
+    # Grava no índice antes de tirar das pendentes: quem vê a imagem fora
+    # das pendentes já encontra os hashes
+    get_image_hash_index().add_many(
+        (ref, *hashes) for ref, hashes in zip(refs, results) if hashes is not None
+    )
+    with _pending_lock:
+        for ref, hashes in zip(refs, results):
+            _pending.pop(ref, None)
+            if hashes is None:
+                _failed.add(ref)
+
+
+def schedule_hashes(refs: Iterable[str]):
+    """
+    Agenda o cálculo dos hashes das imagens que ainda não os têm
+
+    As imagens são lidas do armazenamento pelos processos de trabalho, em
+    lotes de `IMAGE_HASH_BATCH`.
+    """
+
+    from utils.blob_store import get_blob_store
+
+    index = get_image_hash_index()
+    store = get_blob_store()
+
+    with _pending_lock:
+        missing = []
+        for ref in dict.fromkeys(refs):
+            if ref not in _pending and ref not in _failed and not index.contains(ref) and store.exists(ref):
+                missing.append(ref)
+
+        for start in range(0, len(missing), IMAGE_HASH_BATCH):
+            batch = missing[start:start + IMAGE_HASH_BATCH]
+            future = submit(compute_hashes, [str(store.path(ref)) for ref in batch])
+            for ref in batch:
+                _pending[ref] = (future, batch)
+            future.add_done_callback(lambda f, batch=batch: _on_done(batch, f))
+
+
+def get_hashes(ref: str) -> Optional[Tuple[int, int]]:
+    """
+    (dHash, pHash) da imagem, sem esperar
+
+    Se os hashes ainda não existem, agenda o cálculo e devolve None; use
+    `hashes_pending` para saber se vale consultar de novo mais tarde.
+    """
+
+    index = get_image_hash_index()
+    hashes = index.hashes(ref)
+    if hashes is None:
+        schedule_hashes([ref])
+        # O cálculo pode ter terminado durante o agendamento
+        hashes = index.hashes(ref)
+    return hashes
+
+
+def hashes_pending(ref: str) -> bool:
+    """Se os hashes da imagem ainda estão sendo calculados"""
+    with _pending_lock:
+        return ref in _pending
+
+
+def find_similar_images(ref: str, max_distance: int = IMAGE_SIMILAR_DISTANCE) -> List[Tuple[str, int]]:
+    """
+    Imagens parecidas com a imagem dada (incluindo ela mesma, a distância 0)
+
+    Não espera pelo cálculo dos hashes (ver `get_hashes`).
+
+    Returns:
+        Lista de (referência, distância), da mais próxima para a mais
+        distante; vazia enquanto os hashes da imagem não existem
+    """
+
+    hashes = get_hashes(ref)
+    if hashes is None:
+        return []
+    return get_image_hash_index().search(hashes[1], max_distance)
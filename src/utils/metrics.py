@@ -0,0 +1,297 @@
+"""
+Métricas de latência por etapa, no formato de exposição do Prometheus
+
+Cada etapa da geração (fila do limite de taxa, envio ao provedor, polling,
+download, decodificação, cache) e cada rerun da interface é cronometrado em
+um histograma com rótulos (provedor, modelo, etapa). As métricas podem ser
+lidas em um endpoint HTTP local (`METRICS_PORT`), gravadas periodicamente em
+um arquivo texto para o node_exporter (`METRICS_TEXTFILE`) ou vistas no
+painel de administração da aplicação.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Limites dos buckets dos histogramas, em segundos
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Amostras recentes guardadas por série para calcular p50/p95/p99
+METRICS_RESERVOIR_SIZE = int(os.getenv("METRICS_RESERVOIR_SIZE", "2048"))
+
+# Endpoint HTTP local (0 = desligado) e arquivo texto (vazio = desligado)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "")
+METRICS_TEXTFILE_INTERVAL = float(os.getenv("METRICS_TEXTFILE_INTERVAL", "15"))
+
+METRIC_PREFIX = "portrait_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Coletor: devolve (nome, rótulos, valor) de gauges lidos na hora da exposição
+GaugeCollector = Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]
+
+
+class Histogram:
+    """Histograma cumulativo com um reservatório de amostras recentes"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=METRICS_RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """Registro de histogramas, contadores e gauges do processo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[GaugeCollector] = []
+
+    def describe(self, name: str, help_text: str):
+        """Define o texto de ajuda (# HELP) de uma métrica"""
+        self._help[name] = help_text
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        """Registra uma duração no histograma `name`"""
+
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        """Incrementa o contador `name`"""
+
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Cronometra o bloco e registra a duração mesmo se houver exceção"""
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register_collector(self, collector: GaugeCollector):
+        """Adiciona um coletor de gauges lido a cada exposição"""
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def summary(self) -> List[Dict[str, object]]:
+        """
+        Resumo de cada série de histograma para o painel de administração
+
+        Returns:
+            Lista de dicts com métrica, rótulos, contagem, média e p50/p95/p99
+        """
+
+        with self._lock:
+            rows = []
+            for name, series in sorted(self._histograms.items()):
+                for labels, histogram in sorted(series.items()):
+                    rows.append({
+                        "metric": name,
+                        **dict(labels),
+                        "count": histogram.count,
+                        "mean": histogram.sum / histogram.count if histogram.count else None,
+                        "p50": histogram.percentile(0.50),
+                        "p95": histogram.percentile(0.95),
+                        "p99": histogram.percentile(0.99),
+                    })
+            return rows
+
+    def render_prometheus(self) -> str:
+        """Exposição de todas as métricas no formato texto do Prometheus"""
+
+        lines = []
+        with self._lock:
+            collectors = list(self._collectors)
+
+            for name, series in sorted(self._histograms.items()):
+                full_name = METRIC_PREFIX + name
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        bucket_labels = _format_labels(labels + (("le", repr(float(bound))),))
+                        lines.append(f"{full_name}_bucket{bucket_labels} {count}")
+                    inf_labels = _format_labels(labels + (("le", "+Inf"),))
+                    lines.append(f"{full_name}_bucket{inf_labels} {histogram.count}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+
+            for name, series in sorted(self._counters.items()):
+                full_name = METRIC_PREFIX + name
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{full_name}{_format_labels(labels)} {value}")
+
+        gauges: Dict[str, List[str]] = {}
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception:
+                continue
+            for name, labels, value in samples:
+                label_text = _format_labels(sorted((k, str(v)) for k, v in labels.items()))
+                gauges.setdefault(name, []).append(f"{METRIC_PREFIX}{name}{label_text} {value}")
+        for name, samples in sorted(gauges.items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+            lines.extend(samples)
+
+        return "\n".join(lines) + "\n"
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Retorna o registro de métricas compartilhado pelo processo"""
+
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry()
+                _registry.describe("stage_seconds", "Duração de cada etapa da geração por provedor e modelo")
+                _registry.describe("generation_seconds", "Duração total de generate_image por resultado")
+                _registry.describe("rate_limit_wait_seconds", "Espera por um token do limite de taxa")
+                _registry.describe("render_seconds", "Duração dos reruns de cada parte da interface")
+                _registry.describe("coalesced_requests_total", "Requisições atendidas por uma chamada idêntica já em andamento")
+    return _registry
+
+
+def stage_timer(stage: str, provider: str, model: str):
+    """Cronometra uma etapa da geração no histograma `stage_seconds`"""
+    return get_metrics().timer("stage_seconds", provider=provider, model=model, stage=stage)
+
+
+def write_textfile(path: str = METRICS_TEXTFILE):
+    """Grava a exposição em um arquivo (escrita atômica, para o node_exporter)"""
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(get_metrics().render_prometheus())
+    os.replace(tmp_path, path)
+
+
+def _serve_http(host: str, port: int):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = get_metrics().render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def _write_textfile_forever(path: str, interval: float):
+    while True:
+        try:
+            write_textfile(path)
+        except OSError:
+            pass
+        time.sleep(interval)
+
+
+_export_started = False
+_export_lock = threading.Lock()
+
+
+def start_metrics_export(
+    port: int = METRICS_PORT,
+    textfile: str = METRICS_TEXTFILE,
+    host: str = METRICS_HOST,
+) -> Dict[str, object]:
+    """
+    Liga a exposição das métricas (uma vez por processo)
+
+    Args:
+        port: Porta do endpoint `/metrics` (0 = desligado)
+        textfile: Arquivo texto atualizado periodicamente (vazio = desligado)
+        host: Interface do endpoint (padrão: só local)
+
+    Returns:
+        Dict com o que foi ligado
+    """
+
+    global _export_started
+    with _export_lock:
+        if _export_started:
+            return {}
+        _export_started = True
+
+    started: Dict[str, object] = {}
+    if port:
+        server = _serve_http(host, port)
+        started["http"] = f"http://{host}:{server.server_port}/metrics"
+    if textfile:
+        threading.Thread(
+            target=_write_textfile_forever,
+            args=(textfile, METRICS_TEXTFILE_INTERVAL),
+            name="metrics-textfile",
+            daemon=True,
+        ).start()
+        started["textfile"] = textfile
+    return started
@@ -0,0 +1,25 @@
+"""
+Diretórios de dados locais da aplicação (cache, imagens, banco de dados)
+"""
+
+import os
+from pathlib import Path
+
+# Raiz dos dados locais (pode ser sobrescrita por variável de ambiente)
+DATA_DIR = Path(os.getenv("APP_DATA_DIR", ".data"))
+
+
+def get_data_dir(name: str) -> Path:
+    """
+    Retorna (criando se necessário) um subdiretório de dados
+
+    Args:
+        name: Nome do subdiretório
+
+    Returns:
+        Caminho do diretório
+    """
+
+    path = DATA_DIR / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,56 @@
+"""
+Pool de processos compartilhado para trabalho de CPU com imagens (Pillow)
+
+Codificar e redimensionar imagens segura o GIL; rodar isso em processos
+separados evita travar a thread do script do Streamlit.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+# Número de processos de trabalho (padrão: metade dos núcleos, mínimo 1)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Retorna o pool de processos compartilhado, criando-o na primeira chamada"""
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # "spawn" evita herdar por fork as threads do servidor Streamlit
+                _pool = ProcessPoolExecutor(
+                    max_workers=IMAGE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+    return _pool
+
+
+def submit(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    Envia uma tarefa ao pool compartilhado
+
+    Se um processo de trabalho morreu e o pool ficou inutilizável, ele é
+    recriado e a tarefa é reenviada uma vez.
+    """
+
+    global _pool
+    pool = get_process_pool()
+    try:
+        return pool.submit(fn, *args, **kwargs)
+    except BrokenProcessPool:
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        pool.shutdown(wait=False)
+        return get_process_pool().submit(fn, *args, **kwargs)
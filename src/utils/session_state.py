@@ -3,10 +3,42 @@ Gerenciamento do estado da sessão Streamlit
 """
 
 import streamlit as st
+import re
+import secrets
+import uuid
+from utils.blob_store import get_blob_store
+from utils.history_store import get_history_store
+from utils.transcode import DOWNLOAD_FORMAT
+
+# Parâmetro da URL que identifica o dono do histórico persistido. Não há
+# login: quem tem o link vê e altera o histórico. Por isso o valor é sempre
+# gerado pelo servidor (128 bits aleatórios, impossível de adivinhar); valores
+# escolhidos à mão (ex.: "?u=ana") são trocados por um novo. O link deve ser
+# tratado como uma senha e não deve ser compartilhado.
+USER_QUERY_PARAM = "u"
+USER_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+def new_user_id() -> str:
+    """Gera um identificador de dono do histórico impossível de adivinhar"""
+    return secrets.token_hex(16)
 
 def initialize_session_state():
     """Inicializa variáveis do estado da sessão"""
     
+    # Identificador da sessão (dono das imagens no armazenamento em disco)
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    
+    get_blob_store().touch_session(st.session_state.session_id)
+    
+    # Dono do histórico persistido: fica na URL para sobreviver a recarregamentos
+    if 'user_id' not in st.session_state:
+        user_id = st.query_params.get(USER_QUERY_PARAM, "")
+        if not USER_ID_PATTERN.fullmatch(user_id):
+            user_id = new_user_id()
+            st.query_params[USER_QUERY_PARAM] = user_id
+        st.session_state.user_id = user_id
+    
     # Chaves de API
     if 'openai_key' not in st.session_state:
         st.session_state.openai_key = ""
@@ -21,6 +53,9 @@ def initialize_session_state():
     if 'selected_model' not in st.session_state:
         st.session_state.selected_model = "DALL-E 3"
     
+    if 'fanout_mode' not in st.session_state:
+        st.session_state.fanout_mode = False
+    
     if 'quality' not in st.session_state:
         st.session_state.quality = "hd"
     
@@ -44,17 +79,26 @@ def initialize_session_state():
     if 'negative_prompt' not in st.session_state:
         st.session_state.negative_prompt = ""
     
-    # Histórico
-    if 'generation_history' not in st.session_state:
-        st.session_state.generation_history = []
+    if 'bypass_cache' not in st.session_state:
+        st.session_state.bypass_cache = False
     
+    if 'download_format' not in st.session_state:
+        st.session_state.download_format = DOWNLOAD_FORMAT
+    
+    # Prompts salvos do usuário; as gerações ficam no banco e a galeria as
+    # lê em páginas (ver `utils.history_search`)
     if 'saved_prompts' not in st.session_state:
-        st.session_state.saved_prompts = []
+        st.session_state.saved_prompts = get_history_store().saved_prompts(st.session_state.user_id)
 
 def reset_session_state():
     """Reseta o estado da sessão"""
     
-    keys_to_keep = ['openai_key', 'replicate_key', 'stability_key']
+    keys_to_keep = ['openai_key', 'replicate_key', 'stability_key', 'session_id', 'user_id']
+    
+    # O histórico da sessão é recarregado do banco; as imagens persistidas
+    # continuam protegidas pelo histórico, não pela sessão
+    if 'session_id' in st.session_state:
+        get_blob_store().retain(st.session_state.session_id, [])
     
     for key in list(st.session_state.keys()):
         if key not in keys_to_keep:
@@ -62,11 +106,25 @@ def reset_session_state():
     
     initialize_session_state()
 
+def get_session_id() -> str:
+    """Retorna o identificador da sessão atual"""
+    return st.session_state.session_id
+
+def get_user_id() -> str:
+    """Retorna o identificador do dono do histórico persistido"""
+    return st.session_state.user_id
+
 def export_session_data():
-    """Exporta dados da sessão para backup"""
+    """
+    Exporta dados da sessão para backup
+    
+    As imagens do histórico são referências do armazenamento em disco
+    (ver `utils.blob_store`), não os bytes. Para um backup completo, com as
+    imagens e sem montar tudo em memória, use `utils.archive.export_archive`.
+    """
     
     export_data = {
-        'generation_history': st.session_state.get('generation_history', []),
+        'generation_history': get_history_store().recent(st.session_state.user_id),
         'saved_prompts': st.session_state.get('saved_prompts', []),
         'settings': {
             'selected_model': st.session_state.get('selected_model'),
@@ -0,0 +1,212 @@
+"""
+Miniaturas das imagens geradas para a galeria
+
+As miniaturas são criadas uma única vez por imagem, em um pool de processos,
+e guardadas em disco (e em um pequeno cache em memória). A galeria mostra as
+miniaturas e só carrega a imagem original para download ou quando o usuário
+pede para vê-la em tamanho real. Nada aqui espera a criação da miniatura: a
+galeria mostra um aviso no lugar e recarrega quando ela fica pronta.
+"""
+
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Set, Union
+
+from utils.paths import get_data_dir
+from utils.process_pool import submit
+
+# Lado máximo da miniatura em pixels
+THUMBNAIL_MAX_SIZE = int(os.getenv("THUMBNAIL_MAX_SIZE", "384"))
+
+# Formato ("WEBP" ou "JPEG") e qualidade das miniaturas
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "WEBP").upper()
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
+# Quantas miniaturas manter em memória além do disco
+THUMBNAIL_MEMORY_ITEMS = int(os.getenv("THUMBNAIL_MEMORY_ITEMS", "256"))
+
+# Intervalo (segundos) com que a interface verifica as miniaturas em criação
+THUMBNAIL_POLL_INTERVAL = 1.0
+
+_memory: "OrderedDict[str, bytes]" = OrderedDict()
+_pending: Dict[str, Future] = {}
+# Miniaturas que não puderam ser criadas (a galeria usa a imagem original)
+_failed: Set[str] = set()
+_lock = threading.Lock()
+
+
+def make_thumbnail(
+    image: Union[bytes, str],
+    max_size: int = THUMBNAIL_MAX_SIZE,
+    fmt: str = THUMBNAIL_FORMAT,
+    quality: int = THUMBNAIL_QUALITY,
+) -> bytes:
+    """
+    Gera a miniatura de uma imagem (executado nos processos de trabalho)
+
+    Args:
+        image: Bytes ou caminho do arquivo da imagem original
+        max_size: Lado máximo da miniatura em pixels
+        fmt: Formato de saída ("WEBP" ou "JPEG")
+        quality: Qualidade de compressão
+
+    Returns:
+        Bytes da miniatura
+    """
+
+    from PIL import Image
+
+    source = image if isinstance(image, str) else io.BytesIO(image)
+    with Image.open(source) as img:
+        img.thumbnail((max_size, max_size))
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = io.BytesIO()
+        img.save(output, format=fmt, quality=quality)
+        return output.getvalue()
+
+
+def _thumbnail_key(image_key: str) -> str:
+    return f"{image_key}-{THUMBNAIL_MAX_SIZE}-{THUMBNAIL_QUALITY}.{THUMBNAIL_FORMAT.lower()}"
+
+
+def image_id(image: bytes) -> str:
+    """Identificador de conteúdo da imagem (SHA-256)"""
+    return hashlib.sha256(image).hexdigest()
+
+
+def _remember(key: str, thumbnail: bytes):
+    """Guarda a miniatura no cache em memória (chamar com o lock)"""
+    _memory[key] = thumbnail
+    _memory.move_to_end(key)
+    while len(_memory) > THUMBNAIL_MEMORY_ITEMS:
+        _memory.popitem(last=False)
+
+
+def _on_done(key: str, future: Future):
+    """Persiste a miniatura quando o processo de trabalho termina"""
+
+    with _lock:
+        _pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            _failed.add(key)
+            return
+        thumbnail = future.result()
+        _remember(key, thumbnail)
+
+    path = get_data_dir("thumbnails") / key
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(thumbnail)
+    os.replace(tmp_path, path)
+
+
+def _lookup(key: str) -> Optional[bytes]:
+    """Busca a miniatura em memória ou em disco"""
+
+    with _lock:
+        thumbnail = _memory.get(key)
+        if thumbnail is not None:
+            _memory.move_to_end(key)
+            return thumbnail
+
+    path = get_data_dir("thumbnails") / key
+    if path.is_file():
+        thumbnail = path.read_bytes()
+        with _lock:
+            _remember(key, thumbnail)
+        return thumbnail
+
+    return None
+
+
+def schedule_thumbnail(image: Union[bytes, str], image_key: Optional[str] = None) -> str:
+    """
+    Agenda a criação da miniatura em segundo plano, se ainda não existir
+
+    Passar o caminho do arquivo evita copiar a imagem para o processo de
+    trabalho; nesse caso `image_key` é obrigatório.
+
+    Args:
+        image: Bytes ou caminho do arquivo da imagem original
+        image_key: Identificador da imagem (padrão: hash do conteúdo)
+
+    Returns:
+        Identificador da imagem
+    """
+
+    image_key = image_key or image_id(image)
+    key = _thumbnail_key(image_key)
+
+    if _lookup(key) is not None:
+        return image_key
+
+    with _lock:
+        if key in _pending:
+            return image_key
+        future = submit(make_thumbnail, image)
+        _pending[key] = future
+
+    # Fora do lock: o callback roda na hora se o futuro já tiver terminado
+    future.add_done_callback(lambda f: _on_done(key, f))
+    return image_key
+
+
+def get_thumbnail(
+    image: Union[bytes, str],
+    image_key: Optional[str] = None,
+) -> Optional[Union[bytes, str]]:
+    """
+    Retorna a miniatura da imagem, agendando sua criação se necessário
+
+    Não espera a criação (é chamada na thread do script do Streamlit).
+
+    Returns:
+        Bytes da miniatura; None enquanto ela está sendo criada; a própria
+        imagem original (bytes ou caminho) se a criação falhou
+    """
+
+    image_key = image_key or image_id(image)
+    key = _thumbnail_key(image_key)
+
+    thumbnail = _lookup(key)
+    if thumbnail is not None:
+        return thumbnail
+
+    with _lock:
+        if key in _failed:
+            return image
+
+    schedule_thumbnail(image, image_key)
+    # O futuro pode ter terminado durante o agendamento
+    return _lookup(key)
+
+
+def thumbnail_pending(image_key: str) -> bool:
+    """Se a miniatura da imagem ainda está sendo criada"""
+    with _lock:
+        return _thumbnail_key(image_key) in _pending
+
+
+def delete_thumbnails(image_key: str) -> int:
+    """
+    Apaga as miniaturas da imagem, em memória e em disco (de qualquer tamanho)
+
+    Returns:
+        Número de arquivos removidos
+    """
+
+    prefix = f"{image_key}-"
+    with _lock:
+        for key in [key for key in _memory if key.startswith(prefix)]:
+            del _memory[key]
+        _failed.difference_update([key for key in _failed if key.startswith(prefix)])
+
+    removed = 0
+    for path in get_data_dir("thumbnails").glob(f"{prefix}*"):
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
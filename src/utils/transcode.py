@@ -0,0 +1,234 @@
+"""
+Transcodificação das imagens geradas para formatos mais leves
+
+Cada imagem salva é recodificada em segundo plano, no pool de processos, para
+os formatos configurados (WebP, AVIF, JPEG). Os downloads usam a versão no
+formato escolhido quando ela já está pronta e, senão, a original, sempre com
+o tipo MIME real do conteúdo. Vazão de codificação e taxa de compressão são
+acumuladas por formato.
+"""
+
+import io
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple, Union
+
+from utils.paths import get_data_dir
+from utils.process_pool import submit
+
+# Formatos gerados para cada imagem (separados por vírgula; vazio desativa)
+TRANSCODE_FORMATS = [
+    fmt.strip().upper()
+    for fmt in os.getenv("TRANSCODE_FORMATS", "WEBP,JPEG").split(",")
+    if fmt.strip()
+]
+
+# Qualidade padrão e por formato (TRANSCODE_QUALITY_WEBP, _AVIF, _JPEG)
+TRANSCODE_QUALITY = int(os.getenv("TRANSCODE_QUALITY", "85"))
+
+# Formato oferecido nos downloads ("ORIGINAL" para os bytes do provedor)
+DOWNLOAD_FORMAT = os.getenv("DOWNLOAD_FORMAT", "WEBP").upper()
+
+FORMAT_MIME = {
+    "PNG": ("image/png", "png"),
+    "JPEG": ("image/jpeg", "jpg"),
+    "WEBP": ("image/webp", "webp"),
+    "AVIF": ("image/avif", "avif"),
+    "GIF": ("image/gif", "gif"),
+}
+
+_pending: Dict[str, Future] = {}
+_stats: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+
+def transcode_quality(fmt: str) -> int:
+    """Qualidade configurada para o formato"""
+    return int(os.getenv(f"TRANSCODE_QUALITY_{fmt}", str(TRANSCODE_QUALITY)))
+
+
+def detect_format(data: Union[bytes, memoryview]) -> str:
+    """
+    Identifica o formato da imagem pelos primeiros bytes (sem usar o Pillow)
+
+    Returns:
+        "PNG", "JPEG", "WEBP", "AVIF", "GIF" ou "PNG" se desconhecido
+    """
+
+    head = bytes(data[:16])
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis"):
+        return "AVIF"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "GIF"
+    return "PNG"
+
+
+def mime_for(fmt: str) -> Tuple[str, str]:
+    """Tipo MIME e extensão de arquivo de um formato"""
+    return FORMAT_MIME.get(fmt, FORMAT_MIME["PNG"])
+
+
+def transcode_image(path: str, fmt: str, quality: int) -> Tuple[bytes, float]:
+    """
+    Recodifica a imagem em outro formato (executado nos processos de trabalho)
+
+    Args:
+        path: Caminho da imagem original
+        fmt: Formato de saída ("WEBP", "AVIF" ou "JPEG")
+        quality: Qualidade de compressão
+
+    Returns:
+        Bytes codificados e o tempo de codificação em segundos
+    """
+
+    from PIL import Image
+
+    started = time.perf_counter()
+    with Image.open(path) as img:
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = io.BytesIO()
+        img.save(output, format=fmt, quality=quality)
+    return output.getvalue(), time.perf_counter() - started
+
+
+def _variant_path(ref: str, fmt: str):
+    _, ext = mime_for(fmt)
+    return get_data_dir("transcoded") / f"{ref}-{transcode_quality(fmt)}.{ext}"
+
+
+def _record(fmt: str, input_bytes: int, output_bytes: int, seconds: float):
+    """Acumula as estatísticas do formato (chamar com o lock)"""
+
+    stats = _stats.setdefault(fmt, {"images": 0, "input_bytes": 0, "output_bytes": 0, "encode_seconds": 0.0})
+    stats["images"] += 1
+    stats["input_bytes"] += input_bytes
+    stats["output_bytes"] += output_bytes
+    stats["encode_seconds"] += seconds
+
+
+def _on_done(ref: str, fmt: str, input_bytes: int, future: Future):
+    """Grava a versão transcodificada quando o processo de trabalho termina"""
+
+    key = f"{ref}:{fmt}"
+    with _lock:
+        _pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        data, seconds = future.result()
+        _record(fmt, input_bytes, len(data), seconds)
+
+    path = _variant_path(ref, fmt)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def schedule_transcode(path: str, ref: str, formats: Optional[List[str]] = None):
+    """
+    Agenda a transcodificação da imagem para os formatos configurados
+
+    Args:
+        path: Caminho da imagem original (evita copiar os bytes ao processo)
+        ref: Referência da imagem no armazenamento
+        formats: Formatos a gerar (padrão: `TRANSCODE_FORMATS`)
+    """
+
+    source_format = None
+    for fmt in formats if formats is not None else TRANSCODE_FORMATS:
+        if _variant_path(ref, fmt).is_file():
+            continue
+
+        if source_format is None:
+            with open(path, "rb") as f:
+                source_format = detect_format(f.read(16))
+        if fmt == source_format:
+            continue
+
+        key = f"{ref}:{fmt}"
+        with _lock:
+            if key in _pending:
+                continue
+            future = submit(transcode_image, path, fmt, transcode_quality(fmt))
+            _pending[key] = future
+
+        input_bytes = os.path.getsize(path)
+        future.add_done_callback(lambda f, fmt=fmt: _on_done(ref, fmt, input_bytes, f))
+
+
+def get_download(
+    ref: str,
+    original_path: str,
+    fmt: str = DOWNLOAD_FORMAT,
+) -> Tuple[bytes, str, str]:
+    """
+    Bytes, tipo MIME e extensão para o download de uma imagem
+
+    Usa a versão no formato pedido se ela já estiver pronta e for menor que
+    a original; senão (inclusive enquanto a conversão está em andamento), a
+    original com o tipo MIME real. Nunca espera a conversão: é chamada na
+    thread do script do Streamlit.
+    """
+
+    if fmt != "ORIGINAL":
+        mime, ext = mime_for(fmt)
+        original_size = os.path.getsize(original_path)
+
+        try:
+            data = _variant_path(ref, fmt).read_bytes()
+        except OSError:
+            # Ainda não convertida (ou removida junto com a imagem)
+            data = None
+
+        # Uma conversão maior que a original não compensa
+        if data is not None and len(data) < original_size:
+            return data, mime, ext
+
+    with open(original_path, "rb") as f:
+        data = f.read()
+    mime, ext = mime_for(detect_format(data))
+    return data, mime, ext
+
+
+def delete_variants(ref: str) -> int:
+    """
+    Apaga as versões transcodificadas da imagem (de qualquer formato e qualidade)
+
+    Returns:
+        Número de arquivos removidos
+    """
+
+    removed = 0
+    for path in get_data_dir("transcoded").glob(f"{ref}-*"):
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
+
+
+def transcode_stats() -> Dict[str, object]:
+    """
+    Estatísticas de transcodificação
+
+    Returns:
+        Dict com `pending` (tarefas em andamento) e `formats`: por formato,
+        imagens, bytes de entrada e saída, taxa de compressão (entrada/saída)
+        e vazão de codificação por processo (imagens/s e MB/s de entrada)
+    """
+
+    with _lock:
+        formats = {fmt: dict(values) for fmt, values in _stats.items()}
+        pending = len(_pending)
+
+    for values in formats.values():
+        seconds = values["encode_seconds"] or 1e-9
+        values["compression_ratio"] = round(values["input_bytes"] / max(1, values["output_bytes"]), 2)
+        values["images_per_second"] = round(values["images"] / seconds, 2)
+        values["input_mb_per_second"] = round(values["input_bytes"] / seconds / (1024 * 1024), 2)
+
+    return {"pending": pending, "formats": formats}
@@ -0,0 +1,44 @@
+"""
+Servidores falsos dos provedores para os testes
+
+As configurações dos geradores (URLs dos provedores, limites) são lidas na
+importação, então os servidores sobem e o ambiente é montado aqui, antes de
+qualquer teste importar `generators`.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.stub_servers import StubConfig, start_stub_servers, stub_environment
+
+SERVERS = start_stub_servers({
+    provider: StubConfig(latency=0.05, payload_bytes=4096, download_latency=0.01, poll_steps=1)
+    for provider in ("openai", "stability", "replicate")
+})
+
+os.environ.update(stub_environment(SERVERS))
+os.environ.update({
+    "APP_DATA_DIR": tempfile.mkdtemp(prefix="portrait-tests-"),
+    "REPLICATE_POLL_INTERVAL": "0.01",
+    "RETRY_BASE_DELAY": "0.01",
+})
+for name in ("OPENAI", "STABILITY", "REPLICATE"):
+    os.environ[f"RATE_LIMIT_{name}_RPM"] = "1000000"
+    os.environ[f"RATE_LIMIT_{name}_BURST"] = "100000"
+
+
+@pytest.fixture
+def stubs():
+    """Servidores falsos, com a configuração restaurada ao fim do teste"""
+
+    configs = {provider: server.config for provider, server in SERVERS.items()}
+    yield SERVERS
+    for provider, server in SERVERS.items():
+        server.config = configs[provider]
+
+
+def pytest_unconfigure(config):
+    for server in SERVERS.values():
+        server.stop()
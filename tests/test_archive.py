@@ -0,0 +1,84 @@
+"""
+Testes da exportação e importação do histórico em arquivo
+"""
+
+import io
+import json
+import os
+import time
+import uuid
+import zipfile
+
+from utils import archive
+from utils.archive import import_archive, new_export_path
+from utils.blob_store import get_blob_store
+from utils.history_store import get_history_store
+
+
+def make_archive(generations, images, prompts=()):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as f:
+        for ref, data in images.items():
+            f.writestr(archive.IMAGES_DIR + ref, data)
+        f.writestr(archive.HISTORY_MEMBER, "".join(json.dumps(g) + "\n" for g in generations))
+        f.writestr(archive.PROMPTS_MEMBER, "".join(json.dumps({"prompt": p}) + "\n" for p in prompts))
+    buffer.seek(0)
+    return buffer
+
+
+def test_import_skips_generations_repeated_inside_the_archive():
+    user = uuid.uuid4().hex
+    data = uuid.uuid4().bytes
+    ref = get_blob_store().put(data)
+    generation = {"prompt": "retrato repetido", "images": [ref], "timestamp": 1700000000.0, "model": "DALL-E 3"}
+    other = {**generation, "timestamp": 1700000001.0}
+
+    result = import_archive(make_archive([generation, generation, other], {ref: data}), user)
+
+    assert result["generations"] == 2 and result["skipped"] == 1
+    assert get_history_store().count(user) == 2
+
+    again = import_archive(make_archive([generation, other], {ref: data}), user)
+
+    assert again["generations"] == 0 and again["skipped"] == 2
+    assert get_history_store().count(user) == 2
+
+
+def test_import_rejects_refs_outside_the_blob_store():
+    user = uuid.uuid4().hex
+    escape = "../../../../../../../etc/hostname"
+    generation = {"prompt": "fora do armazenamento", "images": [escape], "timestamp": 1700000000.0}
+
+    result = import_archive(make_archive([generation], {"../x": b"dados"}), user)
+
+    assert result["generations"] == 0 and result["images"] == 0 and result["skipped"] == 2
+    assert get_history_store().count(user) == 0
+    assert not get_blob_store().exists(escape)
+
+
+def test_reimport_does_not_duplicate_saved_prompts():
+    user = uuid.uuid4().hex
+
+    first = import_archive(make_archive([], {}, ["retrato a óleo", "retrato a óleo", "aquarela"]), user)
+    again = import_archive(make_archive([], {}, ["aquarela", "carvão"]), user)
+
+    assert first["saved_prompts"] == 2 and again["saved_prompts"] == 1
+    assert sorted(get_history_store().saved_prompts(user)) == ["aquarela", "carvão", "retrato a óleo"]
+
+
+def test_new_export_path_removes_old_exports():
+    user = uuid.uuid4().hex
+    previous = new_export_path(user, "zip")
+    previous.write_bytes(b"antigo")
+    expired = previous.with_name(f"outro-{uuid.uuid4().hex}.tar")
+    expired.write_bytes(b"expirado")
+    old = time.time() - archive.EXPORT_TTL - 10
+    os.utime(expired, (old, old))
+    recent = previous.with_name(f"outro-{uuid.uuid4().hex}.zip")
+    recent.write_bytes(b"recente")
+
+    path = new_export_path(user, "tar")
+
+    assert path.suffix == ".tar" and path.name.startswith(f"{user}-")
+    assert not previous.exists() and not expired.exists()
+    assert recent.exists()
@@ -0,0 +1,272 @@
+"""
+Testes da API assíncrona de geração contra os servidores falsos dos provedores
+"""
+
+import asyncio
+import dataclasses
+import json
+import time
+import uuid
+
+import pytest
+
+from generators import async_generator, capabilities, scheduler
+from generators.async_generator import close_async_clients, generate_image_async, generate_image_sync
+from generators.batch import run_batch
+from generators.scheduler import GenerationScheduler, SchedulerTimeoutError
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+API_KEYS = {"openai": "stub-openai", "stability": "stub-stability", "replicate": "stub-replicate"}
+
+MODEL_PROVIDERS = {
+    "DALL-E 3": "openai",
+    "DALL-E 2": "openai",
+    "Stable Diffusion XL": "stability",
+    "Midjourney (Replicate)": "replicate",
+}
+
+
+def unique_prompt() -> str:
+    """Prompt que nunca está no cache nem em andamento em outro teste"""
+    return f"retrato de teste {uuid.uuid4().hex}"
+
+
+def generate(model: str, **kwargs):
+    """Executa uma geração em um event loop novo, fechando os clientes no fim"""
+
+    async def run():
+        try:
+            return await generate_image_async(
+                prompt=kwargs.pop("prompt", None) or unique_prompt(),
+                model=model,
+                api_key=kwargs.pop("api_key", API_KEYS[MODEL_PROVIDERS[model]]),
+                **kwargs
+            )
+        finally:
+            await close_async_clients()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("model", list(MODEL_PROVIDERS))
+def test_generates_with_each_model(stubs, model):
+    result = generate(model, num_images=2)
+
+    assert result["success"], result["error"]
+    assert len(result["images"]) == 2
+    assert all(image.startswith(PNG_SIGNATURE) for image in result["images"])
+
+
+def test_dalle_url_mode_downloads_images(stubs, monkeypatch):
+    monkeypatch.setitem(capabilities.RESPONSE_MODES, "openai", "url")
+
+    result = generate("DALL-E 2", num_images=3)
+
+    assert result["success"], result["error"]
+    assert len(result["images"]) == 3
+    assert result["images"][0] == stubs["openai"].png
+
+
+def test_stability_json_mode_decodes_artifacts(stubs, monkeypatch):
+    monkeypatch.setitem(capabilities.RESPONSE_MODES, "stability", "json")
+    before = stubs["stability"].stats()["requests"]
+
+    result = generate("Stable Diffusion XL", num_images=3)
+
+    assert result["success"], result["error"]
+    assert result["images"] == [stubs["stability"].png] * 3
+    # Em JSON as três imagens vêm em uma única chamada
+    assert stubs["stability"].stats()["requests"] - before == 1
+
+
+def test_single_image_model_is_split_into_calls(stubs):
+    before = stubs["openai"].stats()["requests"]
+
+    result = generate("DALL-E 3", num_images=3)
+
+    assert result["success"], result["error"]
+    assert len(result["images"]) == 3
+    assert stubs["openai"].stats()["requests"] - before == 3
+
+
+def test_repeated_request_comes_from_cache(stubs):
+    prompt = unique_prompt()
+    before = stubs["stability"].stats()["requests"]
+
+    first = generate("Stable Diffusion XL", prompt=prompt)
+    second = generate("Stable Diffusion XL", prompt=prompt)
+
+    assert first["success"] and not first.get("cached")
+    assert second.get("cached")
+    assert second["images"] == first["images"]
+    assert stubs["stability"].stats()["requests"] - before == 1
+
+
+def test_bypassing_cache_calls_provider_again(stubs):
+    prompt = unique_prompt()
+    before = stubs["stability"].stats()["requests"]
+
+    generate("Stable Diffusion XL", prompt=prompt)
+    result = generate("Stable Diffusion XL", prompt=prompt, use_cache=False)
+
+    assert result["success"] and not result.get("cached")
+    assert stubs["stability"].stats()["requests"] - before == 2
+
+
+def test_identical_concurrent_requests_share_one_call(stubs):
+    stubs["stability"].config = dataclasses.replace(stubs["stability"].config, latency=0.3)
+    prompt = unique_prompt()
+    before = stubs["stability"].stats()["requests"]
+
+    async def run():
+        try:
+            return await asyncio.gather(*[
+                generate_image_async(prompt, "Stable Diffusion XL", API_KEYS["stability"])
+                for _ in range(5)
+            ])
+        finally:
+            await close_async_clients()
+
+    results = asyncio.run(run())
+
+    assert all(result["success"] for result in results)
+    assert sum(bool(result.get("coalesced")) for result in results) == 4
+    assert stubs["stability"].stats()["requests"] - before == 1
+
+
+def test_requests_with_different_keys_are_not_coalesced(stubs):
+    stubs["stability"].config = dataclasses.replace(stubs["stability"].config, latency=0.3)
+    prompt = unique_prompt()
+    before = stubs["stability"].stats()["requests"]
+
+    async def run():
+        try:
+            return await asyncio.gather(
+                generate_image_async(prompt, "Stable Diffusion XL", "chave-a"),
+                generate_image_async(prompt, "Stable Diffusion XL", "chave-b"),
+            )
+        finally:
+            await close_async_clients()
+
+    results = asyncio.run(run())
+
+    assert not any(result.get("coalesced") for result in results)
+    assert stubs["stability"].stats()["requests"] - before == 2
+
+
+def test_provider_errors_are_retried_then_reported(stubs):
+    stubs["replicate"].config = dataclasses.replace(stubs["replicate"].config, error_rate=1.0)
+    before = stubs["replicate"].stats()["errors"]
+
+    result = generate("Midjourney (Replicate)")
+
+    assert not result["success"]
+    assert result["images"] == []
+    assert "Replicate" in result["error"]
+    assert stubs["replicate"].stats()["errors"] - before > 1
+
+
+def test_progress_events_follow_the_generation(stubs):
+    events = []
+
+    result = generate("Midjourney (Replicate)", num_images=2, progress_callback=events.append)
+
+    stages = [event["stage"] for event in events]
+    assert stages[0] == "queued"
+    assert "submitted" in stages and "polling" in stages and "downloaded" in stages
+    assert stages[-1] == "done" and events[-1]["result"] is result
+    progress = [event["progress"] for event in events]
+    assert progress == sorted(progress)
+
+
+def test_generations_wait_for_a_scheduler_slot(stubs, monkeypatch):
+    stubs["stability"].config = dataclasses.replace(stubs["stability"].config, latency=0.2)
+    limited = GenerationScheduler(max_concurrent=10, provider_limits={"stability": 1})
+    monkeypatch.setattr(scheduler, "_scheduler", limited)
+    queued = []
+
+    async def run():
+        try:
+            tasks = [
+                asyncio.ensure_future(generate_image_async(
+                    unique_prompt(), "Stable Diffusion XL", API_KEYS["stability"],
+                    progress_callback=lambda event: event.get("waiting") and queued.append(event)
+                ))
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0.1)
+            stats = limited.stats()["stability"]
+            return stats, await asyncio.gather(*tasks)
+        finally:
+            await close_async_clients()
+
+    stats, results = asyncio.run(run())
+
+    assert stats["running"] == 1 and stats["waiting"] == 2
+    assert all(result["success"] for result in results)
+    assert queued and queued[0]["message"].startswith("Na fila: posição")
+    assert limited.stats()["stability"] == {"running": 0, "waiting": 0, "limit": 1}
+
+
+def test_scheduler_slot_async_gives_up_after_max_wait():
+    limited = GenerationScheduler(max_concurrent=1, provider_limits={})
+
+    async def run():
+        async with limited.slot_async("openai"):
+            with pytest.raises(SchedulerTimeoutError):
+                async with limited.slot_async("openai", max_wait=0.05):
+                    pass
+        # A vaga que desistiu não fica presa na fila
+        async with limited.slot_async("openai", max_wait=0.05):
+            return limited.stats()["openai"]
+
+    assert asyncio.run(run()) == {"running": 1, "waiting": 0, "limit": None}
+
+
+def test_sync_wrapper_reuses_its_event_loop(stubs):
+    first = generate_image_sync(unique_prompt(), "DALL-E 2", API_KEYS["openai"])
+    second = generate_image_sync(unique_prompt(), "DALL-E 2", API_KEYS["openai"])
+
+    assert first["success"] and second["success"]
+    loop = async_generator._get_background_loop().loop
+    assert ("http", "") in async_generator._loop_clients[loop]
+
+
+def test_close_async_clients_closes_the_loop_clients(stubs):
+    async def run():
+        await generate_image_async(unique_prompt(), "DALL-E 2", API_KEYS["openai"])
+        loop = asyncio.get_running_loop()
+        client = async_generator._loop_clients[loop][("http", "")]
+        await close_async_clients()
+        return client, loop in async_generator._loop_clients
+
+    client, still_registered = asyncio.run(run())
+
+    assert client.is_closed
+    assert not still_registered
+
+
+def test_batch_runs_rows_concurrently_and_resumes(stubs, tmp_path):
+    stubs["stability"].config = dataclasses.replace(stubs["stability"].config, latency=0.3)
+    prompt_file = tmp_path / "prompts.jsonl"
+    rows = [{"prompt": unique_prompt(), "model": "Stable Diffusion XL"} for _ in range(4)]
+    prompt_file.write_text("\n".join(json.dumps(row) for row in rows), encoding="utf-8")
+    out = tmp_path / "saida"
+
+    started = time.perf_counter()
+    summary = run_batch(str(prompt_file), str(out), api_keys=API_KEYS, max_workers=4)
+    elapsed = time.perf_counter() - started
+
+    assert summary["succeeded"] == 4 and summary["failed"] == 0
+    # Quatro chamadas de 0.3s em paralelo, não uma depois da outra
+    assert elapsed < 1.0
+    manifest = [json.loads(line) for line in (out / "manifest.jsonl").read_text().splitlines()]
+    assert len(manifest) == 4
+    assert all((out / entry["files"][0]).read_bytes().startswith(PNG_SIGNATURE) for entry in manifest)
+
+    before = stubs["stability"].stats()["requests"]
+    resumed = run_batch(str(prompt_file), str(out), api_keys=API_KEYS, max_workers=4)
+
+    assert resumed["skipped"] == 4 and resumed["succeeded"] == 0
+    assert stubs["stability"].stats()["requests"] == before
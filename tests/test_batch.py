@@ -0,0 +1,59 @@
+"""
+Testes do lote: ids estáveis, retomada e arquivos gravados
+"""
+
+import json
+
+from generators import batch
+from generators.batch import load_prompt_file, run_batch
+
+JPEG_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 32
+
+
+def write_rows(path, rows):
+    path.write_text("\n".join(json.dumps(row) for row in rows), encoding="utf-8")
+
+
+def test_default_ids_do_not_depend_on_row_position(tmp_path):
+    prompt_file = tmp_path / "prompts.jsonl"
+    write_rows(prompt_file, [{"prompt": "a"}, {"prompt": "b"}])
+    before = {row["prompt"]: row["id"] for row in load_prompt_file(str(prompt_file))}
+
+    write_rows(prompt_file, [{"prompt": "novo"}, {"prompt": "a"}, {"prompt": "b"}])
+    after = {row["prompt"]: row["id"] for row in load_prompt_file(str(prompt_file))}
+
+    assert after["a"] == before["a"] and after["b"] == before["b"]
+
+
+def test_repeated_rows_get_distinct_ids(tmp_path):
+    prompt_file = tmp_path / "prompts.jsonl"
+    write_rows(prompt_file, [{"prompt": "a"}, {"prompt": "a"}, {"prompt": "a", "id": "x"}])
+
+    ids = [row["id"] for row in load_prompt_file(str(prompt_file))]
+
+    assert len(set(ids)) == 3 and ids[2] == "x"
+
+
+def test_partial_rows_are_retried_and_files_use_the_real_format(tmp_path, monkeypatch):
+    calls = []
+
+    async def fake_generate(**kwargs):
+        calls.append(kwargs["prompt"])
+        # Primeira execução: só uma das duas imagens
+        count = 1 if len(calls) == 1 else kwargs["num_images"]
+        return {"success": True, "images": [JPEG_BYTES] * count, "error": None}
+
+    monkeypatch.setattr(batch, "generate_image_async", fake_generate)
+    prompt_file = tmp_path / "prompts.jsonl"
+    write_rows(prompt_file, [{"prompt": "a", "num_images": 2}])
+    out = tmp_path / "saida"
+
+    first = run_batch(str(prompt_file), str(out), api_keys={})
+    second = run_batch(str(prompt_file), str(out), api_keys={})
+
+    assert first["partial"] == 1 and first["succeeded"] == 0
+    assert second["skipped"] == 0 and second["succeeded"] == 1
+    manifest = [json.loads(line) for line in (out / "manifest.jsonl").read_text().splitlines()]
+    assert [entry["status"] for entry in manifest] == ["partial", "success"]
+    assert all(name.endswith(".jpg") for name in manifest[1]["files"])
+    assert (out / manifest[1]["files"][0]).read_bytes() == JPEG_BYTES
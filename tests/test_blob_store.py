@@ -0,0 +1,82 @@
+"""
+Testes do armazenamento de imagens: cotas sob concorrência e limpeza
+"""
+
+import os
+import threading
+
+from utils import thumbnails
+from utils.blob_store import BlobStore, QuotaExceededError
+from utils.paths import get_data_dir
+from utils.transcode import _variant_path
+
+
+def test_concurrent_puts_never_exceed_the_session_quota(tmp_path):
+    store = BlobStore(root=tmp_path, session_quota=10 * 1024, global_quota=10 ** 9)
+    barrier = threading.Barrier(16)
+    rejected = []
+
+    def put(i):
+        barrier.wait()
+        try:
+            store.put(bytes([i]) * 1024, session_id="sessao")
+        except QuotaExceededError:
+            rejected.append(i)
+
+    threads = [threading.Thread(target=put, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.session_bytes("sessao") == 10 * 1024
+    assert len(rejected) == 6
+
+
+def test_concurrent_puts_never_exceed_the_global_quota(tmp_path):
+    store = BlobStore(root=tmp_path, global_quota=8 * 1024)
+    # Tudo referenciado: a limpeza não pode liberar espaço
+    store.add_ref_source(lambda: list(store._sizes))
+    barrier = threading.Barrier(16)
+
+    def put(i):
+        barrier.wait()
+        try:
+            store.put(bytes([i]) * 1024, session_id=f"sessao-{i}")
+        except QuotaExceededError:
+            pass
+
+    threads = [threading.Thread(target=put, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.total_bytes == 8 * 1024
+    assert sum(path.stat().st_size for path in tmp_path.glob("*/*")) == 8 * 1024
+
+
+def test_cleanup_removes_thumbnails_and_transcoded_variants(tmp_path):
+    store = BlobStore(root=tmp_path)
+    ref = store.put(b"imagem orfa")
+    kept = store.put(b"imagem mantida", session_id="sessao")
+
+    derived = [
+        get_data_dir("thumbnails") / thumbnails._thumbnail_key(ref),
+        get_data_dir("thumbnails") / f"{ref}-128-50.jpeg",
+        _variant_path(ref, "WEBP"),
+        _variant_path(ref, "JPEG"),
+    ]
+    kept_thumbnail = get_data_dir("thumbnails") / thumbnails._thumbnail_key(kept)
+    for path in derived + [kept_thumbnail]:
+        path.write_bytes(b"derivado")
+    with thumbnails._lock:
+        thumbnails._remember(thumbnails._thumbnail_key(ref), b"derivado")
+
+    assert store.cleanup_orphans(grace_seconds=-1) == 1
+
+    assert not store.exists(ref)
+    assert not any(path.exists() for path in derived)
+    assert thumbnails._thumbnail_key(ref) not in thumbnails._memory
+    assert kept_thumbnail.exists() and store.exists(kept)
+    assert os.path.exists(store.path(kept))
@@ -0,0 +1,55 @@
+"""
+Testes do cache de resultados: as imagens ficam só no armazenamento por conteúdo
+"""
+
+import json
+import uuid
+
+from generators.cache import META_FILE, ResultCache
+from utils.blob_store import BlobStore
+
+
+def make_cache(tmp_path, **kwargs):
+    blobs = BlobStore(root=tmp_path / "blobs")
+    return ResultCache(root=tmp_path / "cache", blobs=blobs, **kwargs), blobs
+
+
+def test_cached_images_are_blob_refs_not_copies(tmp_path):
+    cache, blobs = make_cache(tmp_path)
+    images = [uuid.uuid4().bytes * 64, uuid.uuid4().bytes * 64]
+    # A mesma imagem já está no histórico
+    history_ref = blobs.put(images[0], session_id="sessao")
+
+    cache.put("chave", {"success": True, "images": images, "error": None})
+
+    entry_dir = tmp_path / "cache" / "chave"
+    assert [path.name for path in entry_dir.iterdir()] == [META_FILE]
+    refs = json.loads((entry_dir / META_FILE).read_text())["refs"]
+    assert refs[0] == history_ref
+    assert blobs.stats()["blobs"] == 2
+
+    result = cache.get("chave")
+    assert result["cached"] and result["images"] == images
+
+
+def test_cleanup_keeps_cached_blobs_and_reload_keeps_entries(tmp_path):
+    cache, blobs = make_cache(tmp_path)
+    image = uuid.uuid4().bytes * 64
+    cache.put("chave", {"success": True, "images": [image], "error": None})
+
+    assert blobs.cleanup_orphans(grace_seconds=-1) == 0
+
+    reloaded = ResultCache(root=tmp_path / "cache", blobs=blobs)
+    assert reloaded.get("chave")["images"] == [image]
+
+
+def test_missing_blob_is_a_miss(tmp_path):
+    cache, blobs = make_cache(tmp_path)
+    image = uuid.uuid4().bytes * 64
+    cache.put("chave", {"success": True, "images": [image], "error": None})
+    cache.clear()
+    cache.put("outra", {"success": True, "images": [image], "error": None})
+    blobs.path(cache._index["outra"][2][0]).unlink()
+
+    assert cache.get("outra") is None
+    assert not cache.contains("outra")
@@ -0,0 +1,78 @@
+"""
+Testes do histórico persistente e do índice de busca compartilhado por usuário
+"""
+
+from utils.history_search import HistorySearch
+from utils.history_store import HistoryStore
+from utils.session_state import USER_ID_PATTERN, new_user_id
+
+
+def generation(prompt, timestamp, model="DALL-E 3", images=None):
+    return {
+        "prompt": prompt,
+        "images": images or [f"ref-{timestamp}"],
+        "timestamp": timestamp,
+        "model": model,
+        "parameters": {"quality": "hd", "size": "1024x1024", "style": "vivid"},
+    }
+
+
+def test_flush_waits_only_for_the_users_own_writes(tmp_path):
+    store = HistoryStore(path=tmp_path / "history.db", batch_size=1)
+    store.add_generation("ana", generation("retrato", 1.0))
+    for i in range(2000):
+        store.add_generation("bruno", generation(f"outro {i}", 2.0 + i))
+
+    store.flush("ana")
+
+    assert store.count("ana") == 1
+    # As escritas do outro usuário, depois das dela na fila, não foram esperadas
+    assert store._pending.get("bruno", 0) > 0
+    store.flush()
+    assert not store._pending
+
+
+def test_search_index_covers_recent_generations_and_follows_new_ones(tmp_path):
+    store = HistoryStore(path=tmp_path / "history.db")
+    for i in range(5):
+        store.add_generation("ana", generation(f"astronauta numero{i}", 10.0 + i))
+    store.add_generation("bruno", generation("astronauta de outro usuario", 20.0))
+    search = HistorySearch("ana", store=store, limit=3)
+
+    refs = search.sync()
+
+    assert refs == ["ref-12.0", "ref-13.0", "ref-14.0"]
+    results = search.search("astronauta")
+    assert [number for _, number in results] == [5, 4, 3]
+    generations = store.generations_by_id("ana", [generation_id for generation_id, _ in results])
+    assert [g["prompt"] for g in generations] == ["astronauta numero4", "astronauta numero3", "astronauta numero2"]
+
+    store.add_generation("ana", generation("gato astronauta", 30.0, model="DALL-E 2"))
+    assert search.sync() == ["ref-30.0"]
+    assert [number for _, number in search.search("gato")] == [6]
+    assert search.values("model") == ["DALL-E 2", "DALL-E 3"]
+    assert search.newest_with_image("ref-30.0") == 30.0
+
+
+def test_search_index_is_rebuilt_after_clear_and_older_imports(tmp_path):
+    store = HistoryStore(path=tmp_path / "history.db")
+    store.add_generation("ana", generation("retrato antigo", 10.0))
+    search = HistorySearch("ana", store=store)
+    search.sync()
+
+    # Geração importada com data anterior às já indexadas
+    store.add_generation("ana", generation("retrato importado", 5.0))
+    search.sync()
+    assert [number for _, number in search.search("retrato")] == [2, 1]
+
+    store.clear_user("ana")
+    search.sync()
+    assert search.search("retrato") == []
+
+
+def test_generated_user_ids_are_unguessable_tokens():
+    user_ids = {new_user_id() for _ in range(100)}
+
+    assert len(user_ids) == 100
+    assert all(USER_ID_PATTERN.fullmatch(user_id) for user_id in user_ids)
+    assert not USER_ID_PATTERN.fullmatch("ana")
@@ -0,0 +1,35 @@
+"""
+Testes dos hashes perceptuais: cálculo em segundo plano, sem esperar
+"""
+
+import time
+
+from utils import image_hash
+from utils.blob_store import get_blob_store
+from utils.image_hash import get_hashes, hashes_pending
+
+
+def wait_until_ready(ref: str, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while hashes_pending(ref) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_missing_hashes_are_computed_in_background(stubs):
+    ref = get_blob_store().put(stubs["stability"].png)
+
+    first = get_hashes(ref)
+
+    assert first is not None or hashes_pending(ref)
+    wait_until_ready(ref)
+    assert get_hashes(ref) is not None
+
+
+def test_unreadable_image_is_not_rescheduled():
+    ref = get_blob_store().put(b"isto nao e uma imagem " + str(time.time()).encode())
+
+    assert get_hashes(ref) is None
+    wait_until_ready(ref)
+
+    assert ref in image_hash._failed
+    assert get_hashes(ref) is None and not hashes_pending(ref)
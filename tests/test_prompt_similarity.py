@@ -0,0 +1,61 @@
+"""
+Testes do índice de prompts quase iguais
+"""
+
+from generators.prompt_similarity import PromptIndex
+
+PARAMETERS = {"quality": "standard", "size": "1024x1024", "style": "vivid"}
+
+
+def test_similar_prompts_are_only_offered_to_their_owner(tmp_path):
+    index = PromptIndex(path=tmp_path / "prompts.jsonl")
+    index.add("retrato de uma astronauta sorrindo", "DALL-E 3", PARAMETERS, ["ref-a"], owner="ana")
+    index.add("retrato de uma astronauta sorrindo", "DALL-E 3", PARAMETERS, ["ref-b"], owner="bruno")
+
+    matches = index.find_similar("Sorrindo, retrato de uma astronauta!", model="DALL-E 3", owner="ana")
+
+    assert [match["images"] for match in matches] == [["ref-a"]]
+    assert matches[0]["owner"] == "ana"
+    assert index.find_similar("retrato de uma astronauta sorrindo", owner="carla") == []
+
+
+def test_owner_survives_reload_and_entries_without_owner_are_not_offered(tmp_path):
+    path = tmp_path / "prompts.jsonl"
+    index = PromptIndex(path=path)
+    index.add("gato astronauta no espaço", "DALL-E 2", PARAMETERS, ["ref-a"], owner="ana")
+    index.add("gato astronauta no espaço", "DALL-E 2", PARAMETERS, ["ref-antiga"])
+
+    reloaded = PromptIndex(path=path)
+
+    assert [match["images"] for match in reloaded.find_similar("gato astronauta no espaço", owner="ana")] == [["ref-a"]]
+    assert len(reloaded.find_similar("gato astronauta no espaço")) == 2
+
+
+def test_parameter_and_image_filters_run_before_the_limit(tmp_path):
+    index = PromptIndex(path=tmp_path / "prompts.jsonl")
+    hd = {**PARAMETERS, "quality": "hd"}
+    prompt = "farol na tempestade ao entardecer"
+    for model in ("DALL-E 3", "DALL-E 2", "Stable Diffusion XL"):
+        index.add(prompt, model, hd, ["ref-hd-a", "ref-hd-b"], owner="ana")
+    index.add(prompt, "DALL-E 3", PARAMETERS, ["ref-1"], owner="ana")
+    index.add(prompt + " antigo", "DALL-E 3", PARAMETERS, ["ref-2a", "ref-2b"], owner="ana")
+
+    matches = index.find_similar(prompt, owner="ana", parameters=PARAMETERS, limit=1)
+    pairs = index.find_similar(prompt, owner="ana", parameters=PARAMETERS, min_images=2)
+
+    assert [match["images"] for match in matches] == [["ref-1"]]
+    assert [match["images"] for match in pairs] == [["ref-2a", "ref-2b"]]
+
+
+def test_oldest_entries_are_evicted_first(tmp_path):
+    index = PromptIndex(path=tmp_path / "prompts.jsonl", max_entries=2)
+    index.add("barco a vela no porto", "DALL-E 3", PARAMETERS, ["ref-barco"], owner="ana")
+    index.add("cidade futurista à noite", "DALL-E 3", PARAMETERS, ["ref-cidade"], owner="ana")
+    # Registrar de novo torna a entrada a mais recente
+    index.add("barco a vela no porto", "DALL-E 3", PARAMETERS, ["ref-barco-2"], owner="ana")
+    index.add("floresta com neblina", "DALL-E 3", PARAMETERS, ["ref-floresta"], owner="ana")
+
+    assert len(index) == 2
+    assert index.find_similar("cidade futurista à noite") == []
+    assert [match["images"] for match in index.find_similar("barco a vela no porto")] == [["ref-barco-2"]]
+    assert len(PromptIndex(path=tmp_path / "prompts.jsonl", max_entries=2)) == 2
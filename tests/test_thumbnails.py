@@ -0,0 +1,38 @@
+"""
+Testes das miniaturas da galeria: criação em segundo plano, sem esperar
+"""
+
+import time
+import uuid
+
+from utils import thumbnails
+from utils.thumbnails import get_thumbnail, thumbnail_pending
+
+
+def wait_until_ready(image_key: str, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while thumbnail_pending(image_key) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_cache_miss_returns_none_and_creates_thumbnail_in_background(stubs):
+    image = stubs["stability"].png
+    image_key = uuid.uuid4().hex
+
+    assert get_thumbnail(image, image_key) is None
+
+    wait_until_ready(image_key)
+    thumbnail = get_thumbnail(image, image_key)
+    assert thumbnail is not None and thumbnail != image
+
+
+def test_failed_thumbnail_falls_back_to_original_image():
+    image = b"isto nao e uma imagem"
+    image_key = uuid.uuid4().hex
+
+    assert get_thumbnail(image, image_key) is None
+
+    wait_until_ready(image_key)
+    assert get_thumbnail(image, image_key) == image
+    assert not thumbnail_pending(image_key)
+    assert thumbnails._thumbnail_key(image_key) in thumbnails._failed